@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from core.utils import parse_json, parse_sql_from_string, add_prefix, load_json_file, extract_world_info, is_email, is_valid_date_column
+from core.utils import parse_json, parse_sql_from_string, add_prefix, load_json_file, extract_world_info, is_valid_date_column
+from core.utils import sql_block_closed, decomposition_solved, json_object_closed
 from func_timeout import func_set_timeout, FunctionTimedOut
 
 LLM_API_FUC = None
@@ -14,20 +15,27 @@ except:
     print(f"Use func from core.llm in agents.py")
 
 from core.const import *
+from core.metrics import get_metrics
+from core.db_profile_cache import get_profile_cache, make_schema_key
+from core.db_loader import load_db_infos
+from core.value_profiler import profile_table, ColumnProfile, MAX_NUMERIC_DISTINCT, MAX_TEXT_LENGTH
+from core.token_budget import count_units, max_units, get_token_budget, plan_trim, tokenizer_name
+from core import schema_index
+from core import join_graph
+from core.selector_cache import get_selector_cache, make_version, make_decision_key
 from typing import List
-from copy import deepcopy
 
 import sqlite3
+import json
 import time
 import abc
 import sys
 import os
 import glob
 import pandas as pd
-from tqdm import tqdm, trange
+from tqdm import tqdm
 from pprint import pprint
 import pdb
-import tiktoken
 
 
 class BaseAgent(metaclass=abc.ABCMeta):
@@ -48,12 +56,22 @@ class Selector(BaseAgent):
 
     def __init__(self, data_path: str, tables_json_path: str, model_name: str, dataset_name:str, lazy: bool = True, without_selector: bool = False):
         super().__init__()
-        self.data_path = data_path.strip('/').strip('\\')
+        self.data_path = data_path.rstrip('/').rstrip('\\')
         self.tables_json_path = tables_json_path
         self.model_name = model_name
         self.dataset_name = dataset_name
         self.db2infos = {}  # summary of db (stay in the memory during generating prompt)
         self.db2dbjsons = {} # store all db to tables.json dict by tables_json_path
+        self.db2indexes = {}  # lexical schema index per db, built on first use (SCHEMA_INDEX=1)
+        self.db2joingraphs = {}  # foreign key join graph per db, built on first use (SELECTOR_JOIN_PATHS=1)
+        self.db2fragments = {}  # rendered schema text per db, built on first use
+        # two-phase schema: value examples are profiled only for the columns a question shows (SELECTOR_LAZY_VALUES=1)
+        self.lazy_values = os.getenv("SELECTOR_LAZY_VALUES", "0") == "1"
+        if self.lazy_values and get_token_budget(model_name) is not None:
+            # the budget decision counts value example tokens, which lazy profiling only knows after the decision
+            print(f"SELECTOR_LAZY_VALUES is ignored: a schema token budget is set for {model_name}")
+            self.lazy_values = False
+        self._column_meanings = None
         self.init_db2jsons()
         if not lazy:
             self._load_all_db_info()
@@ -134,12 +152,10 @@ class Selector(BaseAgent):
 
         key_col_list = [json_column_names[i] for i, flag in enumerate(is_key_column_lst) if flag]
 
-        len_column_names = len(column_names)
-
+        # columns that need value examples; pk, fk and id/email/url-like columns get none
+        profiled_names = []
+        profiled_types = []
         for idx, column_name in enumerate(column_names):
-            # 查询每列的 distinct value, 从指定的表中选择指定列的值，并按照该列的值进行分组。然后按照每个分组中的记录数量进行降序排序。
-            # print(f"In _get_unique_column_values_str, processing column: {idx}/{len_column_names} col_name: {column_name} of table: {table}", flush=True)
-
             # skip pk and fk
             if column_name in key_col_list:
                 continue
@@ -153,15 +169,17 @@ class Selector(BaseAgent):
                 col_to_values_str_dict[column_name] = values_str
                 continue
 
-            sql = f"SELECT `{column_name}` FROM `{table}` GROUP BY `{column_name}` ORDER BY COUNT(*) DESC"
-            cursor.execute(sql)
-            values = cursor.fetchall()
-            values = [value[0] for value in values]
+            profiled_names.append(column_name)
+            profiled_types.append(column_types[idx])
 
+        # One aggregate pass over the table decides the columns it can; SQLite groups the rest and returns only their top values
+        profiles = profile_table(cursor, table, profiled_names, profiled_types,
+                                 strip=(self.dataset_name == 'spider'))
+        for column_name, profile in profiles.items():
             values_str = ''
             # try to get value examples str, if exception, just use empty str
             try:
-                values_str = self._get_value_examples_str(values, column_types[idx])
+                values_str = self._get_value_examples_str(profile)
             except Exception as e:
                 print(f"\nerror: get_value_examples_str failed, Exception:\n{e}\n")
 
@@ -182,7 +200,6 @@ class Selector(BaseAgent):
                 values_str = col_to_values_str_dict[column_name]
             else:
                 print(col_to_values_str_dict)
-                time.sleep(3)
                 print(f"error: column_name: {column_name} not found in col_to_values_str_dict")
             
             col_to_values_str_lst.append([column_name, values_str])
@@ -191,57 +208,29 @@ class Selector(BaseAgent):
     
 
     # 这个地方需要精细化处理
-    def _get_value_examples_str(self, values: List[object], col_type: str):
-        if not values:
+    def _get_value_examples_str(self, profile: ColumnProfile):
+        # whole-column checks come from the profile, so only the top values are needed
+        if profile.rows == 0:
             return ''
-        if len(values) > 10 and col_type in ['INTEGER', 'REAL', 'NUMERIC', 'FLOAT', 'INT']:
+        if profile.is_numeric and profile.cardinality() > MAX_NUMERIC_DISTINCT:
+            return ''
+        if profile.is_text and (profile.has_url or profile.has_email or profile.max_length > MAX_TEXT_LENGTH):
             return ''
         
+        has_null = profile.nulls > 0
         vals = []
-        has_null = False
-        for v in values:
+        for v in profile.top_values():
             if v is None:
-                has_null = True
-            else:
-                tmp_v = str(v).strip()
-                if tmp_v == '':
-                    continue
-                else:
-                    vals.append(v)
-        if not vals:
-            return ''
-        
-        # drop meaningless values
-        if col_type in ['TEXT', 'VARCHAR']:
-            new_values = []
-            
-            for v in vals:
-                if not isinstance(v, str):
-                    
-                    new_values.append(v)
-                else:
-                    if self.dataset_name == 'spider':
-                        v = v.strip()
-                    if v == '': # exclude empty string
-                        continue
-                    elif ('https://' in v) or ('http://' in v): # exclude url
-                        return ''
-                    elif is_email(v): # exclude email
-                        return ''
-                    else:
-                        new_values.append(v)
-            vals = new_values
-            tmp_vals = [len(str(a)) for a in vals]
-            if not tmp_vals:
-                return ''
-            max_len = max(tmp_vals)
-            if max_len > 50:
-                return ''
-        
+                continue
+            if self.dataset_name == 'spider' and profile.is_text and isinstance(v, str):
+                v = v.strip()
+            if str(v).strip() == '':
+                continue
+            vals.append(v)
+            if len(vals) == 6:
+                break
         if not vals:
             return ''
-        
-        vals = vals[:6]
 
         is_date_column = is_valid_date_column(vals)
         if is_date_column:
@@ -254,11 +243,36 @@ class Selector(BaseAgent):
         return val_str
     
     def _load_single_db_info(self, db_id: str) -> dict:
+        # Profiles are persisted per database and rebuilt only when the sqlite file or its tables.json entry changes
+        db_path = f"{self.data_path}/{db_id}/{db_id}.sqlite"
+        cache = get_profile_cache()
+        if self.lazy_values:
+            # two-phase mode: a complete cached profile is still used, otherwise values are profiled on demand
+            db_info = cache.load(db_id, db_path, self._profile_schema_key(db_id)) if cache is not None else None
+            if db_info is None:
+                return self._build_schema_db_info(db_id)
+        elif cache is None:
+            return self._build_single_db_info(db_id)
+        else:
+            db_info = cache.get_or_build(db_id, db_path, self._profile_schema_key(db_id), lambda: self._build_single_db_info(db_id))
+        # JSON has no tuples; restore the (from_col, to_table, to_col) foreign key triples
+        db_info["fk_dict"] = {tb: [tuple(fk) for fk in fks] for tb, fks in db_info["fk_dict"].items()}
+        return db_info
+
+    def _profile_schema_key(self, db_id: str) -> str:
+        return make_schema_key(self.db2dbjsons[db_id], self.dataset_name, type(self).__name__, tokenizer_name())
+
+    def _build_schema_db_info(self, db_id: str) -> dict:
+        """
+        Phase one of the db info: names, descriptions and keys from tables.json, no value examples.
+        The columns that get value examples are listed in "pending_values" until they are profiled.
+        """
         table2coldescription = {} # Dict {table_name: [(column_name, full_column_name, column_description), ...]}
         table2primary_keys = {} # DIct {table_name: [primary_key_column_name,...]}
         
         table_foreign_keys = {} # Dict {table_name: [(from_col, to_table, to_col), ...]}
         table_unique_column_values = {} # Dict {table_name: [(column_name, examples_values_str)]}
+        table_pending_values = {} # Dict {table_name: [column_name, ...]} columns whose value examples are not profiled yet
 
         db_dict = self.db2dbjsons[db_id]
 
@@ -271,30 +285,20 @@ class Selector(BaseAgent):
             else:
                 important_key_id_lst.append(col_id)
 
-
-        db_path = f"{self.data_path}/{db_id}/{db_id}.sqlite"
-        conn = sqlite3.connect(db_path)
-        conn.text_factory = lambda b: b.decode(errors="ignore")  # avoid gbk/utf8 error, copied from sql-eval.exec_eval
-        cursor = conn.cursor()
-
         table_names_original_lst = db_dict['table_names_original']
+        all_column_names_original_lst = db_dict['column_names_original']
         for tb_idx, tb_name in enumerate(table_names_original_lst):
             # 遍历原始列名
-            all_column_names_original_lst = db_dict['column_names_original']
-            
             all_column_names_full_lst = db_dict['column_names']
             col2dec_lst = []
+            pending_lst = []
 
-            pure_column_names_original_lst = []
-            is_key_column_lst = []
             for col_idx, (root_tb_idx, orig_col_name) in enumerate(all_column_names_original_lst):
                 if root_tb_idx != tb_idx:
                     continue
-                pure_column_names_original_lst.append(orig_col_name)
-                if col_idx in important_key_id_lst:
-                    is_key_column_lst.append(True)
-                else:
-                    is_key_column_lst.append(False)
+                # pk and fk get no value examples
+                if col_idx not in important_key_id_lst:
+                    pending_lst.append(orig_col_name)
                 full_col_name: str = all_column_names_full_lst[col_idx][1]
                 full_col_name = full_col_name.replace('_', ' ')
                 cur_desc_obj = [orig_col_name, full_col_name, '']
@@ -302,13 +306,9 @@ class Selector(BaseAgent):
             table2coldescription[tb_name] = col2dec_lst
             
             table_foreign_keys[tb_name] = []
-            table_unique_column_values[tb_name] = []
+            table_unique_column_values[tb_name] = [[col_name, ''] for col_name, _, _ in col2dec_lst]
             table2primary_keys[tb_name] = []
-
-            # column_names, column_types
-            all_sqlite_column_names_lst, all_sqlite_column_types_lst = self._get_column_attributes(cursor, tb_name)
-            col_to_values_str_lst = self._get_unique_column_values_str(cursor, tb_name, all_sqlite_column_names_lst, all_sqlite_column_types_lst, pure_column_names_original_lst, is_key_column_lst)
-            table_unique_column_values[tb_name] = col_to_values_str_lst
+            table_pending_values[tb_name] = pending_lst
         
         # table_foreign_keys 处理起来麻烦一些
         foreign_keys_lst = db_dict['foreign_keys']
@@ -342,29 +342,180 @@ class Selector(BaseAgent):
                 col_name = all_column_names_original_lst[cur_pk_idx][1]
                 tb_name = table_names_original_lst[tb_idx]
                 table2primary_keys[tb_name].append(col_name)
-        
-        cursor.close()
-        # print table_name and primary keys
-        # for tb_name, pk_keys in table2primary_keys.items():
-        #     print(f"table_name: {tb_name}; primary key: {pk_keys}")
-        time.sleep(3)
 
         # wrap result and return
         result = {
             "desc_dict": table2coldescription,
             "value_dict": table_unique_column_values,
             "pk_dict": table2primary_keys,
-            "fk_dict": table_foreign_keys
+            "fk_dict": table_foreign_keys,
+            "pending_values": table_pending_values
         }
+        result["token_dict"] = self._count_schema_tokens(result)
+        return result
+
+    def _build_single_db_info(self, db_id: str) -> dict:
+        result = self._build_schema_db_info(db_id)
+        pending_values = result.pop("pending_values")
+
+        db_path = f"{self.data_path}/{db_id}/{db_id}.sqlite"
+        conn = sqlite3.connect(db_path)
+        conn.text_factory = lambda b: b.decode(errors="ignore")  # avoid gbk/utf8 error, copied from sql-eval.exec_eval
+        cursor = conn.cursor()
+
+        for tb_name, col2dec_lst in result["desc_dict"].items():
+            pure_column_names_original_lst = [col_name for col_name, _, _ in col2dec_lst]
+            is_key_column_lst = [col_name not in pending_values[tb_name] for col_name in pure_column_names_original_lst]
+
+            # column_names, column_types
+            all_sqlite_column_names_lst, all_sqlite_column_types_lst = self._get_column_attributes(cursor, tb_name)
+            col_to_values_str_lst = self._get_unique_column_values_str(cursor, tb_name, all_sqlite_column_names_lst, all_sqlite_column_types_lst, pure_column_names_original_lst, is_key_column_lst)
+            result["value_dict"][tb_name] = col_to_values_str_lst
+        
+        cursor.close()
+        conn.close()
+
+        result["token_dict"] = self._count_schema_tokens(result)
         return result
 
-    def _load_all_db_info(self):
+    def _profile_pending_values(self, db_id: str, columns: dict) -> None:
+        """
+        Phase two of the db info: profile the value examples of some columns.
+        The value_dict, token_dict and rendered fragments of the db are updated in place and its schema
+        index is dropped so the next search sees the new values; once every
+        column is profiled the db info is stored in the profile cache like an eagerly built one.
+        :param columns: {table_name: [column_name, ..]} columns about to be shown
+        """
+        db_info = self.db2infos[db_id]
+        pending_values = db_info.get('pending_values')
+        if not pending_values:
+            return
+        requested = {tb: [col for col in pending_values.get(tb, []) if col in cols] for tb, cols in columns.items()}
+        requested = {tb: cols for tb, cols in requested.items() if cols}
+        if not requested:
+            return
+
+        db_path = f"{self.data_path}/{db_id}/{db_id}.sqlite"
+        conn = sqlite3.connect(db_path)
+        conn.text_factory = lambda b: b.decode(errors="ignore")  # avoid gbk/utf8 error, copied from sql-eval.exec_eval
+        cursor = conn.cursor()
+        fragments = self._get_fragments(db_id)
+        try:
+            for tb_name, cols in requested.items():
+                all_sqlite_column_names_lst, all_sqlite_column_types_lst = self._get_column_attributes(cursor, tb_name)
+                # only the requested columns are scanned
+                sqlite_cols = [(name, col_type) for name, col_type in zip(all_sqlite_column_names_lst, all_sqlite_column_types_lst) if name in cols]
+                col_to_values_str_lst = self._get_unique_column_values_str(cursor, tb_name, [name for name, _ in sqlite_cols], [col_type for _, col_type in sqlite_cols], cols, [False] * len(cols))
+                values = dict(col_to_values_str_lst)
+
+                for idx, (col_name, full_col_name, col_extra_desc) in enumerate(db_info['desc_dict'][tb_name]):
+                    if col_name not in values:
+                        continue
+                    db_info['value_dict'][tb_name][idx] = [col_name, values[col_name]]
+                    line = self._build_bird_column_line_str(col_name, full_col_name, col_extra_desc, values[col_name])
+                    fragments[tb_name]['columns'][idx] = (line, fragments[tb_name]['columns'][idx][1])
+                    is_last = idx == len(db_info['desc_dict'][tb_name]) - 1
+                    db_info['token_dict'][tb_name]['columns'][idx] = self._count_column_line(line, fragments[tb_name]['columns'][idx][1], is_last)
+                pending_values[tb_name] = [col for col in pending_values[tb_name] if col not in values]
+        finally:
+            cursor.close()
+            conn.close()
+
+        # the schema index was built without these values; rebuild it with them on next use
+        self.db2indexes.pop(db_id, None)
+
+        if not any(pending_values.values()):
+            del db_info['pending_values']
+            cache = get_profile_cache()
+            if cache is not None:
+                try:
+                    cache.save(db_id, db_path, self._profile_schema_key(db_id), db_info)
+                except (OSError, TypeError, ValueError) as e:
+                    print(f"Could not cache profile of {db_id}: {e}")
+
+    def _count_schema_tokens(self, db_info: dict) -> dict:
+        """
+        Precompute the size (core.token_budget.count_units) of every piece of the full schema prompt,
+        so the pruning decision needs no tokenizer at question time. The pieces are cut right after
+        newlines exactly as _get_db_desc_str joins them, so they add up to the size of desc_str + '\n' + fk_str.
+        :return: {table_name: {"table": header and brackets, "columns": [[line, line_without_values], ..],
+                               "fk": the table's new foreign key lines}}
+        """
+        token_dict = {}
+        fragments = self._render_fragments(db_info)
+        seen_fk = {}
+        for fragment in fragments.values():
+            for fk_link_str in fragment['fk']:
+                seen_fk[fk_link_str] = None
+        last_fk = list(seen_fk)[-1] if seen_fk else None
+        seen_fk = set()
+        for table_name, fragment in fragments.items():
+            columns = fragment['columns']
+            if columns:
+                table_units = count_units(fragment['header'] + '[\n') + count_units(']\n')
+            else:
+                table_units = count_units(fragment['header'] + '[\n\n]\n')
+            fk_units = 0
+            for fk_link_str in fragment['fk']:
+                if fk_link_str not in seen_fk:
+                    seen_fk.add(fk_link_str)
+                    # fk_str is stripped, the last line has no newline
+                    fk_units += count_units(fk_link_str if fk_link_str == last_fk else fk_link_str + '\n')
+            token_dict[table_name] = {
+                "table": table_units,
+                "columns": [self._count_column_line(line, line_without_values, idx == len(columns) - 1)
+                            for idx, (line, line_without_values) in enumerate(columns)],
+                "fk": fk_units
+            }
+        return token_dict
+
+    def _count_column_line(self, line: str, line_without_values: str, is_last: bool) -> list:
+        # the last line of a table loses its trailing comma to .strip(',')
+        if is_last:
+            line, line_without_values = line.rstrip(','), line_without_values.rstrip(',')
+        return [count_units(line + '\n'), count_units(line_without_values + '\n')]
+
+    def _render_fragments(self, db_info: dict) -> dict:
+        """
+        Render the prompt text of every table header, column line and foreign key of a db once.
+        :return: {table_name: {"header": str, "columns": [(line, line_without_values), ..],
+                               "column_names": [str, ..], "keys": {pk and fk column names}, "fk": [fk_link_str, ..]}}
+        """
+        fragments = {}
+        for table_name, columns_desc in db_info['desc_dict'].items():
+            columns_val = db_info['value_dict'][table_name]
+            fk_links = []
+            for col_name, to_table, to_col in db_info['fk_dict'][table_name]:
+                if '`' not in str(col_name):
+                    col_name = f"`{col_name}`"
+                if '`' not in str(to_col):
+                    to_col = f"`{to_col}`"
+                fk_links.append(f"{table_name}.{col_name} = {to_table}.{to_col}")
+            fragments[table_name] = {
+                "header": f"# Table: {table_name}\n",
+                "columns": [(self._build_bird_column_line_str(col_name, full_col_name, col_extra_desc, col_values_str),
+                             self._build_bird_column_line_str(col_name, full_col_name, col_extra_desc, ''))
+                            for (col_name, full_col_name, col_extra_desc), (_, col_values_str) in zip(columns_desc, columns_val)],
+                "column_names": [col_name for col_name, _, _ in columns_desc],
+                "keys": set(db_info['pk_dict'][table_name]) | {col_name for col_name, _, _ in db_info['fk_dict'][table_name]},
+                "fk": fk_links
+            }
+        return fragments
+
+    def _get_fragments(self, db_id: str) -> dict:
+        # rendered once per db; rebuilt if the db info object is replaced
+        db_info = self.db2infos[db_id]
+        cached = self.db2fragments.get(db_id)
+        if cached is None or cached[0] is not db_info:
+            cached = self.db2fragments[db_id] = (db_info, self._render_fragments(db_info))
+        return cached[1]
+
+    def _load_all_db_info(self, workers: int = None):
         print("\nLoading all database info...", file=sys.stdout, flush=True)
-        db_ids = [item for item in os.listdir(self.data_path)]
-        for i in trange(len(db_ids)):
-            db_id = db_ids[i]
-            db_info = self._load_single_db_info(db_id)
-            self.db2infos[db_id] = db_info
+        # databases are profiled in a process pool (DB_LOAD_WORKERS); failures are logged and skipped
+        errors = load_db_infos(self, workers=workers)
+        if errors:
+            print(f"Failed to load {len(errors)} database(s): {sorted(errors)}", file=sys.stdout, flush=True)
     
     
     def _build_bird_table_schema_sqlite_str(self, table_name, new_columns_desc, new_columns_val):
@@ -389,145 +540,147 @@ class Selector(BaseAgent):
         schema_desc_str += '{\n' + '\n'.join(extracted_column_infos) + '\n}' + '\n'
         return schema_desc_str
     
+    def _build_bird_column_line_str(self, col_name, full_col_name, col_extra_desc, col_values_str):
+        col_extra_desc = 'And ' + str(col_extra_desc) if col_extra_desc != '' and str(col_extra_desc) != 'nan' else ''
+        col_extra_desc = col_extra_desc[:100]
+
+        col_line_text = ''
+        col_line_text += f'  ('
+        col_line_text += f"{col_name},"
+
+        if full_col_name != '':
+            full_col_name = full_col_name.strip()
+            col_line_text += f" {full_col_name}."
+        if col_values_str != '':
+            col_line_text += f" Value examples: {col_values_str}."
+        if col_extra_desc != '':
+            col_line_text += f" {col_extra_desc}"
+        col_line_text += '),'
+        return col_line_text
+
     def _build_bird_table_schema_list_str(self, table_name, new_columns_desc, new_columns_val):
         schema_desc_str = ''
         schema_desc_str += f"# Table: {table_name}\n"
         extracted_column_infos = []
         for (col_name, full_col_name, col_extra_desc), (_, col_values_str) in zip(new_columns_desc, new_columns_val):
-            col_extra_desc = 'And ' + str(col_extra_desc) if col_extra_desc != '' and str(col_extra_desc) != 'nan' else ''
-            col_extra_desc = col_extra_desc[:100]
-
-            col_line_text = ''
-            col_line_text += f'  ('
-            col_line_text += f"{col_name},"
-
-            if full_col_name != '':
-                full_col_name = full_col_name.strip()
-                col_line_text += f" {full_col_name}."
-            if col_values_str != '':
-                col_line_text += f" Value examples: {col_values_str}."
-            if col_extra_desc != '':
-                col_line_text += f" {col_extra_desc}"
-            col_line_text += '),'
-            extracted_column_infos.append(col_line_text)
+            extracted_column_infos.append(self._build_bird_column_line_str(col_name, full_col_name, col_extra_desc, col_values_str))
         schema_desc_str += '[\n' + '\n'.join(extracted_column_infos).strip(',') + '\n]' + '\n'
         return schema_desc_str
     
     def _get_db_desc_str(self,
                          db_id: str,
                          extracted_schema: dict,
-                         use_gold_schema: bool = False) -> List[str]:
+                         use_gold_schema: bool = False,
+                         drop_value_columns: set = None,
+                         profile_values: bool = True) -> List[str]:
         """
         Add foreign keys, and value descriptions of focused columns.
+        The text of every table and column is rendered once per db (_get_fragments), so this
+        only picks the columns and joins their fragments.
         :param db_id: name of sqlite database
         :param extracted_schema: {table_name: "keep_all" or "drop_all" or ['col_a', 'col_b']}
+        :param drop_value_columns: {(table_name, column_name), ..} rendered without value examples
+        :param profile_values: with lazy value profiling, show (and profile if needed) the value examples of the
+                               tables that are not dropped; False shows no value examples
         :return: Detailed columns info of db; foreign keys info of db
         """
         if self.db2infos.get(db_id, {}) == {}:  # lazy load
             self.db2infos[db_id] = self._load_single_db_info(db_id)
-        db_info = self.db2infos[db_id]
-        desc_info = db_info['desc_dict']  # table:str -> columns[(column_name, full_column_name, extra_column_desc): str]
-        value_info = db_info['value_dict']  # table:str -> columns[(column_name, value_examples_str): str]
-        pk_info = db_info['pk_dict']  # table:str -> primary keys[column_name: str]
-        fk_info = db_info['fk_dict']  # table:str -> foreign keys[(column_name, to_table, to_column): str]
-        tables_1, tables_2, tables_3 = desc_info.keys(), value_info.keys(), fk_info.keys()
-        assert set(tables_1) == set(tables_2)
-        assert set(tables_2) == set(tables_3)
-
-        # print(f"desc_info: {desc_info}\n\n")
-
-        # schema_desc_str = f"[db_id]: {db_id}\n"
-        schema_desc_str = ''  # for concat
-        db_fk_infos = []  # use list type for unique check in db
-
-        # print(f"extracted_schema:\n")
-        # pprint(extracted_schema)
-        # print()
+        fragments = self._get_fragments(db_id)
+        drop_value_columns = drop_value_columns or set()
 
         print(f"db_id: {db_id}")
         # For selector recall and compression rate calculation
         chosen_db_schem_dict = {} # {table_name: ['col_a', 'col_b'], ..}
-        for (table_name, columns_desc), (_, columns_val), (_, fk_info), (_, pk_info) in \
-                zip(desc_info.items(), value_info.items(), fk_info.items(), pk_info.items()):
+        chosen_column_ids = {} # {table_name: [column index, ..], ..}
+        for table_name, fragment in fragments.items():
             
             table_decision = extracted_schema.get(table_name, '')
             if table_decision == '' and use_gold_schema:
                 continue
 
-            # columns_desc = [(column_name, full_column_name, extra_column_desc): str]
-            # columns_val = [(column_name, value_examples_str): str]
-            # fk_info = [(column_name, to_table, to_column): str]
-            # pk_info = [column_name: str]
-
-            all_columns = [name for name, _, _ in columns_desc]
-            primary_key_columns = [name for name in pk_info]
-            foreign_key_columns = [name for name, _, _ in fk_info]
-
-            important_keys = primary_key_columns + foreign_key_columns
-
-            new_columns_desc = []
-            new_columns_val = []
+            all_columns = fragment['column_names']
 
-            print(f"table_name: {table_name}")
             if table_decision == "drop_all":
-                new_columns_desc = deepcopy(columns_desc[:6])
-                new_columns_val = deepcopy(columns_val[:6])
+                column_ids = list(range(min(len(all_columns), 6)))
             elif table_decision == "keep_all" or table_decision == '':
-                new_columns_desc = deepcopy(columns_desc)
-                new_columns_val = deepcopy(columns_val)
+                column_ids = list(range(len(all_columns)))
             else:
                 llm_chosen_columns = table_decision
                 print(f"llm_chosen_columns: {llm_chosen_columns}")
-                append_col_names = []
-                for idx, col in enumerate(all_columns):
-                    if col in important_keys:
-                        new_columns_desc.append(columns_desc[idx])
-                        new_columns_val.append(columns_val[idx])
-                        append_col_names.append(col)
-                    elif col in llm_chosen_columns:
-                        new_columns_desc.append(columns_desc[idx])
-                        new_columns_val.append(columns_val[idx])
-                        append_col_names.append(col)
-                    else:
-                        pass
+                # primary and foreign keys are always kept
+                important_keys = fragment['keys']
+                column_ids = [idx for idx, col in enumerate(all_columns)
+                              if col in important_keys or col in llm_chosen_columns]
                 
-                # todo: check if len(new_columns_val) ≈ 6
-                if len(all_columns) > 6 and len(new_columns_val) < 6:
-                    for idx, col in enumerate(all_columns):
-                        if len(append_col_names) >= 6:
-                            break
-                        if col not in append_col_names:
-                            new_columns_desc.append(columns_desc[idx])
-                            new_columns_val.append(columns_val[idx])
-                            append_col_names.append(col)
+                # todo: check if len(column_ids) ≈ 6
+                if len(all_columns) > 6 and len(column_ids) < 6:
+                    chosen_ids = set(column_ids)
+                    column_ids += [idx for idx in range(len(all_columns)) if idx not in chosen_ids][:6 - len(column_ids)]
 
             # 统计经过 Selector 筛选后的表格信息
-            chosen_db_schem_dict[table_name] = [col_name for col_name, _, _ in new_columns_desc]
-            
+            chosen_db_schem_dict[table_name] = [all_columns[idx] for idx in column_ids]
+            chosen_column_ids[table_name] = column_ids
+
+        value_tables = chosen_column_ids.keys()
+        if self.lazy_values:
+            # two-phase mode: value examples only for the tables that survive pruning, so a prompt never
+            # depends on what earlier questions happened to profile
+            value_tables = [tb for tb in chosen_column_ids if profile_values and extracted_schema.get(tb, '') != "drop_all"]
+            self._profile_pending_values(db_id, {tb: chosen_db_schem_dict[tb] for tb in value_tables})
+        value_tables = set(value_tables)
+
+        schema_desc_parts = []  # for concat
+        db_fk_infos = {}  # insertion-ordered set for unique check in db
+        for table_name, column_ids in chosen_column_ids.items():
+            fragment = fragments[table_name]
+            all_columns = fragment['column_names']
+
             # 1. Build schema part of prompt
-            # schema_desc_str += self._build_bird_table_schema_sqlite_str(table_name, new_columns_desc, new_columns_val)
-            schema_desc_str += self._build_bird_table_schema_list_str(table_name, new_columns_desc, new_columns_val)
+            with_values = table_name in value_tables
+            column_lines = [fragment['columns'][idx][0] if with_values and (table_name, all_columns[idx]) not in drop_value_columns
+                            else fragment['columns'][idx][1] for idx in column_ids]
+            schema_desc_parts.append(fragment['header'] + '[\n' + '\n'.join(column_lines).strip(',') + '\n]\n')
 
             # 2. Build foreign key part of prompt
-            for col_name, to_table, to_col in fk_info:
-                from_table = table_name
-                if '`' not in str(col_name):
-                    col_name = f"`{col_name}`"
-                if '`' not in str(to_col):
-                    to_col = f"`{to_col}`"
-                fk_link_str = f"{from_table}.{col_name} = {to_table}.{to_col}"
-                if fk_link_str not in db_fk_infos:
-                    db_fk_infos.append(fk_link_str)
+            for fk_link_str in fragment['fk']:
+                db_fk_infos[fk_link_str] = None
         fk_desc_str = '\n'.join(db_fk_infos)
-        schema_desc_str = schema_desc_str.strip()
+        schema_desc_str = ''.join(schema_desc_parts).strip()
         fk_desc_str = fk_desc_str.strip()
         
         return schema_desc_str, fk_desc_str, chosen_db_schem_dict
 
+    def _get_schema_tokens(self, db_id: str) -> int:
+        """
+        Size of the full schema (all tables, all columns, foreign keys) from the precomputed counts,
+        in core.token_budget.count_units; compare with max_units(budget).
+        """
+        token_dict = self.db2infos[db_id]['token_dict']
+        return sum(tb['table'] + sum(with_values for with_values, _ in tb['columns']) + tb['fk']
+                   for tb in token_dict.values())
+
+    def _plan_value_trim(self, db_id: str):
+        """
+        Value examples to drop so the full schema fits the token budget.
+        :return: {(table_name, column_name), ..}, or None if no budget is set or dropping all examples does not fit
+        """
+        budget = get_token_budget(self.model_name)
+        if budget is None:
+            return None
+        db_info = self.db2infos[db_id]
+        savings = []
+        for table_name, tb in db_info['token_dict'].items():
+            for (col_name, _, _), (with_values, without_values) in zip(db_info['desc_dict'][table_name], tb['columns']):
+                savings.append((with_values - without_values, (table_name, col_name)))
+        dropped = plan_trim(self._get_schema_tokens(db_id), max_units(budget), savings)
+        return None if dropped is None else set(dropped)
+
     def _is_need_prune(self, db_id: str, db_schema: str):
-        # encoder = tiktoken.get_encoding("cl100k_base")
-        # tokens = encoder.encode(db_schema)
-        # return len(tokens) >= 25000
+        # with a token budget for the model, prune only when the full schema exceeds it
+        budget = get_token_budget(self.model_name)
+        if budget is not None:
+            return self._get_schema_tokens(db_id) > max_units(budget)
         db_dict = self.db2dbjsons[db_id]
         avg_column_count = db_dict['avg_column_count']
         total_column_count = db_dict['total_column_count']
@@ -536,6 +689,99 @@ class Selector(BaseAgent):
         else:
             return True
 
+    def _get_schema_index(self, db_id: str) -> schema_index.SchemaIndex:
+        if db_id not in self.db2indexes:
+            if self._column_meanings is None:
+                # BIRD keeps column_meaning.json next to the database directory
+                self._column_meanings = schema_index.load_column_meanings(self.data_path, os.path.dirname(self.data_path))
+            meanings = schema_index.column_meanings_for_db(self._column_meanings, db_id)
+            self.db2indexes[db_id] = schema_index.build_index_from_db_info(self.db2infos[db_id], meanings)
+        return self.db2indexes[db_id]
+
+    def _get_join_graph(self, db_id: str) -> join_graph.JoinGraph:
+        if db_id not in self.db2joingraphs:
+            self.db2joingraphs[db_id] = join_graph.build_join_graph_from_db_info(self.db2infos[db_id])
+        return self.db2joingraphs[db_id]
+
+    def _add_join_bridges(self, db_id: str, extracted_schema: dict) -> dict:
+        """
+        Keep the tables (and their join columns) needed to join the tables the Selector chose.
+        :param extracted_schema: {table_name: "keep_all" or "drop_all" or ['col_a', 'col_b']}
+        :return: the decision with bridge tables reduced to their join columns instead of dropped
+        """
+        chosen = [tb for tb, decision in extracted_schema.items() if decision != "drop_all"]
+        plan = self._get_join_graph(db_id).connect(chosen)
+        self._message['join_plan'] = plan.to_dict()
+        if not plan.joins:
+            return extracted_schema
+        extracted_schema = dict(extracted_schema)
+        for tb in plan.tables:
+            decision = extracted_schema.get(tb, '')
+            if decision == "keep_all" or decision == '':  # shown whole anyway
+                continue
+            columns = [] if decision == "drop_all" else list(decision)
+            extracted_schema[tb] = columns + [col for col in plan.join_columns(tb) if col not in columns]
+        if plan.bridges:
+            print(f"join bridges: {plan.bridges}")
+        return extracted_schema
+
+    def _select_with_index(self, db_id: str, query: str, evidence: str = None):
+        """
+        Pick tables lexically before (or instead of) the Selector LLM call.
+        :return: (tables, skip_llm); with skip_llm the tables are the final pick, otherwise the candidates to show the LLM
+        """
+        index = self._get_schema_index(db_id)
+        match = index.search(query, evidence or '', max_tables=schema_index.max_tables())
+        self._message['schema_index'] = match.to_dict()
+        if match.selected and match.confidence >= schema_index.skip_confidence():
+            get_metrics().inc("selector_index_total", outcome="skip", db_id=db_id)
+            return index.with_neighbours(match.selected), True
+        candidates = index.with_neighbours(match.candidates(schema_index.max_tables()))
+        outcome = "candidates" if 0 < len(candidates) < len(index.table_names) else "full"
+        get_metrics().inc("selector_index_total", outcome=outcome, db_id=db_id)
+        return candidates, False
+
+    def _select(self, db_id: str, query: str, evidence: str, db_schema: str, db_fk: str):
+        """
+        Decide which tables and columns to keep, with the schema index and/or the Selector LLM call.
+        :return: (extracted schema {table_name: "keep_all" or "drop_all" or ['col_a', 'col_b']}, complete);
+                 complete is False if the LLM call failed or gave no decision, so it must not be cached
+        """
+        all_tables = list(self.db2infos[db_id]['desc_dict'].keys())
+        index_tables, skip_llm = [], False
+        if schema_index.is_enabled():
+            index_tables, skip_llm = self._select_with_index(db_id, query, evidence)
+        if skip_llm:
+            # confident lexical pick: no Selector LLM call
+            return {tb: "keep_all" if tb in index_tables else "drop_all" for tb in all_tables}, True
+        prune_schema, prune_fk = db_schema, db_fk
+        if index_tables and len(index_tables) < len(all_tables):
+            # show the LLM the candidate tables only; the others are dropped
+            prune_schema, prune_fk, _ = self._get_db_desc_str(db_id=db_id, extracted_schema={tb: "keep_all" for tb in index_tables}, use_gold_schema=True, profile_values=False)
+        try:
+            raw_extracted_schema_dict = self._prune(db_id=db_id, query=query, db_schema=prune_schema, db_fk=prune_fk, evidence=evidence)
+        except Exception as e:
+            print(e)
+            raw_extracted_schema_dict = {}
+        complete = bool(raw_extracted_schema_dict)
+        if prune_schema is not db_schema:
+            raw_extracted_schema_dict = {**{tb: "drop_all" for tb in all_tables if tb not in index_tables}, **(raw_extracted_schema_dict or {})}
+        return raw_extracted_schema_dict, complete
+
+    def _decision_version(self, db_id: str) -> str:
+        """
+        Version of the Selector decisions for a db: prompt template, model, schema and selection settings.
+        """
+        try:
+            # the Selector LLM call goes to the shared API client's model
+            model = api.get_client().model
+        except NameError:  # core.api could not be imported, core.llm is in use
+            model = self.model_name
+        return make_version(selector_template, model, self.model_name, type(self).__name__,
+                            json.dumps(self.db2dbjsons[db_id], sort_keys=True, ensure_ascii=False),
+                            schema_index.is_enabled(), schema_index.max_tables(), schema_index.skip_confidence(),
+                            self.lazy_values)
+
     def _prune(self,
                db_id: str,
                query: str,
@@ -545,7 +791,7 @@ class Selector(BaseAgent):
                ) -> dict:
         prompt = selector_template.format(db_id=db_id, query=query, evidence=evidence, desc_str=db_schema, fk_str=db_fk)
         word_info = extract_world_info(self._message)
-        reply = LLM_API_FUC(prompt, **word_info)
+        reply = LLM_API_FUC(prompt, stop_when=json_object_closed, **word_info)
         extracted_schema_dict = parse_json(reply)
         return extracted_schema_dict
 
@@ -566,17 +812,36 @@ class Selector(BaseAgent):
         use_gold_schema = False
         if ext_sch:
             use_gold_schema = True
-        db_schema, db_fk, chosen_db_schem_dict = self._get_db_desc_str(db_id=db_id, extracted_schema=ext_sch, use_gold_schema=use_gold_schema)
+        # with lazy value profiling the pruning decision sees names, descriptions and keys only
+        db_schema, db_fk, chosen_db_schem_dict = self._get_db_desc_str(db_id=db_id, extracted_schema=ext_sch, use_gold_schema=use_gold_schema, profile_values=False)
         need_prune = self._is_need_prune(db_id, db_schema)
         if self.without_selector:
             need_prune = False
+        trimmed = False
+        if ext_sch == {} and need_prune:
+            # dropping value examples is cheaper than a Selector LLM call when it fits the budget
+            drop_value_columns = self._plan_value_trim(db_id)
+            if drop_value_columns is not None:
+                db_schema, db_fk, chosen_db_schem_dict = self._get_db_desc_str(db_id=db_id, extracted_schema=ext_sch, drop_value_columns=drop_value_columns)
+                need_prune = False
+                trimmed = True
         if ext_sch == {} and need_prune:
             
-            try:
-                raw_extracted_schema_dict = self._prune(db_id=db_id, query=query, db_schema=db_schema, db_fk=db_fk, evidence=evidence)
-            except Exception as e:
-                print(e)
-                raw_extracted_schema_dict = {}
+            # decisions of earlier runs are reused when prompt, model and settings are unchanged (SELECTOR_CACHE_DIR)
+            cache = get_selector_cache()
+            raw_extracted_schema_dict = None
+            if cache is not None:
+                version = self._decision_version(db_id)
+                cache_key = make_decision_key(version, db_id, query, evidence)
+                raw_extracted_schema_dict = cache.get(cache_key)
+                get_metrics().inc("selector_cache_total", outcome="miss" if raw_extracted_schema_dict is None else "hit", db_id=db_id)
+            if raw_extracted_schema_dict is None:
+                raw_extracted_schema_dict, complete = self._select(db_id, query, evidence, db_schema, db_fk)
+                if cache is not None and complete:
+                    cache.put(cache_key, version, db_id, query, raw_extracted_schema_dict)
+            
+            if join_graph.is_enabled() and raw_extracted_schema_dict:
+                raw_extracted_schema_dict = self._add_join_bridges(db_id, raw_extracted_schema_dict)
             
             print(f"query: {message['query']}\n")
             db_schema_str, db_fk, chosen_db_schem_dict = self._get_db_desc_str(db_id=db_id, extracted_schema=raw_extracted_schema_dict)
@@ -588,10 +853,13 @@ class Selector(BaseAgent):
             message['pruned'] = True
             message['send_to'] = DECOMPOSER_NAME
         else:
+            if self.db2infos[db_id].get('pending_values'):
+                db_schema, db_fk, chosen_db_schem_dict = self._get_db_desc_str(db_id=db_id, extracted_schema=ext_sch, use_gold_schema=use_gold_schema)
             message['chosen_db_schem_dict'] = chosen_db_schem_dict
             message['desc_str'] = db_schema
             message['fk_str'] = db_fk
             message['pruned'] = False
+            message['trimmed'] = trimmed
             message['send_to'] = DECOMPOSER_NAME
 
 
@@ -649,7 +917,7 @@ class Decomposer(BaseAgent):
         ## one shot decompose(first) # fixme
         # prompt = oneshot_template_2.format(query=query, evidence=evidence, desc_str=schema_info, fk_str=fk_info)
         word_info = extract_world_info(self._message)
-        reply = LLM_API_FUC(prompt, **word_info).strip()
+        reply = LLM_API_FUC(prompt, stop_when=decomposition_solved, **word_info).strip()
         
         res = ''
         qa_pairs = reply
@@ -748,7 +1016,7 @@ class Refiner(BaseAgent):
                                         exception_class=exception_class)
 
         word_info = extract_world_info(self._message)
-        reply = LLM_API_FUC(prompt, **word_info)
+        reply = LLM_API_FUC(prompt, stop_when=sql_block_closed, **word_info)
         res = parse_sql_from_string(reply)
         return res
 
@@ -779,12 +1047,14 @@ class Refiner(BaseAgent):
             return
         
         is_timeout = False
+        exec_start = time.time()
         try:
             error_info = self._execute_sql(old_sql, db_id)
         except Exception as e:
             is_timeout = True
         except FunctionTimedOut as fto:
             is_timeout = True
+        get_metrics().observe("db_execution_seconds", time.time() - exec_start, agent=self.name, db_id=db_id)
         
         is_need = self._is_need_refine(error_info)
         # is_need = False
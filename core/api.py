@@ -7,8 +7,17 @@ import json
 import requests
 import time
 import logging
-import random
-from typing import Dict, Any, List, Tuple
+import threading
+from typing import Dict, Any, List, Tuple, Optional, Callable
+
+from requests.adapters import HTTPAdapter
+
+from core.llm_cache import get_cache, make_cache_key, make_prompt_hash
+from core.log_sink import get_log_sink, hash_prompts_enabled
+from core.metrics import get_metrics
+from core.rate_limiter import get_rate_limiter, estimate_tokens, COMPLETION_TOKEN_RESERVE
+from core.retry_policy import get_retry_policy, parse_retry_after, APIStatusError
+from core.hedging import get_hedge_policy, HedgeLeg, HedgeCancelled
 
 # Load environment variables from .env file
 try:
@@ -27,6 +36,23 @@ logger = logging.getLogger(__name__)
 # Remove these global reads/prints - they happen too early
 # TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY", "")
 TOGETHER_MODEL = os.getenv("TOGETHER_MODEL", "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo")
+DEFAULT_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+
+# Sampling parameters sent with every request (also part of the response cache key)
+SAMPLING_PARAMS = {
+    "temperature": 0.1,
+    "max_tokens": 4096
+}
+
+# HTTP client settings
+DEFAULT_API_BASE = "https://api.together.xyz/v1"
+TOGETHER_API_URL = f"{DEFAULT_API_BASE}/chat/completions"
+CONNECT_TIMEOUT = float(os.getenv("TOGETHER_CONNECT_TIMEOUT", "10"))  # seconds to establish a connection
+READ_TIMEOUT = float(os.getenv("TOGETHER_READ_TIMEOUT", "180"))  # seconds to wait for response data
+POOL_MAXSIZE = int(os.getenv("TOGETHER_POOL_MAXSIZE", "16"))  # keep-alive connections kept per host
+
+# Stream completions when the caller passes a stop predicate ("0" always waits for the full completion)
+STREAM_ENABLED = os.getenv("TOGETHER_STREAM", "1") == "1"
 
 # Print environment variable values for debugging
 # print(f"API Key (exists): {'Yes' if TOGETHER_API_KEY else 'No'}")
@@ -38,11 +64,7 @@ total_prompt_tokens = 0
 total_response_tokens = 0
 log_path = None
 api_trace_json_path = None
-
-# Rate limiting parameters
-MAX_RETRIES = 20  # Increased from 5 to 20 for more resilience
-RETRY_DELAY = 5  # seconds
-MAX_BACKOFF = 120  # Maximum delay in seconds (cap the exponential backoff)
+_totals_lock = threading.Lock()
 
 def init_log_path(my_log_path):
     """Initialize log path for API call logging"""
@@ -63,63 +85,264 @@ def init_log_path(my_log_path):
         # Set up API trace log file
         api_trace_json_path = os.path.join(log_dir, 'api_trace.json')
 
-def together_api_call(prompt: str) -> Tuple[str, int, int]:
+def get_api_url() -> str:
+    """
+    Get the chat completions endpoint, taken from TOGETHER_API_BASE when set.
+    
+    Pointing TOGETHER_API_BASE at a local stand-in (scripts/mock_together_server.py)
+    runs the whole pipeline offline.
+    
+    Returns:
+        Full URL of the chat completions endpoint
+    """
+    base = os.getenv("TOGETHER_API_BASE", DEFAULT_API_BASE).rstrip("/")
+    return f"{base}/chat/completions"
+
+class TogetherClient:
+    """
+    HTTP client for the Together AI chat completions endpoint.
+    
+    Holds one requests.Session whose urllib3 pool keeps TCP+TLS connections alive
+    between calls. The session is configured once in __init__ and never mutated
+    afterwards, so a single client can be shared by all threads of a process.
+    """
+    
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 api_url: Optional[str] = None, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, pool_maxsize: int = POOL_MAXSIZE):
+        """
+        Initialize the client.
+        
+        Args:
+            api_key: Together API key (defaults to TOGETHER_API_KEY)
+            model: Model name (defaults to TOGETHER_MODEL)
+            api_url: Chat completions endpoint (defaults to get_api_url())
+            connect_timeout: Seconds allowed to establish a connection
+            read_timeout: Seconds allowed between bytes of the response
+            pool_maxsize: Maximum number of pooled keep-alive connections
+        """
+        self.api_key = api_key if api_key is not None else os.getenv("TOGETHER_API_KEY", "")
+        self.model = model or os.getenv("TOGETHER_MODEL", DEFAULT_MODEL)
+        self.api_url = api_url or get_api_url()
+        self.timeout = (connect_timeout, read_timeout)
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+    
+    def post(self, data: Dict[str, Any], read_timeout: Optional[float] = None,
+             stream: bool = False) -> requests.Response:
+        """
+        Send one chat completion request over a pooled connection.
+        
+        Args:
+            data: JSON payload for the request
+            read_timeout: Shorter read timeout for this request (e.g. the time left until its deadline)
+            stream: Return as soon as headers arrive and read the body incrementally
+            
+        Returns:
+            The HTTP response
+        """
+        if not self.api_key:
+            raise ValueError("Together API key not found. Set TOGETHER_API_KEY environment variable.")
+        timeout = self.timeout
+        if read_timeout is not None:
+            timeout = (self.timeout[0], max(1.0, min(self.timeout[1], read_timeout)))
+        return self.session.post(self.api_url, json=data, timeout=timeout, stream=stream)
+    
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+
+# Process-wide client, created on first use
+_client = None
+_client_lock = threading.Lock()
+
+# Client for hedge requests when LLM_HEDGE_MODEL / LLM_HEDGE_API_BASE point elsewhere
+_hedge_client = None
+
+def get_client() -> TogetherClient:
+    """Get the shared Together client, creating it from the environment on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = TogetherClient()
+    return _client
+
+def set_client(client: Optional[TogetherClient]) -> None:
+    """
+    Replace the shared Together client (e.g. with a custom endpoint or timeouts).
+    
+    Args:
+        client: The client to use, or None to rebuild it from the environment on next use
+    """
+    global _client
+    with _client_lock:
+        old_client = _client
+        _client = client
+    if old_client is not None and old_client is not client:
+        old_client.close()
+
+def reset_client() -> None:
+    """Drop the shared client so the next call re-reads TOGETHER_API_KEY and TOGETHER_MODEL."""
+    global _hedge_client
+    set_client(None)
+    with _client_lock:
+        old_hedge_client = _hedge_client
+        _hedge_client = None
+    if old_hedge_client is not None:
+        old_hedge_client.close()
+
+def get_hedge_client() -> TogetherClient:
+    """Get the client hedge requests are sent with (the shared client unless a fallback is configured)."""
+    global _hedge_client
+    model = os.getenv("LLM_HEDGE_MODEL")
+    base = os.getenv("LLM_HEDGE_API_BASE")
+    if not model and not base:
+        return get_client()
+    if _hedge_client is None:
+        with _client_lock:
+            if _hedge_client is None:
+                _hedge_client = TogetherClient(
+                    api_key=os.getenv("LLM_HEDGE_API_KEY") or None,
+                    model=model,
+                    api_url=f"{base.rstrip('/')}/chat/completions" if base else None
+                )
+    return _hedge_client
+
+def together_api_call(prompt: str, stop_when: Optional[Callable[[str], bool]] = None,
+                      labels: Optional[Dict[str, str]] = None) -> Tuple[str, int, int]:
     """
     Call Together AI API to generate a response
     
+    With LLM_HEDGE=1 a request slower than the recent latency percentile of its
+    model/agent is duplicated and the first answer wins (see core/hedging.py).
+    
     Args:
         prompt: The prompt to send to the API
+        stop_when: Optional predicate on the text generated so far. When given,
+            the completion is streamed and the connection is closed as soon as
+            the predicate returns True (see core/utils/parsing.py)
+        labels: Metric labels of the call, used to look up its latency history for hedging
         
     Returns:
         Tuple of (response text, prompt tokens, completion tokens)
     """
-    # Read API Key and Model directly from environment *inside* the function
-    # This ensures it picks up changes from .env or arguments
-    api_key = os.getenv("TOGETHER_API_KEY", "")
-    default_model = "meta-llama/Llama-3.3-70B-Instruct-Turbo" # Define default here
-    model = os.getenv("TOGETHER_MODEL", default_model)
+    text, prompt_tokens, completion_tokens, _ = together_api_call_with_model(prompt, stop_when, labels)
+    return text, prompt_tokens, completion_tokens
+
+def together_api_call_with_model(prompt: str, stop_when: Optional[Callable[[str], bool]] = None,
+                                 labels: Optional[Dict[str, str]] = None) -> Tuple[str, int, int, str]:
+    """
+    together_api_call that also reports which model answered
+    
+    With LLM_HEDGE_MODEL set, a hedge request that wins was answered by the
+    fallback model, not by the shared client's model.
+    
+    Args:
+        prompt: The prompt to send to the API
+        stop_when: Optional stream stop predicate, see together_api_call
+        labels: Metric labels of the call, used to look up its latency history for hedging
+        
+    Returns:
+        Tuple of (response text, prompt tokens, completion tokens, model)
+    """
+    # API key and model are resolved once when the shared client is created
+    client = get_client()
     
     # Check if API key is available
-    if not api_key:
+    if not client.api_key:
         raise ValueError("Together API key not found. Set TOGETHER_API_KEY environment variable.")
     
     # Log model being used
-    logger.info(f"\nUsing Together AI model: {model}\n") # Log the currently resolved model
-    
-    # Prepare API request
-    api_url = "https://api.together.xyz/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    logger.info(f"\nUsing Together AI model: {client.model}\n")
     
+    stream = stop_when is not None and STREAM_ENABLED
     data = {
-        "model": model,
+        "model": client.model,
         "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.1,
-        "max_tokens": 4096
+        **SAMPLING_PARAMS
     }
+    if stream:
+        data["stream"] = True
     
-    # Make API request with retry logic
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(api_url, headers=headers, json=data)
-            
-            # Check for rate limiting
-            if response.status_code == 429:
-                wait_time = min(RETRY_DELAY * (2 ** attempt), MAX_BACKOFF)  # Exponential backoff with cap
-                logger.warning(f"Rate limited. Waiting {wait_time} seconds before retry.")
-                time.sleep(wait_time)
-                continue
-                
-            # Check for other errors
-            if response.status_code != 200:
-                logger.error(f"API error: {response.status_code} - {response.text}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
-                    continue
-                raise Exception(f"API error: {response.status_code} - {response.text}")
-            
+    # Every attempt draws from the RPM/TPM budget shared by all workers on this host
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(prompt) + COMPLETION_TOKEN_RESERVE
+    
+    def primary(leg: Optional[HedgeLeg] = None) -> Tuple[str, int, int, str]:
+        def attempt(remaining: Optional[float]) -> Tuple[str, int, int]:
+            if leg is not None:
+                leg.check()
+            limiter.acquire(estimated_tokens)
+            return _complete_once(client, data, prompt, stop_when, estimated_tokens, remaining, leg)
+        
+        # One retry loop per request: deadline, jittered backoff, Retry-After and circuit breaker
+        return (*get_retry_policy().call(attempt, on_retry=_on_retry), client.model)
+    
+    hedger = get_hedge_policy()
+    if hedger is None:
+        return primary()
+    
+    hedge_client = get_hedge_client()
+    hedge_data = {**data, "model": hedge_client.model}
+    
+    def hedge(leg: HedgeLeg) -> Tuple[str, int, int, str]:
+        # A single attempt on budget already taken by try_budget; the primary keeps its retries
+        return (*_complete_once(hedge_client, hedge_data, prompt, stop_when, estimated_tokens, None, leg),
+                hedge_client.model)
+    
+    # Hedges only go out if the shared budget can pay right now, so they never cause 429s
+    return hedger.run(
+        primary, hedge,
+        try_budget=lambda: limiter.try_acquire(estimated_tokens) == 0.0,
+        delay=hedger.hedge_delay({"model": client.model, **(labels or {})}),
+        model=client.model
+    )
+
+def _complete_once(client: TogetherClient, data: Dict[str, Any], prompt: str,
+                   stop_when: Optional[Callable[[str], bool]], estimated_tokens: int,
+                   remaining: Optional[float], leg: Optional[HedgeLeg] = None) -> Tuple[str, int, int]:
+    """
+    Send one request (rate-limit budget already taken) and read the completion
+    
+    Args:
+        client: Client to send the request with
+        data: JSON payload; streamed if it has "stream": True
+        prompt: The prompt, for token estimates
+        stop_when: Stream stop predicate
+        estimated_tokens: Tokens taken from the limiter, corrected with the real usage
+        remaining: Seconds left until the request's deadline
+        leg: Hedge handle that lets the other request close this one
+        
+    Returns:
+        Tuple of (response text, prompt tokens, completion tokens)
+    """
+    stream = bool(data.get("stream"))
+    response = client.post(data, read_timeout=remaining, stream=stream)
+    if leg is not None:
+        leg.attach(response)
+    
+    try:
+        # Non-200 responses are classified (retryable or not) by the retry policy
+        if response.status_code != 200:
+            raise APIStatusError(response.status_code, response.text,
+                                 parse_retry_after(response.headers))
+        
+        if stream:
+            text, usage = _read_stream(response, stop_when)
+            text = text.strip()
+            # A stream closed early carries no usage; fall back to estimates
+            prompt_tokens = usage["prompt_tokens"] if usage else estimate_tokens(prompt)
+            completion_tokens = usage["completion_tokens"] if usage else estimate_tokens(text)
+        else:
             # Parse response
             result = response.json()
             
@@ -127,104 +350,244 @@ def together_api_call(prompt: str) -> Tuple[str, int, int]:
             text = result["choices"][0]["message"]["content"].strip()
             prompt_tokens = result["usage"]["prompt_tokens"]
             completion_tokens = result["usage"]["completion_tokens"]
-            
-            return text, prompt_tokens, completion_tokens
-            
-        except Exception as e:
-            logger.error(f"Error calling Together API: {str(e)}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-            else:
-                raise
-
-def safe_call_llm(input_prompt: str, **kwargs) -> str:
+    except Exception as e:
+        # The connection was closed because the other hedged request won; do not retry
+        if leg is not None and leg.cancelled:
+            raise HedgeCancelled(str(e)) from e
+        raise
+    finally:
+        # For a stream stopped early this drops the connection, which ends generation server-side
+        response.close()
+        if leg is not None:
+            leg.detach()
+    
+    get_rate_limiter().reconcile(estimated_tokens, prompt_tokens + completion_tokens)
+    return text, prompt_tokens, completion_tokens
+
+def _read_stream(response: requests.Response,
+                 stop_when: Callable[[str], bool]) -> Tuple[str, Optional[Dict[str, int]]]:
     """
-    Safe wrapper for LLM API call with logging
+    Read a server-sent-events completion until it ends or `stop_when` fires
     
     Args:
-        input_prompt: The prompt to send to the LLM
-        **kwargs: Additional context for logging
+        response: Streaming HTTP response
+        stop_when: Predicate on the text generated so far
         
     Returns:
-        Generated response text
+        Tuple of (generated text, usage dict if the server sent one)
+    """
+    # SSE responses often omit the charset; Cyrillic output must not be decoded as latin-1
+    response.encoding = "utf-8"
+    text = ""
+    usage = None
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            break
+        
+        chunk = json.loads(payload)
+        if chunk.get("error"):
+            raise Exception(f"API stream error: {chunk['error']}")
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        piece = (choices[0].get("delta") or {}).get("content") or choices[0].get("text") or ""
+        if piece:
+            text += piece
+            if stop_when(text):
+                logger.info(f"Stopped streaming after {len(text)} characters ({_predicate_name(stop_when)})")
+                break
+    return text, usage
+
+def _record_retry(error: Exception, delay: float, attempt: int, model: str) -> None:
+    """Log and count a failed attempt of a request to `model`"""
+    logger.warning(f"Together API attempt {attempt + 1} failed: {error}. Retrying in {delay:.1f}s")
+    reason = str(getattr(error, "status_code", "")) or type(error).__name__
+    get_metrics().inc("llm_retries_total", model=model, reason=reason)
+
+def _on_retry(error: Exception, delay: float, attempt: int) -> None:
+    """
+    Log a failed attempt before the retry policy sleeps
+    
+    Args:
+        error: Exception raised by the attempt
+        delay: Seconds until the next attempt
+        attempt: Number of the failed attempt (0-based)
+    """
+    _record_retry(error, delay, attempt, get_client().model)
+    
+    # Make every worker on the host back off, not just this one
+    if getattr(error, "status_code", None) == 429:
+        get_rate_limiter().penalize(delay)
+
+def _log_llm_call(input_prompt: str, sys_response: str, prompt_token: int, response_token: int,
+                  cached: bool = False, model: Optional[str] = None, **kwargs) -> None:
+    """
+    Record one LLM call in the text log and the API trace
+    
+    Args:
+        input_prompt: The prompt sent to the LLM
+        sys_response: The response text
+        prompt_token: Prompt tokens of the call
+        response_token: Completion tokens of the call
+        cached: Whether the response was served from the response cache
+        model: Model that produced the response (default: the shared client's)
+        **kwargs: Additional context for logging
     """
     global total_prompt_tokens
     global total_response_tokens
-    global log_path
-    global api_trace_json_path
-    global TOGETHER_MODEL
     
-    # Try to make the API call with retries
-    for attempt in range(MAX_RETRIES):
-        try:
-            # Make API call
-            sys_response, prompt_token, response_token = together_api_call(input_prompt)
-            
-            # Track token usage for rate limiting
+    # Only real API calls count towards token usage
+    with _totals_lock:
+        if not cached:
             total_prompt_tokens += prompt_token
             total_response_tokens += response_token
-            
-            # Log the results based on logging configuration
-            if log_path is None:
-                # Just print to console if no log path set
-                print(f"\nResponse: \n{sys_response}")
-                print(f"\nTokens (prompt/response): {prompt_token}/{response_token}\n")
-            else:
-                # Full logging to file
-                with open(log_path, 'a+', encoding='utf8') as log_fp:
-                    print('\n' + f'*'*20 +'\n', file=log_fp)
-                    print(input_prompt, file=log_fp)
-                    print('\n' + f'='*20 +'\n', file=log_fp)
-                    print(sys_response, file=log_fp)
-                    print(f'\nTokens (prompt/response): {prompt_token}/{response_token}\n', file=log_fp)
-                
-                # Also log to API trace JSON if available
-                if api_trace_json_path:
-                    # Get current model name (environment variable might have changed)
-                    current_model = os.getenv("TOGETHER_MODEL", TOGETHER_MODEL)
-                    
-                    # Create trace entry with all context
-                    trace_entry = {
-                        "prompt": input_prompt.strip(),
-                        "response": sys_response.strip(),
-                        "prompt_tokens": prompt_token,
-                        "response_tokens": response_token, 
-                        "total_prompt_tokens": total_prompt_tokens,
-                        "total_response_tokens": total_response_tokens,
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "model": current_model
-                    }
-                    
-                    # Add any additional context from kwargs
-                    for k, v in kwargs.items():
-                        trace_entry[k] = v
-                    
-                    # Write to trace file
-                    with open(api_trace_json_path, 'a+', encoding='utf8') as trace_fp:
-                        trace_fp.write(json.dumps(trace_entry, ensure_ascii=False) + "\n")
-            
-            # Return the response
-            return sys_response
-            
-        except Exception as e:
-            logger.error(f"API call failed: {str(e)}")
-            # Get current model for error message
-            current_model = os.getenv("TOGETHER_MODEL", TOGETHER_MODEL)
-            print(f"Request {current_model} failed. Try {attempt+1} of {MAX_RETRIES}. Sleeping {RETRY_DELAY} seconds.")
-            time.sleep(RETRY_DELAY)
-    
-    # If all retries failed
-    error_msg = f"Failed to call LLM API after {MAX_RETRIES} attempts"
-    logger.error(error_msg)
-    raise Exception(error_msg)
-
-def call_llm(model_name: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        cur_total_prompt_tokens = total_prompt_tokens
+        cur_total_response_tokens = total_response_tokens
+    
+    source = " (cached)" if cached else ""
+    
+    # Log the results based on logging configuration
+    if log_path is None:
+        # Just print to console if no log path set
+        print(f"\nResponse{source}: \n{sys_response}")
+        print(f"\nTokens (prompt/response): {prompt_token}/{response_token}\n")
+        return
+    
+    # The full prompt (mostly the schema) is only logged if the response cache cannot hold it
+    prompt_hash = make_prompt_hash(input_prompt)
+    prompt_text = input_prompt
+    if hash_prompts_enabled() and get_cache().store_prompt(input_prompt):
+        prompt_text = None
+    
+    # File writes happen on the log sink's background thread
+    sink = get_log_sink()
+    logged_prompt = prompt_text if prompt_text is not None else f"[prompt sha256:{prompt_hash} stored in response cache]"
+    sink.write_text(log_path, (
+        '\n' + '*'*20 + '\n\n' +
+        logged_prompt + '\n' +
+        '\n' + '='*20 + '\n\n' +
+        sys_response + '\n' +
+        f'\nTokens (prompt/response){source}: {prompt_token}/{response_token}\n\n'
+    ))
+    
+    # Also log to API trace JSON if available
+    if api_trace_json_path:
+        # Model that produced the response; a hedge may have been answered by the fallback model
+        current_model = model or get_client().model
+        
+        # Create trace entry with all context
+        trace_entry = {
+            "prompt": prompt_text.strip() if prompt_text is not None else None,
+            "prompt_sha256": prompt_hash,
+            "response": sys_response.strip(),
+            "prompt_tokens": prompt_token,
+            "response_tokens": response_token, 
+            "total_prompt_tokens": cur_total_prompt_tokens,
+            "total_response_tokens": cur_total_response_tokens,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "model": current_model,
+            "cached": cached
+        }
+        
+        # Add any additional context from kwargs
+        for k, v in kwargs.items():
+            trace_entry[k] = v
+        
+        sink.write_json(api_trace_json_path, trace_entry)
+
+def _llm_labels(model: str, context: Dict[str, Any]) -> Dict[str, str]:
+    """Metric labels of an LLM call; the agent is the recipient of the message being processed"""
+    return {
+        "agent": context.get("send_to") or "unknown",
+        "model": model,
+        "db_id": context.get("db_id") or ""
+    }
+
+def _record_llm_metrics(labels: Dict[str, str], seconds: float,
+                        prompt_tokens: int, completion_tokens: int) -> None:
+    """Record latency and token usage of a completed (non-cached) LLM call"""
+    metrics = get_metrics()
+    metrics.inc("llm_requests_total", outcome="ok", **labels)
+    metrics.observe("llm_request_seconds", seconds, **labels)
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, **labels)
+    metrics.inc("llm_completion_tokens_total", completion_tokens, **labels)
+
+def _cache_params(stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+    """Sampling parameters for the cache key; a truncated stream is cached apart from the full completion"""
+    if stop_when is None or not STREAM_ENABLED:
+        return SAMPLING_PARAMS
+    return {**SAMPLING_PARAMS, "stop_when": _predicate_name(stop_when)}
+
+def _predicate_name(stop_when: Callable[[str], bool]) -> str:
+    """Name of a stop predicate; partials and callable objects have no __name__"""
+    return getattr(stop_when, "__name__", repr(stop_when))
+
+def safe_call_llm(input_prompt: str, stop_when: Optional[Callable[[str], bool]] = None, **kwargs) -> str:
+    """
+    Safe wrapper for LLM API call with logging
+    
+    Responses are served from the on-disk response cache (see core/llm_cache.py)
+    when it is enabled and already holds the same model + prompt + sampling params.
+    
+    Args:
+        input_prompt: The prompt to send to the LLM
+        stop_when: Optional stream stop predicate, see together_api_call
+        **kwargs: Additional context for logging
+        
+    Returns:
+        Generated response text
+        
+    Raises:
+        CacheMissError: If the cache is in replay mode and has no entry for the prompt
+        CircuitOpenError: If the provider is failing and the circuit breaker is open
+        RetryError: If the request ran out of attempts or hit its deadline
+    """
+    # Check the response cache before touching the network
+    cache = get_cache()
+    model = get_client().model
+    cache_key = make_cache_key(model, input_prompt, _cache_params(stop_when))
+    labels = _llm_labels(model, kwargs)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        get_metrics().inc("llm_requests_total", outcome="cached", **labels)
+        _log_llm_call(input_prompt, cached["response"], cached["prompt_tokens"],
+                      cached["response_tokens"], cached=True, **kwargs)
+        return cached["response"]
+    
+    # Retries, deadlines and the circuit breaker are handled inside together_api_call
+    start_time = time.time()
+    try:
+        sys_response, prompt_token, response_token, answered_by = together_api_call_with_model(input_prompt, stop_when, labels)
+    except Exception as e:
+        get_metrics().inc("llm_requests_total", outcome="error", **labels)
+        logger.error(f"Request {model} failed: {str(e)}")
+        raise
+    if answered_by != model:
+        # A hedge to LLM_HEDGE_MODEL won: cache, log and count the answer under that model
+        labels = _llm_labels(answered_by, kwargs)
+        cache_key = make_cache_key(answered_by, input_prompt, _cache_params(stop_when))
+    _record_llm_metrics(labels, time.time() - start_time, prompt_token, response_token)
+    
+    cache.put(cache_key, answered_by, sys_response, prompt_token, response_token)
+    _log_llm_call(input_prompt, sys_response, prompt_token, response_token, model=answered_by, **kwargs)
+    
+    return sys_response
+
+def call_llm(model_name: str, messages: List[Dict[str, str]],
+             stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
     """
     Call the LLM with a structured message list.
     
     Args:
         model_name: The name of the model to use
         messages: List of message dictionaries with role and content
+        stop_when: Optional stream stop predicate, see together_api_call
         
     Returns:
         Dictionary with response content
@@ -242,7 +605,7 @@ def call_llm(model_name: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
     prompt = user_messages[-1]["content"]
     
     # Call the LLM
-    response_text = safe_call_llm(prompt)
+    response_text = safe_call_llm(prompt, stop_when=stop_when)
     
     # Return a structured response
     return {
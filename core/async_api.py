@@ -0,0 +1,303 @@
+"""
+Async Together AI API Functions for MAC-SQL
+
+asyncio counterpart of core/api.py. `acall_llm` lets agents and evaluation
+drivers keep many prompts in flight from one process, bounded by a configurable
+in-flight cap, while sharing the response cache, logging and token accounting
+of `safe_call_llm`.
+
+Uses httpx.AsyncClient when httpx is installed; otherwise requests are run on
+worker threads through the pooled synchronous client from core/api.py.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import weakref
+from typing import Dict, Any, List, Optional, Tuple
+
+from core import api
+from core.llm_cache import get_cache, make_cache_key
+from core.metrics import get_metrics
+from core.rate_limiter import get_rate_limiter, estimate_tokens, COMPLETION_TOKEN_RESERVE
+from core.retry_policy import get_retry_policy, parse_retry_after, APIStatusError
+from core.hedging import get_hedge_policy, HedgeLeg
+
+# httpx is optional - fall back to the synchronous client on worker threads
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of requests one client keeps outstanding
+MAX_IN_FLIGHT = int(os.getenv("TOGETHER_MAX_IN_FLIGHT", "8"))
+
+
+class AsyncTogetherClient:
+    """
+    Async client for the Together AI chat completions endpoint.
+
+    A semaphore caps the number of outstanding requests; excess callers wait
+    for a free slot instead of opening more connections.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                 api_url: Optional[str] = None, connect_timeout: float = api.CONNECT_TIMEOUT,
+                 read_timeout: float = api.READ_TIMEOUT, max_in_flight: int = MAX_IN_FLIGHT):
+        """
+        Initialize the client.
+
+        Args:
+            api_key: Together API key (defaults to TOGETHER_API_KEY)
+            model: Model name (defaults to TOGETHER_MODEL)
+            api_url: Chat completions endpoint (defaults to api.get_api_url())
+            connect_timeout: Seconds allowed to establish a connection
+            read_timeout: Seconds allowed between bytes of the response
+            max_in_flight: Maximum number of concurrent requests
+        """
+        self.api_key = api_key if api_key is not None else os.getenv("TOGETHER_API_KEY", "")
+        self.model = model or os.getenv("TOGETHER_MODEL", api.DEFAULT_MODEL)
+        self.api_url = api_url or api.get_api_url()
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+        if HTTPX_AVAILABLE:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_in_flight,
+                                    max_keepalive_connections=max_in_flight),
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+            self._sync_client = None
+        else:
+            self._http = None
+            self._sync_client = api.TogetherClient(
+                api_key=self.api_key, model=self.model, api_url=self.api_url,
+                connect_timeout=connect_timeout, read_timeout=read_timeout,
+                pool_maxsize=max_in_flight
+            )
+
+    async def post(self, data: Dict[str, Any],
+                   read_timeout: Optional[float] = None) -> Tuple[int, Dict[str, str], Any]:
+        """
+        Send one chat completion request once an in-flight slot is free.
+
+        Args:
+            data: JSON payload for the request
+            read_timeout: Shorter read timeout for this request (e.g. the time left until its deadline)
+
+        Returns:
+            Tuple of (status code, response headers, parsed JSON body or raw text)
+        """
+        if not self.api_key:
+            raise ValueError("Together API key not found. Set TOGETHER_API_KEY environment variable.")
+
+        async with self._semaphore:
+            if self._http is not None:
+                timeout = self._http.timeout
+                if read_timeout is not None:
+                    timeout = httpx.Timeout(max(1.0, min(timeout.read, read_timeout)),
+                                            connect=timeout.connect)
+                response = await self._http.post(self.api_url, json=data, timeout=timeout)
+            else:
+                response = await asyncio.to_thread(self._sync_client.post, data, read_timeout)
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        return response.status_code, dict(response.headers), body
+
+    async def aclose(self) -> None:
+        """Close pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+        if self._sync_client is not None:
+            self._sync_client.close()
+
+
+# One client per event loop, since httpx connections are bound to the loop that opened them
+_clients = weakref.WeakKeyDictionary()
+_hedge_clients = weakref.WeakKeyDictionary()
+
+def get_async_client() -> AsyncTogetherClient:
+    """Get the async client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncTogetherClient()
+        _clients[loop] = client
+    return client
+
+def set_async_client(client: AsyncTogetherClient) -> None:
+    """
+    Use a custom async client (e.g. with a different in-flight cap) in the running event loop.
+
+    Args:
+        client: The client to use
+    """
+    _clients[asyncio.get_running_loop()] = client
+
+def get_async_hedge_client(primary: Optional[AsyncTogetherClient] = None) -> AsyncTogetherClient:
+    """
+    Get the async client hedge requests are sent with (see api.get_hedge_client).
+
+    Args:
+        primary: Client of the primary request, reused when no fallback is configured
+    """
+    model = os.getenv("LLM_HEDGE_MODEL")
+    base = os.getenv("LLM_HEDGE_API_BASE")
+    if not model and not base:
+        return primary or get_async_client()
+    loop = asyncio.get_running_loop()
+    client = _hedge_clients.get(loop)
+    if client is None:
+        client = AsyncTogetherClient(
+            api_key=os.getenv("LLM_HEDGE_API_KEY") or None,
+            model=model,
+            api_url=f"{base.rstrip('/')}/chat/completions" if base else None
+        )
+        _hedge_clients[loop] = client
+    return client
+
+
+async def atogether_api_call(prompt: str, client: Optional[AsyncTogetherClient] = None,
+                             labels: Optional[Dict[str, str]] = None) -> Tuple[str, int, int, str]:
+    """
+    Call Together AI API asynchronously to generate a response
+
+    Hedged like api.together_api_call when LLM_HEDGE=1; the losing request's
+    task is cancelled.
+
+    Args:
+        prompt: The prompt to send to the API
+        client: Client to use (defaults to the client of the running loop)
+        labels: Metric labels of the call, used to look up its latency history for hedging
+
+    Returns:
+        Tuple of (response text, prompt tokens, completion tokens, model that answered)
+    """
+    client = client or get_async_client()
+    if not client.api_key:
+        raise ValueError("Together API key not found. Set TOGETHER_API_KEY environment variable.")
+
+    data = {
+        "model": client.model,
+        "messages": [{"role": "user", "content": prompt}],
+        **api.SAMPLING_PARAMS
+    }
+
+    limiter = get_rate_limiter()
+    estimated_tokens = estimate_tokens(prompt) + COMPLETION_TOKEN_RESERVE
+
+    async def send(target: AsyncTogetherClient, payload: Dict[str, Any],
+                   remaining: Optional[float]) -> Tuple[str, int, int, str]:
+        status_code, headers, body = await target.post(payload, read_timeout=remaining)
+
+        if status_code != 200:
+            raise APIStatusError(status_code, body, parse_retry_after(headers))
+
+        text = body["choices"][0]["message"]["content"].strip()
+        prompt_tokens = body["usage"]["prompt_tokens"]
+        completion_tokens = body["usage"]["completion_tokens"]
+        await limiter.areconcile(estimated_tokens, prompt_tokens + completion_tokens)
+        return text, prompt_tokens, completion_tokens, target.model
+
+    async def on_retry(error: Exception, delay: float, attempt: int) -> None:
+        # api._on_retry, labelled with this client's model and without blocking the loop
+        api._record_retry(error, delay, attempt, client.model)
+        if getattr(error, "status_code", None) == 429:
+            await limiter.apenalize(delay)
+
+    async def primary(leg: Optional[HedgeLeg] = None) -> Tuple[str, int, int, str]:
+        async def attempt(remaining: Optional[float]) -> Tuple[str, int, int, str]:
+            await limiter.aacquire(estimated_tokens)
+            return await send(client, data, remaining)
+
+        # Same policy and circuit breaker as the synchronous path
+        return await get_retry_policy().acall(attempt, on_retry=on_retry)
+
+    hedger = get_hedge_policy()
+    if hedger is None:
+        return await primary()
+
+    hedge_client = get_async_hedge_client(client)
+    hedge_data = {**data, "model": hedge_client.model}
+
+    async def hedge(leg: HedgeLeg) -> Tuple[str, int, int, str]:
+        # A single attempt on budget already taken by try_budget
+        return await send(hedge_client, hedge_data, None)
+
+    return await hedger.arun(
+        primary, hedge,
+        try_budget=lambda: limiter.try_acquire(estimated_tokens) == 0.0,
+        delay=hedger.hedge_delay({"model": client.model, **(labels or {})}),
+        model=client.model
+    )
+
+
+async def acall_llm(input_prompt: str, client: Optional[AsyncTogetherClient] = None, **kwargs) -> str:
+    """
+    Async counterpart of api.safe_call_llm.
+
+    Uses the same response cache, log files and token totals as the
+    synchronous path. Cache reads and writes and the log call run in worker
+    threads, since they commit to SQLite.
+
+    Args:
+        input_prompt: The prompt to send to the LLM
+        client: Client to use (defaults to the client of the running loop)
+        **kwargs: Additional context for logging
+
+    Returns:
+        Generated response text
+    """
+    client = client or get_async_client()
+
+    cache = get_cache()
+    cache_key = make_cache_key(client.model, input_prompt, api.SAMPLING_PARAMS)
+    labels = api._llm_labels(client.model, kwargs)
+    cached = await asyncio.to_thread(cache.get, cache_key) if cache.enabled else None
+    if cached is not None:
+        get_metrics().inc("llm_requests_total", outcome="cached", **labels)
+        await asyncio.to_thread(api._log_llm_call, input_prompt, cached["response"], cached["prompt_tokens"],
+                                cached["response_tokens"], cached=True, model=client.model, **kwargs)
+        return cached["response"]
+
+    start_time = time.time()
+    try:
+        sys_response, prompt_token, response_token, answered_by = await atogether_api_call(input_prompt, client, labels)
+    except Exception:
+        get_metrics().inc("llm_requests_total", outcome="error", **labels)
+        raise
+    if answered_by != client.model:
+        # A hedge to LLM_HEDGE_MODEL won: cache, log and count the answer under that model
+        labels = api._llm_labels(answered_by, kwargs)
+        cache_key = make_cache_key(answered_by, input_prompt, api.SAMPLING_PARAMS)
+    api._record_llm_metrics(labels, time.time() - start_time, prompt_token, response_token)
+    if cache.enabled:
+        await asyncio.to_thread(cache.put, cache_key, answered_by, sys_response, prompt_token, response_token)
+    await asyncio.to_thread(api._log_llm_call, input_prompt, sys_response, prompt_token, response_token,
+                            model=answered_by, **kwargs)
+    return sys_response
+
+
+async def acall_llm_many(prompts: List[str], **kwargs) -> List[Any]:
+    """
+    Run several prompts concurrently, bounded by the client's in-flight cap.
+
+    Args:
+        prompts: Prompts to send
+        **kwargs: Additional context for logging (shared by all prompts)
+
+    Returns:
+        Responses in prompt order; failed prompts yield their exception
+    """
+    return await asyncio.gather(*[acall_llm(p, **kwargs) for p in prompts], return_exceptions=True)
@@ -14,9 +14,29 @@ from typing import List, Dict, Any, Optional
 
 from core.agents import Selector, Refiner
 from core.const import SYSTEM_NAME
+from core.selector_cache import make_version
 
 logger = logging.getLogger(__name__)
 
+bird_selector_template = """Given the following database schema and a question, identify the tables and columns that are relevant for answering the question.
+
+DATABASE SCHEMA:
+{db_schema}
+
+FOREIGN KEY CONSTRAINTS:
+{db_fk}
+
+QUESTION: {query}
+{evidence_prompt}
+Think step by step to select the relevant tables and columns for answering this question.
+First, identify key entities and conditions from the question.
+Then, trace through the schema to find matching tables and their relationships.
+Focus on tables and columns that are directly relevant to the question.
+Consider join conditions needed to connect relevant tables.
+
+PRUNED DATABASE SCHEMA:"""
+
+
 class EnhancedBirdSelector(Selector):
     """
     Enhanced Selector agent for BIRD dataset.
@@ -182,23 +202,8 @@ Evidence: {evidence}
 This evidence provides additional context that might help identify relevant tables and columns.
 """
             
-            prompt = f"""Given the following database schema and a question, identify the tables and columns that are relevant for answering the question.
-
-DATABASE SCHEMA:
-{db_schema}
-
-FOREIGN KEY CONSTRAINTS:
-{db_fk}
-
-QUESTION: {query}
-{evidence_prompt}
-Think step by step to select the relevant tables and columns for answering this question.
-First, identify key entities and conditions from the question.
-Then, trace through the schema to find matching tables and their relationships.
-Focus on tables and columns that are directly relevant to the question.
-Consider join conditions needed to connect relevant tables.
-
-PRUNED DATABASE SCHEMA:"""
+            prompt = bird_selector_template.format(db_schema=db_schema, db_fk=db_fk, query=query,
+                                                   evidence_prompt=evidence_prompt)
             
             # Call LLM for pruning
             logger.info(f"Using enhanced BIRD pruning for {db_id}")
@@ -209,6 +214,20 @@ PRUNED DATABASE SCHEMA:"""
             # Use original method for other datasets
             return super()._prune(db_id, query, db_schema, db_fk, evidence)
     
+    def _decision_version(self, db_id: str) -> str:
+        """
+        Version of the cached Selector decisions, including the BIRD pruning prompt.
+        
+        Args:
+            db_id: Database ID
+            
+        Returns:
+            Version hash (see core/selector_cache.py)
+        """
+        if self.dataset_name.lower() == 'bird':
+            return make_version(super()._decision_version(db_id), bird_selector_template)
+        return super()._decision_version(db_id)
+    
     def talk(self, message: Dict):
         """Enhanced talk method with BIRD dataset optimizations"""
         if self.dataset_name.lower() == 'bird':
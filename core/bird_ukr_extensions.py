@@ -4,20 +4,20 @@ Extensions for the BIRD-UKR dataset.
 Provides PostgreSQL-compatible agents for the Ukrainian BIRD dataset.
 """
 
-import os
 import logging
 import time
 import json
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Dict, List, Any, Tuple, Optional
 
 from utils.pg_selector import PostgreSQLSelector
 from core.agents import Decomposer, Refiner, BaseAgent
 from core.const_ukr import SELECTOR_NAME, DECOMPOSER_NAME, REFINER_NAME, refiner_template_ukr
-from core.utils import parse_sql_from_string
+from core.utils import parse_sql_from_string, sql_block_closed, extract_world_info
 from core.api import safe_call_llm
-from utils.pg_connection import get_pool_connection, return_connection
+from core.metrics import get_metrics
+from core.value_index import lookup_values, format_value_hints
+from utils.pg_connection import connection
 
 logger = logging.getLogger(__name__)
 
@@ -41,12 +41,6 @@ class PostgreSQLRefiner(BaseAgent):
         self.model_name = model_name
         self.dataset_name = dataset_name
         
-        # Get PostgreSQL credentials from environment
-        self.pg_user = os.environ.get('PG_USER', 'postgres')
-        self.pg_password = os.environ.get('PG_PASSWORD', '')
-        self.pg_host = os.environ.get('PG_HOST', 'localhost')
-        self.pg_port = os.environ.get('PG_PORT', '5432')
-        
         logger.info("Initialized PostgreSQL Refiner")
     
     def talk(self, message: Dict[str, Any]) -> Dict[str, Any]:
@@ -84,7 +78,9 @@ class PostgreSQLRefiner(BaseAgent):
         
         # Try to execute the SQL
         logger.info(f"Executing SQL query against {db_id}: {pred_sql}")
+        exec_start = time.time()
         success, result, error = self._execute_sql(db_id, pred_sql)
+        get_metrics().observe("db_execution_seconds", time.time() - exec_start, agent=self.name, db_id=db_id)
         
         # Check if we need to refine
         if not success and try_times < 3:
@@ -97,7 +93,8 @@ class PostgreSQLRefiner(BaseAgent):
                 desc_str=desc_str, 
                 fk_str=fk_str, 
                 sql=pred_sql, 
-                sqlite_error=error
+                sqlite_error=error,
+                world_info=extract_world_info(message)
             )
             
             if new_sql and new_sql != pred_sql:
@@ -126,33 +123,19 @@ class PostgreSQLRefiner(BaseAgent):
             Tuple of (success, result, error_message)
         """
         try:
-            # Create connection
-            conn = psycopg2.connect(
-                dbname=db_id,
-                user=self.pg_user,
-                password=self.pg_password,
-                host=self.pg_host,
-                port=self.pg_port
-            )
-            
-            # Create cursor
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Set timeout (30 seconds)
-            cursor.execute("SET statement_timeout = 30000")
-            
-            # Execute query
-            start_time = time.time()
-            cursor.execute(sql)
-            result = cursor.fetchall()
-            execution_time = time.time() - start_time
-            
-            # Convert result to list of dictionaries
-            result_list = [dict(row) for row in result]
-            
-            # Close cursor and connection
-            cursor.close()
-            conn.close()
+            # Borrow a pooled connection; its session already has the statement timeout
+            with connection(db_id, agent=self.name) as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                
+                # Execute query
+                start_time = time.time()
+                cursor.execute(sql)
+                result = cursor.fetchall()
+                execution_time = time.time() - start_time
+                
+                # Convert result to list of dictionaries
+                result_list = [dict(row) for row in result]
+                cursor.close()
             
             logger.info(f"SQL executed successfully in {execution_time:.2f}s. Rows: {len(result_list)}")
             return True, result_list, None
@@ -162,7 +145,8 @@ class PostgreSQLRefiner(BaseAgent):
             return False, None, str(e)
     
     def _refine(self, query: str, evidence: str, desc_str: str, 
-                fk_str: str, sql: str, sqlite_error: str) -> str:
+                fk_str: str, sql: str, sqlite_error: str,
+                world_info: Optional[Dict[str, Any]] = None) -> str:
         """
         Refine the SQL query based on the error.
         
@@ -173,11 +157,18 @@ class PostgreSQLRefiner(BaseAgent):
             fk_str: Foreign key description
             sql: Original SQL query that failed
             sqlite_error: Error message from PostgreSQL
+            world_info: Question context for value lookup and logging (see core.utils.extract_world_info)
             
         Returns:
             Refined SQL query
         """
+        world_info = world_info or {}
         try:
+            # Point the LLM at the stored spelling of values quoted in the question
+            value_hints = format_value_hints(lookup_values(world_info.get("db_id", ""), query))
+            if value_hints:
+                evidence = f"{evidence}\nValues mentioned in the question:\n{value_hints}".strip()
+            
             # Create prompt for the LLM
             prompt = refiner_template_ukr.format(
                 question=query,
@@ -190,7 +181,7 @@ class PostgreSQLRefiner(BaseAgent):
             )
             
             # Call the LLM
-            response = safe_call_llm(prompt)
+            response = safe_call_llm(prompt, stop_when=sql_block_closed, **world_info)
             
             # Parse the SQL from the response
             new_sql = parse_sql_from_string(response)
@@ -18,6 +18,8 @@ except:
 import time
 from pprint import pprint
 
+from core.metrics import get_metrics
+
 # Initialize debugger if available
 try:
     from core.debug_llm import debugger
@@ -151,6 +153,12 @@ class ChatManager(object):
         
         end_time = time.time()
         exec_time = end_time - start_time
+        
+        metrics = get_metrics()
+        db_id = user_message.get('db_id', '')
+        metrics.observe('question_seconds', exec_time, db_id=db_id)
+        # try_times counts Refiner passes; the first pass only executes the SQL
+        metrics.observe('refine_rounds', max(0, user_message.get('try_times', 0) - 1), db_id=db_id)
         print(f"\033[0;34mExecute {exec_time} seconds\033[0m", flush=True)
 
 
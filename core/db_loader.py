@@ -0,0 +1,126 @@
+"""
+Parallel Database Info Loader for MAC-SQL
+
+`Selector(lazy=False)` profiles every database of a dataset before the first
+question. The databases are independent, so this module spreads the work
+over a process pool. Each worker receives a copy of the Selector once, at
+start-up, and then builds one database info after the other with
+`Selector._load_single_db_info`. That path also goes through the on-disk
+profile cache.
+
+A database that fails to load is reported and skipped; it does not abort the
+others. Results are merged into `selector.db2infos` as they arrive.
+
+Configuration (environment variables):
+    DB_LOAD_WORKERS: Worker processes for cold-start loading (default: CPU count,
+        1 loads serially in the calling process)
+"""
+
+import os
+import time
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Tuple
+
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# Selector copy of each worker process, set by _init_worker
+_worker_selector = None
+
+
+def default_workers() -> int:
+    """Worker count from DB_LOAD_WORKERS, falling back to the CPU count."""
+    return max(1, int(os.getenv("DB_LOAD_WORKERS", os.cpu_count() or 1)))
+
+
+def list_db_ids(data_path: str) -> List[str]:
+    """
+    Databases of a dataset directory (sub-directories holding <db_id>.sqlite).
+
+    Args:
+        data_path: Dataset database directory
+
+    Returns:
+        Sorted database identifiers
+    """
+    return sorted(
+        name for name in os.listdir(data_path)
+        if os.path.isfile(os.path.join(data_path, name, f"{name}.sqlite"))
+    )
+
+
+def _init_worker(selector) -> None:
+    global _worker_selector
+    _worker_selector = selector
+
+
+def _load_one(selector, db_id: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[str], float]:
+    """Build one database info; errors are returned instead of raised."""
+    start = time.time()
+    try:
+        return db_id, selector._load_single_db_info(db_id), None, time.time() - start
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+        return db_id, None, error, time.time() - start
+
+
+def _load_in_worker(db_id: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[str], float]:
+    return _load_one(_worker_selector, db_id)
+
+
+def load_db_infos(selector, db_ids: Optional[List[str]] = None, workers: Optional[int] = None,
+                  show_progress: bool = True) -> Dict[str, str]:
+    """
+    Load the info of many databases into `selector.db2infos`.
+
+    Args:
+        selector: Selector whose `_load_single_db_info` builds one database info
+        db_ids: Databases to load (default: all databases under selector.data_path)
+        workers: Worker processes (default: DB_LOAD_WORKERS or CPU count; 1 loads serially)
+        show_progress: Show a progress bar with the database just finished
+
+    Returns:
+        Dictionary mapping failed database identifiers to their error messages
+    """
+    if db_ids is None:
+        db_ids = list_db_ids(selector.data_path)
+    db_ids = [db_id for db_id in db_ids if db_id not in selector.db2infos]
+    workers = min(workers or default_workers(), max(1, len(db_ids)))
+    errors: Dict[str, str] = {}
+    if not db_ids:
+        return errors
+
+    progress = tqdm(total=len(db_ids), desc="Loading db info", disable=not show_progress)
+
+    def collect(result) -> None:
+        db_id, db_info, error, seconds = result
+        if error is None:
+            selector.db2infos[db_id] = db_info
+            logger.debug(f"Loaded {db_id} in {seconds:.2f}s")
+        else:
+            errors[db_id] = error
+            logger.error(f"Failed to load database {db_id}: {error.splitlines()[0]}")
+        progress.set_postfix_str(db_id)
+        progress.update(1)
+
+    start = time.time()
+    try:
+        if workers <= 1:
+            for db_id in db_ids:
+                collect(_load_one(selector, db_id))
+        else:
+            # The Selector is pickled once per worker instead of once per task
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(selector,)) as pool:
+                futures = [pool.submit(_load_in_worker, db_id) for db_id in db_ids]
+                for future in as_completed(futures):
+                    collect(future.result())
+    finally:
+        progress.close()
+
+    logger.info(f"Loaded {len(db_ids) - len(errors)}/{len(db_ids)} databases with {workers} "
+                f"worker(s) in {time.time() - start:.1f}s")
+    return errors
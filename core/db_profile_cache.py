@@ -0,0 +1,241 @@
+"""
+Database Profile Cache for MAC-SQL
+
+`Selector._load_single_db_info` reads every table of a database to collect
+value examples for the schema prompt. This module persists the resulting
+profile (desc_dict, value_dict, pk_dict, fk_dict) as one JSON file per
+database file, so every worker process and every later run loads it from disk
+instead of scanning the database again.
+
+A profile is valid as long as the database file is unchanged and it was built
+from the same tables.json entry by the same profiling code. The database file
+is identified by size, mtime and SHA-256 of its content; the content hash is
+only recomputed when size or mtime change, so a copied but identical file
+keeps its profile.
+
+Configuration (environment variables):
+    DB_PROFILE_CACHE_DIR: Directory of the profile files (default ./cache/db_profiles,
+        relative to the working directory; "off" disables the cache)
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump when the profiling code changes so stale profiles are rebuilt
+PROFILE_VERSION = 5
+
+DEFAULT_CACHE_DIR = os.path.join(".", "cache", "db_profiles")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(path: str) -> str:
+    """
+    SHA-256 of a file's content.
+
+    Args:
+        path: File path
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_schema_key(db_json: Dict[str, Any], *extra: Any) -> str:
+    """
+    Identify the inputs a profile was built from besides the database file.
+
+    Args:
+        db_json: The database's tables.json entry
+        *extra: Other inputs of the profiling code (dataset name, selector class, ...)
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps({"db": db_json, "extra": [str(e) for e in extra], "version": PROFILE_VERSION},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DBProfileCache:
+    """
+    One JSON file per database holding its profile and the fingerprint it was built from.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory of the profile files (created on first write)
+        """
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        # One builder per database file within a process; other threads wait for its result
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, db_id: str, db_path: str) -> str:
+        # Datasets reuse db_ids (Spider and BIRD both have e.g. "college_2"); the path keeps them apart
+        path_hash = hashlib.sha256(os.path.abspath(db_path).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{db_id}.{path_hash}.profile.json")
+
+    def load(self, db_id: str, db_path: str, schema_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Read a profile if it is still valid for the database file.
+
+        Args:
+            db_id: Database identifier
+            db_path: Path of the database file
+            schema_key: Result of make_schema_key for the current inputs
+
+        Returns:
+            The profile, or None if missing or stale
+        """
+        path = self._path(db_id, db_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable profile {path}: {str(e)}")
+            return None
+
+        if entry.get("version") != PROFILE_VERSION or entry.get("schema_key") != schema_key:
+            return None
+
+        stat = os.stat(db_path)
+        fingerprint = entry.get("fingerprint", {})
+        if fingerprint.get("size") != stat.st_size:
+            return None
+        if fingerprint.get("mtime_ns") != stat.st_mtime_ns:
+            # Touched or copied: still valid if the content is identical
+            if fingerprint.get("sha256") != file_content_hash(db_path):
+                return None
+            fingerprint["mtime_ns"] = stat.st_mtime_ns
+            self._write(path, entry)
+
+        return entry["profile"]
+
+    def save(self, db_id: str, db_path: str, schema_key: str, profile: Dict[str, Any]) -> None:
+        """
+        Store a profile together with the fingerprint of the database file.
+
+        Args:
+            db_id: Database identifier
+            db_path: Path of the database file the profile was built from
+            schema_key: Result of make_schema_key for the current inputs
+            profile: JSON-serializable profile
+        """
+        stat = os.stat(db_path)
+        entry = {
+            "version": PROFILE_VERSION,
+            "db_id": db_id,
+            "schema_key": schema_key,
+            "fingerprint": {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_content_hash(db_path)
+            },
+            "profile": profile
+        }
+        self._write(self._path(db_id, db_path), entry)
+
+    def _write(self, path: str, entry: Dict[str, Any]) -> None:
+        """Write atomically so concurrent readers never see a partial file."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get_or_build(self, db_id: str, db_path: str, schema_key: str,
+                     build: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Load the profile of a database, building and storing it on a miss.
+
+        Args:
+            db_id: Database identifier
+            db_path: Path of the database file
+            schema_key: Result of make_schema_key for the current inputs
+            build: Computes the profile from the database
+
+        Returns:
+            The profile
+        """
+        with self._lock:
+            build_lock = self._build_locks.setdefault(self._path(db_id, db_path), threading.Lock())
+        with build_lock:
+            profile = self.load(db_id, db_path, schema_key)
+            if profile is not None:
+                self.hits += 1
+                return profile
+
+            self.misses += 1
+            logger.info(f"Profiling database {db_id} (no valid cached profile)")
+            profile = build()
+            try:
+                self.save(db_id, db_path, schema_key, profile)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Could not cache profile of {db_id}: {str(e)}")
+            return profile
+
+    def invalidate(self, db_id: str, db_path: str) -> None:
+        """
+        Drop the stored profile of a database.
+
+        Args:
+            db_id: Database identifier
+            db_path: Path of the database file
+        """
+        path = self._path(db_id, db_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Process-wide cache, None when disabled
+_profile_cache = None
+_profile_cache_loaded = False
+_profile_cache_lock = threading.Lock()
+
+def get_profile_cache() -> Optional[DBProfileCache]:
+    """Get the process-wide profile cache, or None if DB_PROFILE_CACHE_DIR is "off"."""
+    global _profile_cache, _profile_cache_loaded
+    if not _profile_cache_loaded:
+        with _profile_cache_lock:
+            if not _profile_cache_loaded:
+                cache_dir = os.getenv("DB_PROFILE_CACHE_DIR", DEFAULT_CACHE_DIR)
+                if cache_dir and cache_dir.lower() != "off":
+                    _profile_cache = DBProfileCache(cache_dir)
+                _profile_cache_loaded = True
+    return _profile_cache
+
+def set_profile_cache(cache: Optional[DBProfileCache]) -> None:
+    """
+    Replace the process-wide profile cache.
+
+    Args:
+        cache: The cache to use, or None to disable caching
+    """
+    global _profile_cache, _profile_cache_loaded
+    with _profile_cache_lock:
+        _profile_cache = cache
+        _profile_cache_loaded = True
@@ -30,7 +30,8 @@ def get_db_connection(dataset_name, db_id, db_base_path=None):
         db_base_path: Base path for SQLite databases (only used for SQLite)
         
     Returns:
-        tuple: (connection, db_type)
+        tuple: (connection, db_type). PostgreSQL connections come from the
+        pool in utils/pg_connection.py and go back to it on close().
     """
     conn = None
     db_type = 'sqlite'  # Default
@@ -50,15 +51,11 @@ def get_db_connection(dataset_name, db_id, db_base_path=None):
             raise ImportError("psycopg2 is required for PostgreSQL connections. "
                               "Please install it with: pip install psycopg2-binary")
         
+        # Borrowed from the shared pool; conn.close() returns it
+        from utils.pg_connection import get_connection_pool
         try:
-            conn = psycopg2.connect(
-                host=os.getenv("PG_HOST", "localhost"),
-                port=os.getenv("PG_PORT", "5432"),
-                user=os.getenv("PG_USER", "postgres"),
-                password=os.getenv("PG_PASSWORD", ""),
-                dbname=db_id
-            )
-        except psycopg2.Error as e:
+            conn = get_connection_pool(db_id).acquire()
+        except (psycopg2.Error, ConnectionError) as e:
             raise ConnectionError(f"Failed to connect to PostgreSQL database {db_id}: {e}")
     
     # SQLite connection
@@ -58,7 +58,7 @@ class LLMDebugger:
         # Write to log file
         log_file = os.path.join(self.log_dir, f"llm_debug_{datetime.now().strftime('%Y%m%d')}.jsonl")
         with open(log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + "\n")
+            f.write(json.dumps(log_entry, default=str) + "\n")
         
         # Also log to console in debug mode
         logger.debug(f"LLM Call: {agent_name}")
@@ -51,7 +51,8 @@ class PgEnhancedChatManager:
             db_id: Database identifier
             
         Returns:
-            tuple: (connection, db_type)
+            tuple: (connection, db_type). PostgreSQL connections are borrowed
+            from the shared pool; close() returns them.
         """
         # Use the unified connection function from db_utils
         db_base_path = self.config.get('db_path', None)
@@ -103,7 +104,11 @@ class PgEnhancedChatManager:
         conn, db_type = self.get_database_connection(db_id)
         
         # Get database schema
-        schema_str = self.get_database_schema(conn, db_type)
+        try:
+            schema_str = self.get_database_schema(conn, db_type)
+        finally:
+            # Return the connection to the pool (or close the SQLite file)
+            conn.close()
         
         # Here would be the existing logic for:
         # 1. Running the Selector agent
@@ -0,0 +1,296 @@
+"""
+Hedged LLM Requests for MAC-SQL
+
+A few LLM calls per run hang for tens of seconds and dominate the p99 latency
+of a question. With hedging enabled, a call that has not returned after a
+percentile of recent LLM latency (taken from `llm_request_seconds` in
+core/metrics.py) gets a duplicate request, optionally sent to a fallback model
+or endpoint. Whichever answers first is used and the other one is cancelled:
+its connection is closed, which ends generation server-side for streamed
+completions.
+
+A hedge is only sent if the shared rate limiter can pay for it right away, so
+hedges never push the host over its RPM/TPM budget and never wait for it.
+
+Configuration (environment variables):
+    LLM_HEDGE: "1" enables hedging (default "0")
+    LLM_HEDGE_PERCENTILE: Latency percentile after which the hedge fires (default 95)
+    LLM_HEDGE_MIN_SAMPLES: Recent latencies needed before hedging starts (default 20)
+    LLM_HEDGE_MIN_DELAY: Never hedge earlier than this many seconds (default 2)
+    LLM_HEDGE_MODEL: Model for the hedge request (default: the primary model)
+    LLM_HEDGE_API_BASE: API base URL for the hedge request (default: the primary endpoint)
+    LLM_HEDGE_MAX_WORKERS: Threads running hedged legs (default 32)
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Callable, Optional
+
+from core.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 95.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_MIN_DELAY = 2.0
+DEFAULT_MAX_WORKERS = 32
+
+
+class HedgeCancelled(Exception):
+    """Raised inside a leg that lost the race; never retried."""
+    retryable = False
+
+
+class HedgeLeg:
+    """
+    Cancellation handle of one request of a hedged pair.
+
+    The request code registers its in-flight HTTP response with `attach` and
+    checks `cancelled` between attempts and stream chunks; `cancel` closes the
+    attached response from the winning thread.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cancelled = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        """Raise HedgeCancelled if the other leg already won."""
+        if self._cancelled.is_set():
+            raise HedgeCancelled(f"{self.name} request cancelled, the other request answered first")
+
+    def attach(self, response: Any) -> None:
+        """
+        Register the in-flight response so `cancel` can close it.
+
+        Args:
+            response: Object with a close() method (requests.Response)
+        """
+        with self._lock:
+            self._response = response
+        if self._cancelled.is_set():
+            self._close(response)
+
+    def detach(self) -> None:
+        """Forget the response once it has been read."""
+        with self._lock:
+            self._response = None
+
+    def cancel(self) -> None:
+        """Mark the leg as lost and close its connection."""
+        self._cancelled.set()
+        with self._lock:
+            response = self._response
+        if response is not None:
+            self._close(response)
+
+    @staticmethod
+    def _close(response: Any) -> None:
+        try:
+            response.close()
+        except Exception:
+            pass
+
+
+class HedgePolicy:
+    """
+    Decides when to hedge and races the primary request against the hedge.
+    """
+
+    def __init__(self, percentile: float = DEFAULT_PERCENTILE, min_samples: int = DEFAULT_MIN_SAMPLES,
+                 min_delay: float = DEFAULT_MIN_DELAY, max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        Initialize the policy.
+
+        Args:
+            percentile: Latency percentile in [0, 100] after which the hedge is sent
+            min_samples: Recent latencies required before hedging
+            min_delay: Lower bound of the hedge delay in seconds
+            max_workers: Threads available for running legs
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+
+    def hedge_delay(self, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        """
+        Seconds to wait for the primary request before sending the hedge.
+
+        Uses the latency history of the same model and agent, falling back to
+        the model alone while the agent has too few samples.
+
+        Args:
+            labels: Metric labels of the call (model, agent)
+
+        Returns:
+            The delay, or None while there is not enough history to hedge
+        """
+        labels = labels or {}
+        metrics = get_metrics()
+        candidates = [{k: labels[k] for k in ("model", "agent") if labels.get(k)}]
+        if labels.get("model"):
+            candidates.append({"model": labels["model"]})
+        for selector in candidates:
+            value = metrics.percentile("llm_request_seconds", self.percentile,
+                                       min_samples=self.min_samples, **selector)
+            if value is not None:
+                return max(self.min_delay, value)
+        return None
+
+    def run(self, primary: Callable[[HedgeLeg], Any], hedge: Callable[[HedgeLeg], Any],
+            try_budget: Callable[[], bool], delay: Optional[float], model: str = "") -> Any:
+        """
+        Run `primary`, racing it against `hedge` if it is slower than `delay`.
+
+        Args:
+            primary: The normal request; receives its leg for cancellation checks
+            hedge: The duplicate request; receives its leg
+            try_budget: Takes rate-limit budget for the hedge without waiting;
+                returns False if the budget is exhausted
+            delay: Seconds before hedging (None runs only the primary)
+            model: Model label of the metrics
+
+        Returns:
+            Result of the first leg that succeeds
+
+        Raises:
+            Exception: The primary's error if no leg succeeds
+        """
+        primary_leg = HedgeLeg("primary")
+        if delay is None:
+            return primary(primary_leg)
+
+        metrics = get_metrics()
+        primary_future = self._executor.submit(primary, primary_leg)
+        done, _ = wait([primary_future], timeout=delay)
+        if done:
+            return primary_future.result()
+
+        if not try_budget():
+            metrics.inc("llm_hedges_total", outcome="no_budget", model=model)
+            return primary_future.result()
+
+        logger.info(f"LLM request slower than {delay:.1f}s, sending hedge request")
+        metrics.inc("llm_hedges_total", outcome="sent", model=model)
+        hedge_leg = HedgeLeg("hedge")
+        hedge_future = self._executor.submit(hedge, hedge_leg)
+        legs = {primary_future: primary_leg, hedge_future: hedge_leg}
+
+        pending = set(legs)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                # Winner found: cancel whatever is still running
+                for other, leg in legs.items():
+                    if other is not future:
+                        leg.cancel()
+                if future is hedge_future:
+                    metrics.inc("llm_hedges_total", outcome="won", model=model)
+                    logger.info("Hedge request answered first")
+                return future.result()
+
+        # Both legs failed; report the primary's error
+        return primary_future.result()
+
+    async def arun(self, primary: Callable[[HedgeLeg], Any], hedge: Callable[[HedgeLeg], Any],
+                   try_budget: Callable[[], bool], delay: Optional[float], model: str = "") -> Any:
+        """
+        Async version of run; `primary` and `hedge` return awaitables and the loser task is cancelled.
+
+        `try_budget` is the same blocking check as in run and is called in a worker thread.
+        """
+        primary_leg = HedgeLeg("primary")
+        if delay is None:
+            return await primary(primary_leg)
+
+        metrics = get_metrics()
+        primary_task = asyncio.ensure_future(primary(primary_leg))
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done:
+            return primary_task.result()
+
+        if not await asyncio.to_thread(try_budget):
+            metrics.inc("llm_hedges_total", outcome="no_budget", model=model)
+            return await primary_task
+
+        logger.info(f"LLM request slower than {delay:.1f}s, sending hedge request")
+        metrics.inc("llm_hedges_total", outcome="sent", model=model)
+        hedge_task = asyncio.ensure_future(hedge(HedgeLeg("hedge")))
+
+        pending = {primary_task, hedge_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                for other in pending:
+                    other.cancel()
+                if task is hedge_task:
+                    metrics.inc("llm_hedges_total", outcome="won", model=model)
+                    logger.info("Hedge request answered first")
+                return task.result()
+
+        return primary_task.result()
+
+    def shutdown(self) -> None:
+        """Stop the leg threads (running legs finish in the background)."""
+        self._executor.shutdown(wait=False)
+
+
+# Process-wide policy, None while hedging is disabled
+_policy = None
+_policy_loaded = False
+_policy_lock = threading.Lock()
+
+def get_hedge_policy() -> Optional[HedgePolicy]:
+    """Get the process-wide hedge policy, or None if LLM_HEDGE is not enabled."""
+    global _policy, _policy_loaded
+    if not _policy_loaded:
+        with _policy_lock:
+            if not _policy_loaded:
+                if os.getenv("LLM_HEDGE", "0") == "1":
+                    _policy = HedgePolicy(
+                        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", DEFAULT_PERCENTILE)),
+                        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", DEFAULT_MIN_SAMPLES)),
+                        min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", DEFAULT_MIN_DELAY)),
+                        max_workers=int(os.getenv("LLM_HEDGE_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+                    )
+                _policy_loaded = True
+    return _policy
+
+def set_hedge_policy(policy: Optional[HedgePolicy]) -> None:
+    """
+    Replace the process-wide hedge policy.
+
+    Args:
+        policy: The policy to use, or None to disable hedging
+    """
+    global _policy, _policy_loaded
+    with _policy_lock:
+        old_policy = _policy
+        _policy = policy
+        _policy_loaded = True
+    if old_policy is not None and old_policy is not policy:
+        old_policy.shutdown()
+
+def reset_hedge_policy() -> None:
+    """Drop the policy so LLM_HEDGE_* are re-read on next use."""
+    global _policy, _policy_loaded
+    with _policy_lock:
+        old_policy = _policy
+        _policy = None
+        _policy_loaded = False
+    if old_policy is not None:
+        old_policy.shutdown()
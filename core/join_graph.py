@@ -0,0 +1,275 @@
+"""
+Foreign Key Join Graph for MAC-SQL
+
+The Selector often keeps the tables a question names but drops the bridge
+tables needed to join them. The Decomposer then writes a join over a missing
+table, and the Refiner spends rounds on "missing FROM-clause entry" errors.
+
+This module builds an undirected graph of one database's tables with an edge
+per foreign key and precomputes all-pairs shortest join paths (breadth-first
+search, every join counts 1). Given the tables a Selector keeps, `connect`
+adds the fewest bridge tables that join them, a Steiner tree approximation:
+a minimum spanning tree over the shortest-path distances between the chosen
+tables, expanded into the paths and pruned of bridge tables that do not lie
+between two chosen tables. Ties are broken by table order, so the result
+depends only on the schema and the chosen tables.
+
+Configuration (environment variables):
+    SELECTOR_JOIN_PATHS: Set to 1 to let the Selectors add bridge tables (default off)
+"""
+
+import os
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (from_table, from_column, to_table, to_column)
+Join = Tuple[str, str, str, str]
+
+
+class JoinPlan:
+    """
+    Tables connecting a Selector's choice and the joins between them.
+
+    `tables` holds the chosen tables followed by the bridges and `joins` the
+    column pairs of one foreign key per tree edge (several for a composite key). `unconnected` lists chosen tables that have
+    no join path to the chosen tables before them (another component).
+    """
+
+    def __init__(self, tables: List[str], bridges: List[str], joins: List[Join], unconnected: List[str]):
+        self.tables = tables
+        self.bridges = bridges
+        self.joins = joins
+        self.unconnected = unconnected
+
+    def join_columns(self, table: str) -> List[str]:
+        """Columns of a table used by the plan's joins."""
+        columns = []
+        for from_table, from_col, to_table, to_col in self.joins:
+            if from_table == table and from_col not in columns:
+                columns.append(from_col)
+            if to_table == table and to_col not in columns:
+                columns.append(to_col)
+        return columns
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary for messages and logs."""
+        return {
+            "bridges": self.bridges,
+            "joins": [f"{a}.{b} = {c}.{d}" for a, b, c, d in self.joins],
+            "unconnected": self.unconnected
+        }
+
+
+class JoinGraph:
+    """
+    Foreign key graph of one database with all-pairs shortest join paths.
+    """
+
+    def __init__(self, tables: List[str], foreign_keys: List[Join], constraints: Optional[List[Any]] = None):
+        """
+        Build the graph and its shortest paths.
+
+        Args:
+            tables: Table names, in schema order (the tie-break order)
+            foreign_keys: (from_table, from_column, to_table, to_column) for every foreign key column pair
+            constraints: Constraint id of each column pair; pairs with the same id form one
+                composite key (default: every pair is a key of its own)
+        """
+        self.tables = list(dict.fromkeys(tables))
+        self.order = {t: i for i, t in enumerate(self.tables)}
+        # table -> neighbour -> joins between the two, stored in from -> to direction
+        self.edges: Dict[str, Dict[str, List[Join]]] = {t: {} for t in self.tables}
+        self.constraints: Dict[Join, Any] = {}
+        for i, fk in enumerate(foreign_keys):
+            self.constraints.setdefault(fk, constraints[i] if constraints is not None else fk)
+            from_table, _, to_table, _ = fk
+            if from_table not in self.order or to_table not in self.order or from_table == to_table:
+                continue
+            for a, b in ((from_table, to_table), (to_table, from_table)):
+                joins = self.edges[a].setdefault(b, [])
+                if fk not in joins:
+                    joins.append(fk)
+        for t in self.tables:
+            self.edges[t] = dict(sorted(self.edges[t].items(), key=lambda item: self.order[item[0]]))
+
+        # dist[s][t] hops, parent[s][t] previous table on the shortest path from s to t
+        self.dist: Dict[str, Dict[str, int]] = {}
+        self.parent: Dict[str, Dict[str, str]] = {}
+        for source in self.tables:
+            self._bfs(source)
+
+    def _bfs(self, source: str) -> None:
+        dist = {source: 0}
+        parent = {}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            for neighbour in self.edges[table]:
+                if neighbour not in dist:
+                    dist[neighbour] = dist[table] + 1
+                    parent[neighbour] = table
+                    queue.append(neighbour)
+        self.dist[source] = dist
+        self.parent[source] = parent
+
+    def distance(self, a: str, b: str) -> Optional[int]:
+        """Number of joins between two tables, or None if they are not connected."""
+        return self.dist.get(a, {}).get(b)
+
+    def path(self, a: str, b: str) -> Optional[List[str]]:
+        """
+        Tables on a shortest join path.
+
+        Args:
+            a: First table
+            b: Last table
+
+        Returns:
+            [a, ..., b], or None if the tables are not connected
+        """
+        if self.distance(a, b) is None:
+            return None
+        tables = [b]
+        while tables[-1] != a:
+            tables.append(self.parent[a][tables[-1]])
+        return tables[::-1]
+
+    def join(self, a: str, b: str) -> List[Join]:
+        """
+        The foreign key joining two adjacent tables (the first one if there are several).
+
+        Args:
+            a: First table
+            b: Adjacent table
+
+        Returns:
+            All column pairs of that foreign key, one for a single-column key
+        """
+        joins = self.edges[a][b]
+        constraint = self.constraints[joins[0]]
+        return [fk for fk in joins if self.constraints[fk] == constraint]
+
+    def connect(self, tables: List[str]) -> JoinPlan:
+        """
+        Add the bridge tables that join the chosen tables (Steiner tree approximation).
+
+        Args:
+            tables: Chosen tables; names not in the graph are ignored
+
+        Returns:
+            JoinPlan with the chosen tables followed by the bridges
+        """
+        terminals = sorted({t for t in tables if t in self.order}, key=self.order.get)
+        if len(terminals) < 2:
+            return JoinPlan(list(terminals), [], [], [])
+
+        # Prim's minimum spanning tree over the shortest-path distances of the chosen tables
+        in_tree = {terminals[0]}
+        tree_edges: List[Tuple[str, str]] = []
+        unconnected = []
+        remaining = terminals[1:]
+        while remaining:
+            best = None
+            for t in remaining:
+                for u in in_tree:
+                    d = self.distance(u, t)
+                    if d is not None:
+                        key = (d, self.order[t], self.order[u])
+                        if best is None or key < best[0]:
+                            best = (key, u, t)
+            if best is None:
+                # the rest is in other components: start a new tree there
+                start = remaining.pop(0)
+                unconnected.append(start)
+                in_tree.add(start)
+                continue
+            _, u, t = best
+            tree_edges.append((u, t))
+            in_tree.add(t)
+            remaining.remove(t)
+
+        # expand into shortest paths; the union is pruned back to a tree without bridge leaves
+        adjacency: Dict[str, set] = {}
+        for u, t in tree_edges:
+            path = self.path(u, t)
+            for a, b in zip(path, path[1:]):
+                adjacency.setdefault(a, set()).add(b)
+                adjacency.setdefault(b, set()).add(a)
+        tree = self._spanning_tree(adjacency, terminals)
+        terminal_set = set(terminals)
+        pruned = True
+        while pruned:
+            pruned = False
+            for table in list(tree):
+                if table not in terminal_set and len(tree[table]) <= 1:
+                    for other in tree.pop(table):
+                        tree[other].discard(table)
+                    pruned = True
+
+        bridges = sorted((t for t in tree if t not in terminal_set), key=self.order.get)
+        joins = []
+        for a in sorted(tree, key=self.order.get):
+            for b in sorted(tree[a], key=self.order.get):
+                if self.order[a] < self.order[b]:
+                    joins.extend(self.join(a, b))
+        return JoinPlan(terminals + bridges, bridges, joins, [t for t in unconnected if t in terminal_set])
+
+    def _spanning_tree(self, adjacency: Dict[str, set], terminals: List[str]) -> Dict[str, set]:
+        """Breadth-first spanning forest of a subgraph, in table order."""
+        tree: Dict[str, set] = {t: set() for t in adjacency}
+        seen = set()
+        for root in terminals + sorted(adjacency, key=self.order.get):
+            if root in seen or root not in adjacency:
+                continue
+            seen.add(root)
+            queue = deque([root])
+            while queue:
+                table = queue.popleft()
+                for neighbour in sorted(adjacency[table], key=self.order.get):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        tree[table].add(neighbour)
+                        tree[neighbour].add(table)
+                        queue.append(neighbour)
+        return tree
+
+
+def build_join_graph_from_db_info(db_info: Dict[str, Any]) -> JoinGraph:
+    """
+    Join graph of a Selector database profile (desc_dict, fk_dict).
+
+    Args:
+        db_info: Result of Selector._load_single_db_info
+
+    Returns:
+        JoinGraph
+    """
+    foreign_keys = [(table, col, to_table, to_col)
+                    for table, fks in db_info["fk_dict"].items() for col, to_table, to_col in fks]
+    return JoinGraph(list(db_info["desc_dict"].keys()), foreign_keys)
+
+
+def build_join_graph_from_pg_schema(schema_info: Dict[str, Any]) -> JoinGraph:
+    """
+    Join graph of a PostgreSQLSelector schema ({"tables": {...}, "foreign_keys": [...]}).
+
+    Args:
+        schema_info: Result of PostgreSQLSelector.get_schema
+
+    Returns:
+        JoinGraph
+    """
+    fks = schema_info.get("foreign_keys", [])
+    foreign_keys = [(fk["source_table"], fk["source_column"], fk["target_table"], fk["target_column"])
+                    for fk in fks]
+    # Schemas read before constraint names were recorded fall back to one key per column pair
+    constraints = [fk.get("constraint") or join for fk, join in zip(fks, foreign_keys)]
+    return JoinGraph(list(schema_info["tables"].keys()), foreign_keys, constraints)
+
+
+def is_enabled() -> bool:
+    """Whether the Selectors should add bridge tables (SELECTOR_JOIN_PATHS=1)."""
+    return os.getenv("SELECTOR_JOIN_PATHS", "0").lower() in ("1", "true", "yes", "on")
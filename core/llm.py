@@ -1,9 +1,10 @@
 import sys
-import json
 import time
 import os
 import logging
 from core.api_config import *
+from core.llm_cache import get_cache, make_cache_key, make_prompt_hash
+from core.log_sink import get_log_sink, hash_prompts_enabled
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -79,6 +80,18 @@ def api_func(prompt:str):
         raise
 
 
+def _cache_params() -> dict:
+    """
+    Sampling parameters for the cache key, the same dict core/api.py keys its entries with
+    """
+    try:
+        from core import api
+        return api._cache_params()
+    except ImportError:
+        # Only the OpenAI path writes entries then; temperature is what it sends
+        return {"temperature": 0.1}
+
+
 def safe_call_llm(input_prompt, **kwargs) -> str:
     """
     Call LLM with error handling and logging
@@ -98,7 +111,16 @@ def safe_call_llm(input_prompt, **kwargs) -> str:
         except ImportError:
             logger.warning("Together API module not found, using default implementation")
     
-    # Default implementation with OpenAI
+    # Default implementation with OpenAI, served from the response cache when possible
+    # (no streaming here, so a stop predicate has nothing to cut short)
+    kwargs.pop('stop_when', None)
+    cache = get_cache()
+    cache_key = make_cache_key(MODEL_NAME, input_prompt, _cache_params())
+    cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"\nsys_response (cached): \n{cached['response']}")
+        return cached['response']
+
     for i in range(MAX_TRY):
         try:
             if log_path is None:
@@ -110,50 +132,50 @@ def safe_call_llm(input_prompt, **kwargs) -> str:
                 # Comprehensive logging to file
                 if (log_path is None) or (api_trace_json_path is None):
                     raise FileExistsError('log_path or api_trace_json_path is None, init_log_path first!')
+                
+                sys_response, prompt_token, response_token = api_func(input_prompt)
+                print(f'\n prompt_token,response_token: {prompt_token} {response_token}\n')
+                
+                # Track total tokens
+                total_prompt_tokens += prompt_token
+                total_response_tokens += response_token
+                
+                # The full prompt is only logged if the response cache cannot hold it
+                prompt_hash = make_prompt_hash(input_prompt)
+                prompt_text = input_prompt
+                if hash_prompts_enabled() and cache.store_prompt(input_prompt):
+                    prompt_text = None
+                logged_prompt = prompt_text if prompt_text is not None else f"[prompt sha256:{prompt_hash} stored in response cache]"
+                
+                # Add kwargs, prompt and response to world_dict
+                world_dict = dict(kwargs)
+                world_dict['response'] = '\n' + sys_response.strip() + '\n'
+                world_dict['input_prompt'] = prompt_text.strip() + '\n' if prompt_text is not None else None
+                world_dict['prompt_sha256'] = prompt_hash
+                world_dict['prompt_token'] = prompt_token
+                world_dict['response_token'] = response_token
+                world_dict['cur_total_prompt_tokens'] = total_prompt_tokens
+                world_dict['cur_total_response_tokens'] = total_response_tokens
+                
+                # File writes happen on the log sink's background thread
+                sink = get_log_sink()
+                sink.write_text(log_path, (
+                    '\n' + '*'*20 + '\n\n' +
+                    logged_prompt + '\n' +
+                    '\n' + '='*20 + '\n\n' +
+                    sys_response + '\n' +
+                    f'\n prompt_token,response_token: {prompt_token} {response_token}\n\n' +
+                    f'\n total_prompt_tokens,total_response_tokens: {total_prompt_tokens} {total_response_tokens}\n\n'
+                ))
+                sink.write_json(api_trace_json_path, world_dict)
+                
+                # Clean up
+                world_dict = {}
+                
+                # Log token totals
+                print(f'\n total_prompt_tokens,total_response_tokens: {total_prompt_tokens} {total_response_tokens}\n')
                     
-                with open(log_path, 'a+', encoding='utf8') as log_fp, open(api_trace_json_path, 'a+', encoding='utf8') as trace_json_fp:
-                    print('\n' + f'*'*20 +'\n', file=log_fp)
-                    print(input_prompt, file=log_fp)
-                    print('\n' + f'='*20 +'\n', file=log_fp)
-                    sys_response, prompt_token, response_token = api_func(input_prompt)
-                    print(sys_response, file=log_fp)
-                    print(f'\n prompt_token,response_token: {prompt_token} {response_token}\n', file=log_fp)
-                    print(f'\n prompt_token,response_token: {prompt_token} {response_token}\n')
-
-                    # Reset dict for this invocation
-                    if len(world_dict) > 0:
-                        world_dict = {}
-                    
-                    # Add kwargs to world_dict
-                    if len(kwargs) > 0:
-                        world_dict = {}
-                        for k, v in kwargs.items():
-                            world_dict[k] = v
-                            
-                    # Add prompt and response to world_dict
-                    world_dict['response'] = '\n' + sys_response.strip() + '\n'
-                    world_dict['input_prompt'] = input_prompt.strip() + '\n'
-                    world_dict['prompt_token'] = prompt_token
-                    world_dict['response_token'] = response_token
-                    
-                    # Track total tokens
-                    total_prompt_tokens += prompt_token
-                    total_response_tokens += response_token
-                    world_dict['cur_total_prompt_tokens'] = total_prompt_tokens
-                    world_dict['cur_total_response_tokens'] = total_response_tokens
-
-                    # Write to trace file
-                    world_json_str = json.dumps(world_dict, ensure_ascii=False)
-                    print(world_json_str, file=trace_json_fp)
-
-                    # Clean up
-                    world_dict = {}
-                    world_json_str = ''
-
-                    # Log token totals
-                    print(f'\n total_prompt_tokens,total_response_tokens: {total_prompt_tokens} {total_response_tokens}\n', file=log_fp)
-                    print(f'\n total_prompt_tokens,total_response_tokens: {total_prompt_tokens} {total_response_tokens}\n')
-                    
+            cache.put(cache_key, MODEL_NAME, sys_response, prompt_token, response_token)
             return sys_response
         except Exception as ex:
             print(ex)
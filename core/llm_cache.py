@@ -0,0 +1,414 @@
+"""
+LLM Response Cache for MAC-SQL
+
+This module provides a persistent, content-addressed cache of LLM completions.
+Entries are keyed by a hash of model + prompt + sampling parameters and stored
+in a small SQLite file, so re-running the same question set (for example a
+nightly BIRD-UKR re-evaluation) answers repeated Selector/Decomposer/Refiner
+prompts from disk instead of the API.
+
+Configuration (environment variables):
+    LLM_CACHE_DIR: Directory holding the cache file. Caching is disabled if unset.
+    LLM_CACHE_MODE: "readwrite" (default), "replay" (read-only, a miss raises
+        CacheMissError) or "off".
+    LLM_CACHE_MAX_MB: Maximum total size of cached responses and stored prompt
+        texts (default 512).
+    LLM_CACHE_MAX_AGE_DAYS: Entries older than this are treated as misses and
+        purged (default 30, 0 disables age-based eviction).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODE_OFF = "off"
+CACHE_MODE_READWRITE = "readwrite"
+CACHE_MODE_REPLAY = "replay"
+CACHE_MODES = [CACHE_MODE_OFF, CACHE_MODE_READWRITE, CACHE_MODE_REPLAY]
+
+CACHE_FILE_NAME = "llm_responses.sqlite"
+DEFAULT_MAX_MB = 512
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a prompt has no cached response."""
+    pass
+
+
+def make_cache_key(model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the content address of an LLM request.
+
+    Args:
+        model: Model name the request is sent to
+        prompt: Full prompt text
+        params: Sampling parameters (temperature, max_tokens, ...)
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    payload = json.dumps({
+        "model": model,
+        "prompt": prompt,
+        "params": params or {}
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_prompt_hash(prompt: str) -> str:
+    """
+    Hash of the prompt text alone, used to reference prompts from logs.
+
+    Args:
+        prompt: Full prompt text
+
+    Returns:
+        Hex SHA-256 digest of the prompt
+    """
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed response cache with size- and age-based eviction.
+
+    The cache is safe to share between threads of one process; several
+    processes may point at the same directory since SQLite serializes writers.
+    """
+
+    def __init__(self, cache_dir: str, mode: str = CACHE_MODE_READWRITE,
+                 max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 max_age: float = DEFAULT_MAX_AGE_DAYS * 24 * 3600):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory where the cache file lives
+            mode: One of "readwrite", "replay" or "off"
+            max_bytes: Maximum total size of stored responses and prompts (0 for unlimited)
+            max_age: Maximum entry age in seconds (0 for unlimited)
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of {CACHE_MODES}")
+
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if self.mode != CACHE_MODE_OFF:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.path = os.path.join(cache_dir, CACHE_FILE_NAME)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    prompt_tokens INTEGER,
+                    response_tokens INTEGER,
+                    size INTEGER,
+                    created_at REAL,
+                    last_access REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+            # Full prompt texts referenced by hash from log.txt / api_trace.json
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompts (
+                    hash TEXT PRIMARY KEY,
+                    prompt TEXT,
+                    size INTEGER,
+                    last_access REAL
+                )
+            """)
+            self._upgrade_prompts()
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prompts_last_access ON prompts(last_access)")
+            self._conn.commit()
+            logger.info(f"LLM response cache enabled ({self.mode}) at {self.path}")
+
+    def _upgrade_prompts(self) -> None:
+        """Add the size and last_access columns to a prompts table created without them."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(prompts)")]
+        if "size" in columns:
+            return
+        self._conn.execute("ALTER TABLE prompts ADD COLUMN size INTEGER")
+        self._conn.execute("ALTER TABLE prompts ADD COLUMN last_access REAL")
+        # length() counts characters; close enough for prompts stored before sizes were tracked
+        self._conn.execute("UPDATE prompts SET size = length(prompt), last_access = ?", (time.time(),))
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != CACHE_MODE_OFF
+
+    @property
+    def read_only(self) -> bool:
+        return self.mode == CACHE_MODE_REPLAY
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            Dictionary with response, prompt_tokens and response_tokens, or None on a miss
+
+        Raises:
+            CacheMissError: In replay mode when the key is not cached
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, prompt_tokens, response_tokens, created_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is not None and self.max_age and now - row[3] > self.max_age:
+                # Expired entries count as misses; replay mode never deletes
+                if not self.read_only:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                if self.read_only:
+                    raise CacheMissError(f"No cached response for key {key[:16]}... in replay mode")
+                return None
+
+            self.hits += 1
+            if not self.read_only:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+
+        return {
+            "response": row[0],
+            "prompt_tokens": row[1],
+            "response_tokens": row[2]
+        }
+
+    def put(self, key: str, model: str, response: str,
+            prompt_tokens: int = 0, response_tokens: int = 0) -> None:
+        """
+        Store a response and evict old entries if the cache exceeds its limits.
+
+        Args:
+            key: Cache key from make_cache_key
+            model: Model that produced the response
+            response: Response text
+            prompt_tokens: Prompt tokens reported by the API
+            response_tokens: Completion tokens reported by the API
+        """
+        if not self.enabled or self.read_only:
+            return
+
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, prompt_tokens, response_tokens, size, now, now)
+            )
+            self.writes += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def contains(self, key: str) -> bool:
+        """Check whether a key is cached without touching the hit/miss counters."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def store_prompt(self, prompt: str) -> Optional[str]:
+        """
+        Keep the full prompt text so logs can reference it by hash.
+
+        Args:
+            prompt: Full prompt text
+
+        Returns:
+            The prompt hash if the cache holds the text, otherwise None
+        """
+        if not self.enabled:
+            return None
+
+        prompt_hash = make_prompt_hash(prompt)
+        now = time.time()
+        with self._lock:
+            if self.read_only:
+                row = self._conn.execute("SELECT 1 FROM prompts WHERE hash = ?", (prompt_hash,)).fetchone()
+                return prompt_hash if row is not None else None
+            cursor = self._conn.execute("UPDATE prompts SET last_access = ? WHERE hash = ?", (now, prompt_hash))
+            if cursor.rowcount == 0:
+                self._conn.execute(
+                    "INSERT INTO prompts VALUES (?, ?, ?, ?)",
+                    (prompt_hash, prompt, len(prompt.encode("utf-8")), now)
+                )
+                self._evict(now)
+            self._conn.commit()
+        return prompt_hash
+
+    def get_prompt(self, prompt_hash: str) -> Optional[str]:
+        """
+        Look up a prompt stored by store_prompt.
+
+        Args:
+            prompt_hash: Hash from make_prompt_hash
+
+        Returns:
+            The prompt text, or None if it is not stored
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT prompt FROM prompts WHERE hash = ?", (prompt_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _evict(self, now: float) -> None:
+        """
+        Drop expired entries, then least recently used ones until under max_bytes.
+
+        Stored prompts count toward max_bytes and age out with the responses;
+        a log line whose prompt was evicted keeps only the hash.
+        """
+        if self.max_age:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+            self.evictions += max(cursor.rowcount, 0)
+            self._conn.execute("DELETE FROM prompts WHERE last_access < ?", (now - self.max_age,))
+
+        if not self.max_bytes:
+            return
+
+        total_size = self._conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM responses) + (SELECT COALESCE(SUM(size), 0) FROM prompts)"
+        ).fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT 'responses', key, size, last_access FROM responses "
+            "UNION ALL SELECT 'prompts', hash, size, last_access FROM prompts "
+            "ORDER BY last_access ASC"
+        ).fetchall()
+        evict_keys = []
+        evict_prompts = []
+        for table, key, size, _ in rows:
+            if total_size <= self.max_bytes:
+                break
+            if table == "responses":
+                evict_keys.append((key,))
+            else:
+                evict_prompts.append((key,))
+            total_size -= size or 0
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        self._conn.executemany("DELETE FROM prompts WHERE hash = ?", evict_prompts)
+        self.evictions += len(evict_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss counters for this process.
+
+        Returns:
+            Dictionary with hits, misses, writes, evictions and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self.mode = CACHE_MODE_OFF
+
+
+# Process-wide cache instance, created lazily from the environment
+_cache = None
+_cache_lock = threading.Lock()
+_first_use_lock = threading.Lock()
+
+
+def init_cache(cache_dir: Optional[str] = None, mode: Optional[str] = None,
+               max_mb: Optional[float] = None, max_age_days: Optional[float] = None) -> LLMResponseCache:
+    """
+    Create (or replace) the process-wide response cache.
+
+    Arguments left as None fall back to the LLM_CACHE_* environment variables.
+
+    Args:
+        cache_dir: Cache directory
+        mode: Cache mode ("readwrite", "replay" or "off")
+        max_mb: Maximum cache size in megabytes
+        max_age_days: Maximum entry age in days
+
+    Returns:
+        The new cache instance
+    """
+    global _cache
+
+    cache_dir = cache_dir or os.getenv("LLM_CACHE_DIR", "")
+    mode = mode or os.getenv("LLM_CACHE_MODE", CACHE_MODE_READWRITE)
+    if max_mb is None:
+        max_mb = float(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    if max_age_days is None:
+        max_age_days = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS))
+
+    if not cache_dir:
+        mode = CACHE_MODE_OFF
+
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = LLMResponseCache(
+            cache_dir=cache_dir,
+            mode=mode.lower(),
+            max_bytes=int(max_mb * 1024 * 1024),
+            max_age=max_age_days * 24 * 3600
+        )
+    return _cache
+
+
+def get_cache() -> LLMResponseCache:
+    """
+    Get the process-wide response cache, creating it from the environment on first use.
+
+    Returns:
+        The shared cache instance (possibly disabled)
+    """
+    if _cache is None:
+        # Concurrent first calls must not replace (and close) each other's cache
+        with _first_use_lock:
+            if _cache is None:
+                init_cache()
+    return _cache
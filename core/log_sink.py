@@ -0,0 +1,261 @@
+"""
+Background Log Sink for MAC-SQL
+
+LLM calls used to open, append to and close log.txt and api_trace.json from
+the calling thread on every request. The sink moves that file I/O to one
+background thread: callers put records on a bounded queue, and the writer
+batches them, opens each file once per batch and flushes on an interval and at
+interpreter shutdown. JSONL trace files are rotated by size and the rotated
+files are gzip-compressed (api_trace.json.1.gz, api_trace.json.2.gz, ...).
+
+Configuration (environment variables):
+    LLM_LOG_ASYNC: "1" (default) writes from the background thread, "0" writes inline
+    LLM_LOG_QUEUE_SIZE: Maximum queued records before callers block (default 10000)
+    LLM_LOG_FLUSH_INTERVAL: Seconds a record may wait for a batch to fill (default 1.0)
+    LLM_TRACE_MAX_MB: Size at which a JSONL trace is rotated, 0 disables (default 64)
+    LLM_TRACE_BACKUPS: Number of compressed trace files to keep (default 5)
+    LLM_LOG_PROMPT_HASH: "1" logs only the prompt hash when the response cache
+        stores the full prompt text (default "0")
+"""
+
+import os
+import gzip
+import json
+import queue
+import atexit
+import time
+import shutil
+import logging
+import threading
+from typing import Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_TRACE_MAX_MB = 64
+DEFAULT_TRACE_BACKUPS = 5
+
+RECORD_TEXT = "text"
+RECORD_JSON = "json"
+
+
+class LogSink:
+    """
+    Bounded-queue writer for text logs and JSONL traces.
+
+    Records for the same file keep their submission order. When the queue is
+    full, callers block until the writer catches up.
+    """
+
+    def __init__(self, asynchronous: bool = True, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, batch_size: int = DEFAULT_BATCH_SIZE,
+                 trace_max_bytes: int = DEFAULT_TRACE_MAX_MB * 1024 * 1024,
+                 trace_backups: int = DEFAULT_TRACE_BACKUPS):
+        """
+        Initialize the sink.
+
+        Args:
+            asynchronous: Write from a background thread (False writes inline)
+            queue_size: Maximum number of queued records
+            flush_interval: Seconds to wait for more records before writing a partial batch
+            batch_size: Maximum records written per batch
+            trace_max_bytes: Size at which JSONL traces are rotated (0 disables rotation)
+            trace_backups: Number of compressed trace files to keep
+        """
+        self.asynchronous = asynchronous
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.trace_max_bytes = trace_max_bytes
+        self.trace_backups = trace_backups
+        self.records_written = 0
+        self.rotations = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._write_lock = threading.Lock()
+        # Orders _submit against close(): nothing is queued behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        if self.asynchronous:
+            self._thread = threading.Thread(target=self._run, name="llm-log-sink", daemon=True)
+            self._thread.start()
+
+    def write_text(self, path: str, text: str) -> None:
+        """
+        Append text to a plain log file.
+
+        Args:
+            path: Log file path
+            text: Text to append (written as is, include trailing newlines)
+        """
+        self._submit((path, RECORD_TEXT, text))
+
+    def write_json(self, path: str, record: Dict[str, Any]) -> None:
+        """
+        Append one JSON object as a line of a JSONL trace.
+
+        Args:
+            path: Trace file path
+            record: JSON-serializable record
+        """
+        self._submit((path, RECORD_JSON, json.dumps(record, ensure_ascii=False) + "\n"))
+
+    def _submit(self, item: Tuple[str, str, str]) -> None:
+        if self.asynchronous:
+            with self._submit_lock:
+                if not self._closed:
+                    self._queue.put(item)
+                    return
+            # Closed: let the writer drain first so the file keeps submission order
+            if self._thread is not None:
+                self._thread.join()
+        self._write_batch([item])
+
+    def _run(self) -> None:
+        """Writer loop: collect records until batch_size or flush_interval after the first, then write."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                # flush() with nothing pending
+                item.set()
+                continue
+
+            batch = [item]
+            flushed = None
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed = item
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} log records: {str(e)}")
+            if flushed is not None:
+                flushed.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, str, str]]) -> None:
+        """Write records grouped by file, opening each file once."""
+        by_path: Dict[str, List[Tuple[str, str]]] = {}
+        for path, kind, payload in batch:
+            by_path.setdefault(path, []).append((kind, payload))
+
+        with self._write_lock:
+            for path, records in by_path.items():
+                payload = "".join(p for _, p in records)
+                if any(kind == RECORD_JSON for kind, _ in records):
+                    self._maybe_rotate(path, len(payload.encode("utf-8")))
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, "a", encoding="utf8") as fp:
+                    fp.write(payload)
+                self.records_written += len(records)
+
+    def _maybe_rotate(self, path: str, incoming: int) -> None:
+        """Compress the trace to <path>.1.gz (shifting older backups) if it would exceed the size limit."""
+        if not self.trace_max_bytes or not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        if size == 0 or size + incoming <= self.trace_max_bytes:
+            return
+
+        if self.trace_backups > 0:
+            for i in range(self.trace_backups - 1, 0, -1):
+                src = f"{path}.{i}.gz"
+                if os.path.exists(src):
+                    os.replace(src, f"{path}.{i + 1}.gz")
+            with open(path, "rb") as src_fp, gzip.open(f"{path}.1.gz", "wb") as dst_fp:
+                shutil.copyfileobj(src_fp, dst_fp)
+        os.remove(path)
+        self.rotations += 1
+        logger.info(f"Rotated LLM trace {path} ({size} bytes)")
+
+    def flush(self) -> None:
+        """Block until every record queued before the call has been written."""
+        if not self.asynchronous or self._thread is None:
+            return
+        # The marker cuts the current batch short instead of waiting for its deadline
+        done = threading.Event()
+        with self._submit_lock:
+            if self._closed:
+                done = None
+            else:
+                self._queue.put(done)
+        if done is None:
+            self._thread.join()
+            return
+        while not done.wait(0.1):
+            if not self._thread.is_alive():
+                return
+
+    def close(self) -> None:
+        """Write all queued records and stop the writer thread."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            # Records submitted from now on are written inline, after the queue is drained
+            self._closed = True
+            if self.asynchronous and self._thread is not None:
+                self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+
+# Process-wide sink, created on first use and drained at interpreter exit
+_sink = None
+_sink_lock = threading.Lock()
+
+def get_log_sink() -> LogSink:
+    """Get the process-wide log sink, creating it from the environment on first use."""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = LogSink(
+                    asynchronous=os.getenv("LLM_LOG_ASYNC", "1") == "1",
+                    queue_size=int(os.getenv("LLM_LOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+                    flush_interval=float(os.getenv("LLM_LOG_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+                    trace_max_bytes=int(float(os.getenv("LLM_TRACE_MAX_MB", DEFAULT_TRACE_MAX_MB)) * 1024 * 1024),
+                    trace_backups=int(os.getenv("LLM_TRACE_BACKUPS", DEFAULT_TRACE_BACKUPS))
+                )
+    return _sink
+
+def flush_logs() -> None:
+    """Block until all queued log records are on disk."""
+    if _sink is not None:
+        _sink.flush()
+
+def close_log_sink() -> None:
+    """Drain and stop the process-wide sink; the next write creates a new one."""
+    global _sink
+    with _sink_lock:
+        sink = _sink
+        _sink = None
+    if sink is not None:
+        sink.close()
+
+def hash_prompts_enabled() -> bool:
+    """Whether logs may store a prompt hash instead of the full prompt text."""
+    return os.getenv("LLM_LOG_PROMPT_HASH", "0") == "1"
+
+atexit.register(close_log_sink)
@@ -0,0 +1,313 @@
+"""
+Metrics Registry for MAC-SQL
+
+Process-wide counters and histograms for the agent pipeline: LLM latency,
+prompt/completion tokens, retries, DB execution time and refine rounds,
+labeled by agent (Selector, Decomposer, Refiner), model and db_id.
+
+The registry can be scraped in Prometheus text format from a local HTTP
+endpoint (`start_metrics_server`) and dumped as a JSON snapshot at the end of
+an evaluation run (`dump_metrics`). Histograms also keep a window of recent
+samples so callers can ask for latency percentiles (`percentile`).
+
+Configuration (environment variables):
+    METRICS_PORT: Port of the local /metrics endpoint started by the evaluation
+        drivers (default 0, disabled)
+    METRICS_WINDOW: Recent samples kept per histogram series (default 1000)
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 1000
+
+# Bucket upper bounds in seconds; LLM calls take seconds, DB queries milliseconds
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+# Metric name -> (type, help, histogram buckets)
+METRICS = {
+    "llm_requests_total": ("counter", "LLM requests by outcome (ok, cached, error)", None),
+    "llm_request_seconds": ("histogram", "Wall time of LLM requests including retries", LATENCY_BUCKETS),
+    "llm_prompt_tokens_total": ("counter", "Prompt tokens sent to the LLM", None),
+    "llm_completion_tokens_total": ("counter", "Completion tokens received from the LLM", None),
+    "llm_retries_total": ("counter", "Retried LLM attempts by reason", None),
+    "llm_hedges_total": ("counter", "Hedged LLM requests by outcome (sent, won, no_budget)", None),
+    "selector_index_total": ("counter", "Schema index decisions by outcome (skip, candidates, full)", None),
+    "selector_cache_total": ("counter", "Selector decision cache lookups by outcome (hit, miss)", None),
+    "selector_schema_cache_total": ("counter", "PostgreSQL schema cache lookups by outcome (hit, miss, changed)", None),
+    "db_execution_seconds": ("histogram", "SQL execution time", LATENCY_BUCKETS),
+    "db_pool_connections_total": ("counter", "PostgreSQL pool connection events (opened, broken, closed)", None),
+    "db_pool_acquire_seconds": ("histogram", "Wait for a pooled PostgreSQL connection, including health check", LATENCY_BUCKETS),
+    "db_pool_checkout_seconds": ("histogram", "Time a pooled PostgreSQL connection was borrowed", LATENCY_BUCKETS),
+    "db_pool_acquire_timeouts_total": ("counter", "Borrows that found no free PostgreSQL connection in time", None),
+    "db_pool_session_sets_total": ("counter", "set_config round trips changing pooled PostgreSQL session settings", None),
+    "question_seconds": ("histogram", "Wall time of one question through the agent pipeline", LATENCY_BUCKETS),
+    "refine_rounds": ("histogram", "Refiner passes per question", COUNT_BUCKETS),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Histogram:
+    """Cumulative-bucket histogram plus a window of recent samples."""
+
+    def __init__(self, buckets, window: int):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of labeled counters and histograms.
+
+    Metrics are created on first use; names listed in METRICS get their help
+    text and bucket layout from there.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        """
+        Initialize the registry.
+
+        Args:
+            window: Recent samples kept per histogram series for percentiles
+        """
+        self.window = window
+        self.started_at = time.time()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """
+        Increase a counter.
+
+        Args:
+            name: Metric name
+            value: Amount to add
+            **labels: Label values of the series
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Record one histogram sample.
+
+        Args:
+            name: Metric name
+            value: Observed value (seconds for latencies)
+            **labels: Label values of the series
+        """
+        key = _label_key(labels)
+        buckets = METRICS.get(name, (None, None, LATENCY_BUCKETS))[2] or LATENCY_BUCKETS
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets, self.window)
+            hist.observe(value)
+
+    def percentile(self, name: str, q: float, min_samples: int = 1, **labels) -> Optional[float]:
+        """
+        Percentile of the recent samples of a histogram.
+
+        Args:
+            name: Histogram name
+            q: Percentile in [0, 100]
+            min_samples: Return None if fewer recent samples are available
+            **labels: Only use series whose labels include these values
+
+        Returns:
+            The percentile, or None without enough samples
+        """
+        wanted = set(_label_key(labels))
+        with self._lock:
+            samples = [v for key, hist in self._histograms.get(name, {}).items()
+                       if wanted.issubset(key) for v in hist.recent]
+        if len(samples) < max(1, min_samples):
+            return None
+        samples.sort()
+        index = min(len(samples) - 1, max(0, int(round(q / 100.0 * (len(samples) - 1)))))
+        return samples[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get all metrics as a JSON-serializable dictionary.
+
+        Returns:
+            Dictionary with counters and histograms (count, sum, mean, p50, p95, p99 per series)
+        """
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {}
+            for name, series in self._histograms.items():
+                entries = []
+                for key, hist in series.items():
+                    recent = sorted(hist.recent)
+                    pick = lambda q: recent[min(len(recent) - 1, int(round(q * (len(recent) - 1))))] if recent else None
+                    entries.append({
+                        "labels": dict(key),
+                        "count": hist.count,
+                        "sum": hist.sum,
+                        "mean": hist.sum / hist.count if hist.count else 0.0,
+                        "p50": pick(0.50),
+                        "p95": pick(0.95),
+                        "p99": pick(0.99),
+                        "buckets": dict(zip([str(b) for b in hist.buckets], hist.counts))
+                    })
+                histograms[name] = entries
+        return {
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "uptime_seconds": time.time() - self.started_at,
+            "counters": counters,
+            "histograms": histograms
+        }
+
+    def render_prometheus(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            Exposition text
+        """
+        def fmt_labels(key: LabelKey, extra: Optional[List[Tuple[str, str]]] = None) -> str:
+            pairs = list(key) + (extra or [])
+            if not pairs:
+                return ""
+            escaped = [(k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in pairs]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {METRICS.get(name, ('', name, None))[1]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{fmt_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {METRICS.get(name, ('', name, None))[1]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{name}_bucket{fmt_labels(key, [('le', str(bound))])} {count}")
+                    lines.append(f"{name}_bucket{fmt_labels(key, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"{name}_sum{fmt_labels(key)} {hist.sum}")
+                    lines.append(f"{name}_count{fmt_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Drop all recorded metrics."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+
+# Process-wide registry
+_registry = MetricsRegistry(window=int(os.getenv("METRICS_WINDOW", DEFAULT_WINDOW)))
+_server = None
+
+def get_metrics() -> MetricsRegistry:
+    """Get the process-wide metrics registry."""
+    return _registry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves /metrics (Prometheus text) and /metrics.json (snapshot)."""
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(_registry.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        elif self.path.startswith("/metrics"):
+            body = _registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """
+    Serve the registry over HTTP from a daemon thread.
+
+    Args:
+        port: Port to listen on (0 or negative disables the endpoint)
+        host: Interface to bind, local-only by default
+
+    Returns:
+        The running server, or None if disabled or the port is unavailable
+    """
+    global _server
+    if port <= 0:
+        return None
+    if _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Could not start metrics endpoint on {host}:{port}: {str(e)}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return _server
+
+def stop_metrics_server() -> None:
+    """Stop the HTTP endpoint if it is running."""
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+def dump_metrics(path: str) -> None:
+    """
+    Write a JSON snapshot of the registry.
+
+    Args:
+        path: Output file path
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_registry.snapshot(), f, indent=2, ensure_ascii=False)
+    logger.info(f"Metrics snapshot saved to {path}")
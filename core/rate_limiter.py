@@ -0,0 +1,283 @@
+"""
+Process-shared Rate Limiter for MAC-SQL
+
+Token-bucket limiter that enforces both requests-per-minute (RPM) and
+tokens-per-minute (TPM) limits of the LLM provider. The bucket state lives in
+a small JSON file guarded by an OS file lock, so every thread and every worker
+process on the host draws from the same budget.
+
+Configuration (environment variables):
+    TOGETHER_MAX_CALLS_PER_MINUTE: Sustained request rate (default 45)
+    TOGETHER_MAX_CALLS_PER_SECOND: Request burst size (default 4)
+    TOGETHER_MAX_TOKENS_PER_MINUTE: Sustained token rate, 0 disables (default 0)
+    TOGETHER_RATE_LIMIT_DIR: Directory of the shared state files
+        (default: <tmp>/macsql_rate_limits)
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Optional
+
+# fcntl is POSIX-only, Windows uses msvcrt byte-range locks instead
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    import msvcrt
+    HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALLS_PER_MINUTE = 45
+DEFAULT_CALLS_PER_SECOND = 4
+DEFAULT_TOKENS_PER_MINUTE = 0
+
+# Tokens reserved for the completion until the real usage is known
+COMPLETION_TOKEN_RESERVE = 512
+
+# Longest single sleep while waiting, so limit changes are picked up quickly
+MAX_WAIT_SLICE = 5.0
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap upper-bound token estimate for rate limiting.
+
+    Cyrillic text tokenizes denser than English, so three characters per
+    token is used instead of the usual four.
+
+    Args:
+        text: Prompt text
+
+    Returns:
+        Estimated number of prompt tokens
+    """
+    return len(text) // 3 + 1
+
+
+class _FileLock:
+    """Exclusive lock on an open file, usable across processes."""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def __enter__(self):
+        if HAS_FCNTL:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        else:
+            self.fp.seek(0)
+            msvcrt.locking(self.fp.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if HAS_FCNTL:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+        else:
+            self.fp.seek(0)
+            msvcrt.locking(self.fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SharedRateLimiter:
+    """
+    RPM + TPM token buckets shared by all processes using the same state file.
+
+    The request bucket holds up to `calls_per_second` requests and refills at
+    `calls_per_minute / 60` per second. The token bucket holds up to
+    `tokens_per_minute` tokens and refills at `tokens_per_minute / 60` per
+    second. A call proceeds only when both buckets can pay for it.
+    """
+
+    def __init__(self, name: str = "together", calls_per_minute: Optional[float] = None,
+                 calls_per_second: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 state_dir: Optional[str] = None):
+        """
+        Initialize the limiter.
+
+        Args:
+            name: Name of the shared budget (one state file per name)
+            calls_per_minute: Sustained request rate
+            calls_per_second: Maximum request burst
+            tokens_per_minute: Sustained token rate (0 disables the token bucket)
+            state_dir: Directory holding the shared state file
+        """
+        if calls_per_minute is None:
+            calls_per_minute = float(os.getenv("TOGETHER_MAX_CALLS_PER_MINUTE", DEFAULT_CALLS_PER_MINUTE))
+        if calls_per_second is None:
+            calls_per_second = float(os.getenv("TOGETHER_MAX_CALLS_PER_SECOND", DEFAULT_CALLS_PER_SECOND))
+        if tokens_per_minute is None:
+            tokens_per_minute = float(os.getenv("TOGETHER_MAX_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE))
+        state_dir = state_dir or os.getenv("TOGETHER_RATE_LIMIT_DIR",
+                                           os.path.join(tempfile.gettempdir(), "macsql_rate_limits"))
+
+        self.name = name
+        self.calls_per_minute = calls_per_minute
+        self.request_capacity = max(1.0, calls_per_second)
+        self.tokens_per_minute = tokens_per_minute
+        self.token_capacity = tokens_per_minute
+
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, f"{name}.json")
+        self._thread_lock = threading.Lock()
+
+    def _refill(self, state: Dict[str, float], now: float) -> Dict[str, float]:
+        """Add the tokens earned since the last update to both buckets."""
+        if not state:
+            return {"requests": self.request_capacity, "tokens": self.token_capacity, "updated": now}
+
+        elapsed = max(0.0, now - state.get("updated", now))
+        state["requests"] = min(self.request_capacity,
+                                state.get("requests", 0.0) + elapsed * self.calls_per_minute / 60.0)
+        state["tokens"] = min(self.token_capacity,
+                              state.get("tokens", 0.0) + elapsed * self.tokens_per_minute / 60.0)
+        state["updated"] = now
+        return state
+
+    def _update(self, func) -> Any:
+        """Apply `func(state, now)` to the shared state under the thread and file locks."""
+        with self._thread_lock, open(self.state_path, "a+", encoding="utf-8") as fp:
+            with _FileLock(fp):
+                fp.seek(0)
+                raw = fp.read()
+                try:
+                    state = json.loads(raw) if raw.strip() else {}
+                except ValueError:
+                    state = {}
+                now = time.time()
+                state = self._refill(state, now)
+                result = func(state, now)
+                fp.seek(0)
+                fp.truncate()
+                fp.write(json.dumps(state))
+                fp.flush()
+                return result
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """
+        Take one request and `tokens` tokens from the buckets if both can pay.
+
+        Args:
+            tokens: Estimated tokens of the call
+
+        Returns:
+            0.0 if the call may proceed, otherwise seconds to wait before retrying
+        """
+        use_tokens = self.tokens_per_minute > 0
+        # A single call larger than the whole bucket may go once the bucket is full
+        tokens = min(tokens, self.token_capacity) if use_tokens else 0
+
+        def take(state, now):
+            wait = 0.0
+            if state["requests"] < 1.0:
+                wait = max(wait, (1.0 - state["requests"]) * 60.0 / self.calls_per_minute)
+            if use_tokens and state["tokens"] < tokens:
+                wait = max(wait, (tokens - state["tokens"]) * 60.0 / self.tokens_per_minute)
+            if wait > 0:
+                return wait
+            state["requests"] -= 1.0
+            if use_tokens:
+                state["tokens"] -= tokens
+            return 0.0
+
+        return self._update(take)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Block until the call fits both budgets.
+
+        Args:
+            tokens: Estimated tokens of the call
+
+        Returns:
+            Total seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                if waited > 0:
+                    logger.debug(f"Rate limiter '{self.name}': waited {waited:.2f}s")
+                return waited
+            wait = min(wait, MAX_WAIT_SLICE)
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """
+        Async version of acquire that yields to the event loop while waiting.
+
+        The file-locked state update runs in a worker thread, so a lock held by
+        another process does not stall the event loop.
+        """
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait <= 0:
+                return waited
+            wait = min(wait, MAX_WAIT_SLICE)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Correct the token bucket once the API reports real usage.
+
+        Args:
+            estimated_tokens: Tokens taken by acquire
+            actual_tokens: Prompt + completion tokens reported by the API
+        """
+        if self.tokens_per_minute <= 0:
+            return
+        delta = min(estimated_tokens, self.token_capacity) - actual_tokens
+
+        def adjust(state, now):
+            # The bucket may go negative; later callers then wait off the debt
+            state["tokens"] = min(self.token_capacity, state["tokens"] + delta)
+
+        self._update(adjust)
+
+    async def areconcile(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Async version of reconcile, updating the shared state in a worker thread."""
+        if self.tokens_per_minute <= 0:
+            return
+        await asyncio.to_thread(self.reconcile, estimated_tokens, actual_tokens)
+
+    def penalize(self, seconds: float) -> None:
+        """
+        Drain the request bucket after a 429 so every worker backs off together.
+
+        Args:
+            seconds: How long no new requests should start
+        """
+        def drain(state, now):
+            state["requests"] = min(state["requests"], -seconds * self.calls_per_minute / 60.0)
+
+        self._update(drain)
+
+    async def apenalize(self, seconds: float) -> None:
+        """Async version of penalize, updating the shared state in a worker thread."""
+        await asyncio.to_thread(self.penalize, seconds)
+
+
+# Process-wide limiter, created on first use
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> SharedRateLimiter:
+    """Get the shared Together rate limiter, creating it from the environment on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = SharedRateLimiter()
+    return _limiter
+
+def reset_rate_limiter() -> None:
+    """Drop the limiter so the next call re-reads the TOGETHER_MAX_* settings."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
@@ -0,0 +1,390 @@
+"""
+Retry Policy for MAC-SQL LLM calls
+
+One place that decides whether, when and for how long a failed LLM request is
+retried. Every request gets a wall-clock deadline and a maximum number of
+attempts. Retries use exponential backoff with jitter and honor the server's
+Retry-After header on 429/503. Client errors (4xx other than 408/409/425/429)
+fail immediately. A circuit breaker shared by all requests to a provider fails
+fast while the provider is down instead of letting every request run its own
+retry cascade.
+
+Configuration (environment variables):
+    LLM_RETRY_MAX_ATTEMPTS: Attempts per request, including the first (default 6)
+    LLM_RETRY_DEADLINE: Seconds a request may take across all attempts (default 300)
+    LLM_RETRY_BASE_DELAY: Backoff of the first retry in seconds (default 2)
+    LLM_RETRY_MAX_DELAY: Upper bound of the computed backoff in seconds (default 60)
+    LLM_CIRCUIT_FAILURE_THRESHOLD: Consecutive failures that open the circuit (default 5)
+    LLM_CIRCUIT_RESET_TIMEOUT: Seconds the circuit stays open before a probe (default 60)
+"""
+
+import os
+import time
+import random
+import asyncio
+import inspect
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Callable, Optional, Mapping
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_DEADLINE = 300.0
+DEFAULT_BASE_DELAY = 2.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60.0
+
+# Client errors that are still worth retrying (timeouts, conflicts, rate limits)
+RETRYABLE_CLIENT_CODES = {408, 409, 425, 429}
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class APIStatusError(Exception):
+    """Non-200 response from the LLM provider."""
+
+    def __init__(self, status_code: int, body: Any = "", retry_after: Optional[float] = None):
+        super().__init__(f"API error: {status_code} - {body}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code >= 500 or self.status_code in RETRYABLE_CLIENT_CODES
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while its circuit is open."""
+    retryable = False
+
+
+class RetryError(Exception):
+    """Raised when a request runs out of attempts or hits its deadline."""
+    retryable = False
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Decide whether a failed attempt may be retried.
+
+    Exceptions can opt out by setting a false `retryable` attribute; network
+    errors, timeouts and malformed responses are retried.
+
+    Args:
+        error: Exception raised by the attempt
+
+    Returns:
+        True if another attempt may succeed
+    """
+    return bool(getattr(error, "retryable", True))
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Read the server-requested delay from response headers.
+
+    Supports `Retry-After` as seconds or HTTP date, and `retry-after-ms`.
+
+    Args:
+        headers: Response headers (case-insensitive mapping or plain dict)
+
+    Returns:
+        Delay in seconds, or None if the server did not ask for one
+    """
+    if not headers:
+        return None
+    lowered = {k.lower(): v for k, v in headers.items()}
+
+    value = lowered.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+
+    value = lowered.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker shared by all requests to one provider.
+
+    After `failure_threshold` consecutive provider failures the circuit opens
+    and calls fail with CircuitOpenError. Once `reset_timeout` has passed a
+    single probe request is let through; its outcome closes or re-opens the
+    circuit. Rate limiting (429) and client errors do not count as failures.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        """
+        Initialize the breaker.
+
+        Args:
+            name: Provider name, used in log messages
+            failure_threshold: Consecutive failures that open the circuit (0 disables the breaker)
+            reset_timeout: Seconds to stay open before letting a probe through
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        Check that a request may be sent.
+
+        Raises:
+            CircuitOpenError: If the circuit is open or a probe is already running
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return
+            if self.state == CIRCUIT_OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.time()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Circuit for {self.name} is open; retry in {remaining:.0f}s")
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"Circuit for {self.name} is half-open; probe in progress")
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful request."""
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Exception) -> None:
+        """
+        Count a failed request.
+
+        Args:
+            error: Exception raised by the request
+        """
+        if not is_retryable(error) or getattr(error, "status_code", None) == 429:
+            # The provider answered; this is not an outage
+            with self._lock:
+                self._probe_in_flight = False
+            return
+
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.failure_threshold <= 0:
+                return
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CIRCUIT_OPEN:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} "
+                                   f"consecutive failures: {error}")
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.time()
+
+
+class RetryPolicy:
+    """
+    Retry loop with a per-request deadline, jittered exponential backoff,
+    Retry-After support and an optional circuit breaker.
+    """
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, deadline: float = DEFAULT_DEADLINE,
+                 base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the policy.
+
+        Args:
+            max_attempts: Attempts per request, including the first
+            deadline: Seconds a request may take across all attempts (0 for no deadline)
+            base_delay: Backoff of the first retry in seconds
+            max_delay: Upper bound of the computed backoff in seconds
+            breaker: Circuit breaker to consult before each attempt
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        Compute the delay before the next attempt.
+
+        A server-provided Retry-After wins; otherwise the delay is drawn
+        uniformly from the upper half of the capped exponential window.
+
+        Args:
+            attempt: Number of the attempt that just failed (0-based)
+            error: Exception raised by that attempt
+
+        Returns:
+            Delay in seconds
+        """
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        window = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return window / 2 + random.uniform(0, window / 2)
+
+    def _start(self):
+        start = time.time()
+        end = start + self.deadline if self.deadline > 0 else None
+        return start, end
+
+    def _next_delay(self, attempt: int, error: Exception, start: float,
+                    end: Optional[float]) -> float:
+        """Record the failure and return the delay before the next attempt, or raise to give up."""
+        if self.breaker is not None:
+            self.breaker.record_failure(error)
+        if not is_retryable(error):
+            raise error
+        if self.breaker is not None and self.breaker.state == CIRCUIT_OPEN:
+            raise CircuitOpenError(f"Circuit for {self.breaker.name} opened: {error}") from error
+
+        elapsed = time.time() - start
+        if attempt + 1 >= self.max_attempts:
+            raise RetryError(f"Giving up after {attempt + 1} attempts in {elapsed:.1f}s: {error}") from error
+
+        delay = self.backoff(attempt, error)
+        if end is not None and time.time() + delay >= end:
+            raise RetryError(f"Deadline of {self.deadline:.0f}s exceeded after {attempt + 1} attempts "
+                             f"in {elapsed:.1f}s: {error}") from error
+        return delay
+
+    def _remaining(self, end: Optional[float]) -> Optional[float]:
+        return None if end is None else max(0.0, end - time.time())
+
+    def call(self, func: Callable[[Optional[float]], Any],
+             on_retry: Optional[Callable[[Exception, float, int], None]] = None) -> Any:
+        """
+        Run `func` until it succeeds or the policy gives up.
+
+        Args:
+            func: One attempt; receives the seconds left until the deadline
+                (None without a deadline) so it can bound its own timeouts
+            on_retry: Called with (error, delay, attempt) before each backoff sleep
+
+        Returns:
+            Result of the first successful attempt
+
+        Raises:
+            CircuitOpenError: If the provider's circuit is open
+            RetryError: If attempts or the deadline run out
+            Exception: The attempt's own error if it is not retryable
+        """
+        start, end = self._start()
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = func(self._remaining(end))
+            except Exception as e:
+                delay = self._next_delay(attempt, e, start, end)
+                if on_retry is not None:
+                    on_retry(e, delay, attempt)
+                time.sleep(delay)
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    async def acall(self, func: Callable[[Optional[float]], Any],
+                    on_retry: Optional[Callable[[Exception, float, int], Any]] = None) -> Any:
+        """Async version of call; `func` returns an awaitable and so may `on_retry`."""
+        start, end = self._start()
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = await func(self._remaining(end))
+            except Exception as e:
+                delay = self._next_delay(attempt, e, start, end)
+                if on_retry is not None:
+                    pending = on_retry(e, delay, attempt)
+                    if inspect.isawaitable(pending):
+                        await pending
+                await asyncio.sleep(delay)
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+
+# Process-wide breakers (one per provider) and default policy
+_breakers: Dict[str, CircuitBreaker] = {}
+_policy = None
+_policy_lock = threading.Lock()
+
+def get_circuit_breaker(name: str = "together") -> CircuitBreaker:
+    """Get the process-wide circuit breaker of a provider, creating it from the environment on first use."""
+    with _policy_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+                reset_timeout=float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT))
+            )
+            _breakers[name] = breaker
+        return breaker
+
+def get_retry_policy() -> RetryPolicy:
+    """Get the default retry policy for Together calls, creating it from the environment on first use."""
+    global _policy
+    if _policy is None:
+        breaker = get_circuit_breaker("together")
+        with _policy_lock:
+            if _policy is None:
+                _policy = RetryPolicy(
+                    max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+                    deadline=float(os.getenv("LLM_RETRY_DEADLINE", DEFAULT_DEADLINE)),
+                    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", DEFAULT_BASE_DELAY)),
+                    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", DEFAULT_MAX_DELAY)),
+                    breaker=breaker
+                )
+    return _policy
+
+def set_retry_policy(policy: Optional[RetryPolicy]) -> None:
+    """
+    Replace the default retry policy.
+
+    Args:
+        policy: The policy to use, or None to rebuild it from the environment on next use
+    """
+    global _policy
+    with _policy_lock:
+        _policy = policy
+
+def reset_retry_policy() -> None:
+    """Drop the default policy and all circuit breakers so LLM_RETRY_* / LLM_CIRCUIT_* are re-read."""
+    global _policy
+    with _policy_lock:
+        _policy = None
+        _breakers.clear()
@@ -0,0 +1,476 @@
+"""
+Lexical Schema Index for MAC-SQL
+
+A BM25 inverted index over one database's schema: table names, column names,
+column descriptions (tables.json full names, column_meaning.json) and
+profiled value examples. It ranks the tables and columns of a question and
+picks the tables that cover the question's terms. The confidence score of
+that pick tells the Selector what to do:
+
+- confidence >= SCHEMA_INDEX_SKIP_CONFIDENCE: use the pick, no Selector LLM call
+- otherwise: send only the top candidate tables to the Selector LLM
+
+Either way the tables are widened by one foreign key hop, which brings in the
+lookup tables (statuses, types) a question rarely names.
+
+Tokenization is Cyrillic-aware. Text is case folded, apostrophe variants are
+removed (ім'я, ім’я and імя become one token), and identifiers are split on
+underscores and camelCase. A light suffix-stripping stemmer handles Ukrainian
+and English inflection, so "аеропортів" matches the column "аеропорти".
+
+Configuration (environment variables):
+    SCHEMA_INDEX: Set to 1 to let the Selectors use the index (default off)
+    SCHEMA_INDEX_SKIP_CONFIDENCE: Confidence from which the LLM call is skipped (default 0.7)
+    SCHEMA_INDEX_MAX_TABLES: Candidate tables sent to the LLM otherwise (default 8)
+"""
+
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SKIP_CONFIDENCE = 0.7
+DEFAULT_MAX_TABLES = 8
+
+# Tables scoring below this share of the best table only join the pick to cover new terms
+RELATIVE_SCORE = 0.5
+# Column name terms are repeated NAME_WEIGHT times; table name matches are scaled by TABLE_WEIGHT
+NAME_WEIGHT = 3
+TABLE_WEIGHT = 2.0
+
+APOSTROPHES = "'’ʼ`‘′"
+_APOSTROPHE_RE = re.compile(f"[{APOSTROPHES}]")
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-яіїєґ]")
+
+STOPWORDS = {
+    # Ukrainian function and question words
+    "і", "й", "та", "а", "але", "або", "чи", "в", "у", "на", "з", "із", "зі", "до", "від", "по", "за",
+    "для", "про", "при", "що", "хто", "де", "як", "це", "цей", "ця", "ці", "той", "та", "ті", "є", "був",
+    "була", "було", "були", "який", "яка", "яке", "які", "якого", "якої", "яких", "скільки", "усі", "всі",
+    "всіх", "усіх", "його", "її", "їх", "вони", "він", "вона", "не", "ні", "так", "мають", "має",
+    "будь", "ласка", "покажіть", "виведіть", "знайдіть", "перелічіть", "назвіть",
+    # English
+    "the", "a", "an", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were", "be",
+    "with", "by", "at", "from", "what", "which", "who", "how", "many", "much", "list", "show", "give",
+    "me", "all", "each", "that", "this", "there", "their", "its", "it", "as", "do", "does", "did",
+}
+
+# Ukrainian inflectional endings, longest first
+UKR_SUFFIXES = sorted({
+    # reflexive verbs
+    "ться", "тися", "ись", "ся", "сь",
+    # verbs
+    "ували", "ювали", "ував", "ював", "ати", "яти", "ити", "іти", "ути", "ють", "ять", "ать", "ить",
+    "ете", "ите", "ємо", "емо", "имо", "ала", "ила", "ало", "ило", "али", "или", "ав", "ив",
+    # adjectives
+    "ого", "ому", "ими", "іми", "ій", "ий", "ої", "ою", "ею", "єю", "их", "іх", "им", "ім", "ая", "яя",
+    "ее", "еє", "ьої", "ього", "ьому",
+    # nouns
+    "ами", "ями", "ах", "ях", "ові", "еві", "єві", "ом", "ем", "єм", "ів", "їв", "ей", "ям", "ам",
+    "а", "я", "о", "е", "є", "у", "ю", "і", "ї", "и", "ь", "й",
+}, key=len, reverse=True)
+ENG_SUFFIXES = ["ations", "ation", "ings", "ing", "sses", "shes", "ches", "xes", "s"]
+MIN_STEM = 3
+
+
+def fold(text: str) -> str:
+    """Case fold, drop apostrophes and merge ґ into г."""
+    return _APOSTROPHE_RE.sub("", str(text)).casefold().replace("ґ", "г")
+
+
+def stem(word: str) -> str:
+    """
+    Strip one inflectional ending, keeping at least MIN_STEM characters.
+
+    Args:
+        word: Folded word
+
+    Returns:
+        Stem
+    """
+    if word.isdigit():
+        return word
+    if _CYRILLIC_RE.search(word):
+        if word.startswith("най") and len(word) > 6:
+            # superlative: найбільший -> більший
+            word = word[3:]
+        for suffix in UKR_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+                return word[:-len(suffix)]
+        return word
+    if word.endswith("ies") and len(word) - 3 >= MIN_STEM:
+        return word[:-3] + "y"
+    for suffix in ENG_SUFFIXES:
+        if not word.endswith(suffix) or word.endswith("ss"):
+            continue
+        # boxes -> box, classes -> class, names -> name
+        cut = 2 if suffix in ("sses", "shes", "ches", "xes") else len(suffix)
+        if len(word) - cut >= MIN_STEM:
+            return word[:-cut]
+    return word
+
+
+def tokenize(text: Any, keep_stopwords: bool = False) -> List[str]:
+    """
+    Split text or an identifier into stemmed terms.
+
+    Args:
+        text: Question, description, identifier or value list
+        keep_stopwords: Keep function words (identifiers should not lose any part)
+
+    Returns:
+        List of terms in text order
+    """
+    if text is None:
+        return []
+    text = _CAMEL_RE.sub(" ", _APOSTROPHE_RE.sub("", str(text)))
+    terms = []
+    for word in _WORD_RE.findall(text):
+        word = fold(word)
+        if not keep_stopwords and word in STOPWORDS:
+            continue
+        terms.append(stem(word))
+    return terms
+
+
+class SchemaMatch:
+    """
+    Ranked tables and columns of one question.
+    """
+
+    def __init__(self, tables: List[Tuple[str, float]], columns: Dict[str, List[Tuple[str, float]]],
+                 selected: List[str], confidence: float, matched_terms: List[str], unmatched_terms: List[str]):
+        self.tables = tables
+        self.columns = columns
+        self.selected = selected
+        self.confidence = confidence
+        self.matched_terms = matched_terms
+        self.unmatched_terms = unmatched_terms
+
+    def candidates(self, max_tables: int) -> List[str]:
+        """The selected tables followed by the next best ones, at most max_tables (or all selected)."""
+        names = list(self.selected)
+        for table, score in self.tables:
+            if len(names) >= max_tables:
+                break
+            if score > 0 and table not in names:
+                names.append(table)
+        return names
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary for messages and logs."""
+        return {
+            "selected": self.selected,
+            "confidence": round(self.confidence, 3),
+            "tables": [(t, round(s, 3)) for t, s in self.tables[:10]],
+            "unmatched_terms": self.unmatched_terms
+        }
+
+
+class _BM25:
+    """
+    Okapi BM25 over one kind of document.
+    """
+
+    def __init__(self, k1: float, b: float):
+        self.k1 = k1
+        self.b = b
+        self.keys: List[Any] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)  # term -> [(doc, tf)]
+
+    def add(self, key: Any, terms: List[str]) -> None:
+        doc = len(self.keys)
+        self.keys.append(key)
+        self.lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            self.postings[term].append((doc, tf))
+
+    def scores(self, term: str) -> Dict[Any, float]:
+        """BM25 contribution of a term to every document containing it."""
+        postings = self.postings.get(term)
+        if not postings:
+            return {}
+        n = len(self.keys)
+        avgdl = max(sum(self.lengths) / n, 1e-9)
+        idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+        return {
+            self.keys[doc]: idf * tf * (self.k1 + 1) /
+                            (tf + self.k1 * (1 - self.b + self.b * self.lengths[doc] / avgdl))
+            for doc, tf in postings
+        }
+
+
+class SchemaIndex:
+    """
+    BM25 index of one database: table names and columns are scored separately.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        Initialize an empty index.
+
+        Args:
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.table_names: List[str] = []
+        self._tables = _BM25(k1, b)  # documents keyed by table
+        self._columns = _BM25(k1, b)  # documents keyed by (table, column)
+        self._table_terms: Dict[str, set] = {}
+        self.neighbours: Dict[str, set] = defaultdict(set)
+
+    def add_table(self, table: str, description: str = "") -> None:
+        """
+        Index a table name.
+
+        Args:
+            table: Table name
+            description: Optional table description
+        """
+        self.table_names.append(table)
+        name_terms = tokenize(table, keep_stopwords=True)
+        self._table_terms[table] = set(name_terms)
+        self._tables.add(table, name_terms + tokenize(description))
+
+    def add_column(self, table: str, column: str, full_name: str = "", description: str = "",
+                   values: str = "") -> None:
+        """
+        Index a column. Add its table first.
+
+        Args:
+            table: Table name
+            column: Column name
+            full_name: Readable column name (tables.json column_names)
+            description: Column description (column_meaning.json)
+            values: Value examples
+        """
+        name_terms = tokenize(column, keep_stopwords=True)
+        full_terms = [t for t in tokenize(full_name, keep_stopwords=True) if t not in name_terms]
+        # Descriptions like "... в таблиці <table>" would make every column match its table's name
+        own_table = self._table_terms.get(table, set())
+        text_terms = [t for t in tokenize(description) + tokenize(values) if t not in own_table]
+        self._columns.add((table, column), (name_terms + full_terms) * NAME_WEIGHT + text_terms)
+
+    def add_foreign_key(self, table: str, to_table: str) -> None:
+        """
+        Record a foreign key link, used to add bridge tables to a pick.
+
+        Args:
+            table: Referencing table
+            to_table: Referenced table
+        """
+        if table != to_table:
+            self.neighbours[table].add(to_table)
+            self.neighbours[to_table].add(table)
+
+    def with_neighbours(self, tables: List[str]) -> List[str]:
+        """
+        Tables plus the tables they reference or are referenced by (one foreign key hop).
+
+        Args:
+            tables: Picked tables
+
+        Returns:
+            The tables followed by their neighbours, in index order
+        """
+        picked = set(tables)
+        extra = [t for t in self.table_names if t not in picked and self.neighbours[t] & picked]
+        return list(tables) + extra
+
+    def search(self, question: str, evidence: str = "", max_tables: int = DEFAULT_MAX_TABLES) -> SchemaMatch:
+        """
+        Rank tables and columns for a question and pick the tables it needs.
+
+        A table's score sums, over the question terms, the best match of the
+        term in the table (its name, weighted by TABLE_WEIGHT, or any column),
+        so a term repeated across columns is counted once. The pick starts
+        from the best table and adds tables that score close to it or cover
+        terms not covered yet, then tables linking two picked tables by
+        foreign keys.
+
+        Confidence is the share of matched terms the pick covers, scaled down
+        when a table outside the pick scores close to the weakest picked one.
+
+        Args:
+            question: Natural language question
+            evidence: Optional evidence text (BIRD)
+            max_tables: Maximum number of picked tables
+
+        Returns:
+            SchemaMatch
+        """
+        terms = list(dict.fromkeys(tokenize(question) + tokenize(evidence)))
+
+        table_term_best: Dict[str, Dict[str, float]] = defaultdict(dict)
+        column_scores: Dict[Tuple[str, str], float] = defaultdict(float)
+        term_scores: Dict[str, float] = {}  # best score of each matched term anywhere
+        for term in terms:
+            best_by_table = {table: TABLE_WEIGHT * score for table, score in self._tables.scores(term).items()}
+            for (table, column), score in self._columns.scores(term).items():
+                column_scores[(table, column)] += score
+                if score > best_by_table.get(table, 0.0):
+                    best_by_table[table] = score
+            for table, score in best_by_table.items():
+                table_term_best[table][term] = score
+            if best_by_table:
+                term_scores[term] = max(best_by_table.values())
+
+        table_scores = {t: sum(table_term_best[t].values()) for t in self.table_names}
+        ranked = sorted(table_scores.items(), key=lambda kv: -kv[1])
+        columns: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        for (table, column), score in sorted(column_scores.items(), key=lambda kv: -kv[1]):
+            columns[table].append((column, score))
+
+        matched = [t for t in terms if t in term_scores]
+        unmatched = [t for t in terms if t not in term_scores]
+        if not ranked or ranked[0][1] <= 0:
+            return SchemaMatch(ranked, dict(columns), [], 0.0, matched, unmatched)
+
+        top = ranked[0][1]
+        selected, covered = [], set()
+        for table, score in ranked:
+            if score <= 0 or len(selected) >= max_tables:
+                break
+            # A term counts as covered by a table only where it is a real match, not a stray hit
+            new_terms = {t for t, s in table_term_best[table].items() if s >= 0.5 * term_scores[t]}
+            if score >= RELATIVE_SCORE * top or (new_terms - covered):
+                selected.append(table)
+                covered |= new_terms
+
+        for table, _ in ranked:
+            if len(selected) >= max_tables:
+                break
+            if table not in selected and len(self.neighbours[table] & set(selected)) >= 2:
+                selected.append(table)
+
+        coverage = len(covered & set(matched)) / len(matched)
+        weakest = min(table_scores[t] for t in selected)
+        runner_up = max((s for t, s in ranked if t not in selected), default=0.0)
+        margin = max(0.0, min(1.0, 1 - runner_up / weakest)) if weakest > 0 else 0.0
+        # Question words the schema does not know often point at values of tables not picked
+        known = len(matched) / len(terms)
+        confidence = coverage * (0.5 + 0.5 * margin) * math.sqrt(known)
+        return SchemaMatch(ranked, dict(columns), selected, confidence, matched, unmatched)
+
+
+def column_meanings_for_db(meanings: Dict[str, Any], db_id: str) -> Dict[Tuple[str, str], str]:
+    """
+    Column descriptions of one database from a column_meaning.json mapping.
+
+    Both layouts are accepted: {db_id: {"table.column": text}} (BIRD-UKR) and
+    {"db_id|table|column": text} (BIRD).
+
+    Args:
+        meanings: Parsed column_meaning.json
+        db_id: Database identifier
+
+    Returns:
+        Dictionary mapping (table, column), folded, to the description
+    """
+    result = {}
+    nested = meanings.get(db_id)
+    if isinstance(nested, dict):
+        for key, text in nested.items():
+            table, _, column = key.partition(".")
+            result[(fold(table), fold(column))] = str(text)
+        return result
+    prefix = f"{db_id}|"
+    for key, text in meanings.items():
+        if key.startswith(prefix):
+            parts = key.split("|")
+            if len(parts) == 3:
+                result[(fold(parts[1]), fold(parts[2]))] = str(text)
+    return result
+
+
+def load_column_meanings(*dirs: str) -> Dict[str, Any]:
+    """
+    Parse the first column_meaning.json found in the given directories.
+
+    Args:
+        *dirs: Directories to look in, in order
+
+    Returns:
+        Parsed file, or {} if there is none
+    """
+    for directory in dirs:
+        path = os.path.join(directory, "column_meaning.json")
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable {path}: {str(e)}")
+    return {}
+
+
+def build_index_from_db_info(db_info: Dict[str, Any], meanings: Optional[Dict[Tuple[str, str], str]] = None) -> SchemaIndex:
+    """
+    Index a Selector database profile (desc_dict, value_dict, fk_dict).
+
+    Args:
+        db_info: Result of Selector._load_single_db_info
+        meanings: Result of column_meanings_for_db
+
+    Returns:
+        SchemaIndex
+    """
+    meanings = meanings or {}
+    index = SchemaIndex()
+    for table, columns_desc in db_info["desc_dict"].items():
+        index.add_table(table)
+        values = dict(db_info["value_dict"].get(table, []))
+        for col_name, full_col_name, extra_desc in columns_desc:
+            description = " ".join(str(d) for d in (extra_desc, meanings.get((fold(table), fold(col_name)), ""))
+                                   if d and str(d) != "nan")
+            index.add_column(table, col_name, full_col_name, description, values.get(col_name, ""))
+        for _, to_table, _ in db_info["fk_dict"].get(table, []):
+            index.add_foreign_key(table, to_table)
+    return index
+
+
+def build_index_from_pg_schema(schema_info: Dict[str, Any],
+                               meanings: Optional[Dict[Tuple[str, str], str]] = None) -> SchemaIndex:
+    """
+    Index a PostgreSQLSelector schema ({"tables": {table: [column dicts]}, "foreign_keys": [...]}).
+
+    Args:
+        schema_info: Result of PostgreSQLSelector.get_schema
+        meanings: Result of column_meanings_for_db
+
+    Returns:
+        SchemaIndex
+    """
+    meanings = meanings or {}
+    index = SchemaIndex()
+    for table, columns in schema_info["tables"].items():
+        index.add_table(table)
+        for col in columns:
+            index.add_column(table, col["name"], description=meanings.get((fold(table), fold(col["name"])), ""),
+                             values=" ".join(str(v) for v in col.get("samples", [])))
+    for fk in schema_info.get("foreign_keys", []):
+        index.add_foreign_key(fk["source_table"], fk["target_table"])
+    return index
+
+
+def is_enabled() -> bool:
+    """Whether the Selectors should consult the index (SCHEMA_INDEX=1)."""
+    return os.getenv("SCHEMA_INDEX", "0").lower() in ("1", "true", "yes", "on")
+
+
+def skip_confidence() -> float:
+    """Confidence from which the Selector LLM call is skipped."""
+    return float(os.getenv("SCHEMA_INDEX_SKIP_CONFIDENCE", DEFAULT_SKIP_CONFIDENCE))
+
+
+def max_tables() -> int:
+    """Candidate tables sent to the Selector LLM when the confidence is lower."""
+    return int(os.getenv("SCHEMA_INDEX_MAX_TABLES", DEFAULT_MAX_TABLES))
@@ -0,0 +1,200 @@
+"""
+Selector Decision Cache for MAC-SQL
+
+Re-running an evaluation with another Decomposer prompt or model asks the
+Selector about the same (db_id, question, evidence) triples again. This module
+stores the Selector's decision, the extracted schema with its selected tables
+and columns, in a small SQLite file. Later runs then reuse it and only pay for
+the stages that changed.
+
+Entries are keyed by database, the question normalized with
+normalize_ukr_query (case and whitespace), and the evidence. A version hash
+of the Selector prompt template, the model and the selection settings is
+part of the key, so changing any of them starts a fresh set of decisions.
+
+Configuration (environment variables):
+    SELECTOR_CACHE_DIR: Directory holding the cache file. Caching is disabled if
+        unset or "off".
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from utils.bird_ukr_loader import normalize_ukr_query
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = "selector_decisions.sqlite"
+
+
+def make_version(*parts: Any) -> str:
+    """
+    Hash the inputs that shape a Selector's decision besides the question.
+
+    Args:
+        *parts: Prompt template, model name, selector class, settings, ...
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps([str(p) for p in parts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_decision_key(version: str, db_id: str, question: str, evidence: Optional[str] = None) -> str:
+    """
+    Build the cache key of one Selector decision.
+
+    Args:
+        version: Result of make_version
+        db_id: Database identifier
+        question: Natural language question
+        evidence: Evidence text, if any
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps({
+        "version": version,
+        "db_id": db_id,
+        "question": normalize_ukr_query(question or ""),
+        "evidence": " ".join((evidence or "").split())
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SelectorDecisionCache:
+    """
+    SQLite-backed store of Selector decisions.
+
+    The cache is safe to share between threads of one process; several
+    processes may point at the same directory since SQLite serializes writers.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory where the cache file lives (created if missing)
+        """
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE_NAME)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS decisions (
+                key TEXT PRIMARY KEY,
+                version TEXT,
+                db_id TEXT,
+                question TEXT,
+                decision TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.commit()
+        logger.info(f"Selector decision cache enabled at {self.path}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a decision.
+
+        Args:
+            key: Cache key from make_decision_key
+
+        Returns:
+            The stored decision, or None on a miss
+        """
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute("SELECT decision FROM decisions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, version: str, db_id: str, question: str, decision: Dict[str, Any]) -> None:
+        """
+        Store a decision.
+
+        Args:
+            key: Cache key from make_decision_key
+            version: Result of make_version, kept to inspect or purge old entries
+            db_id: Database identifier
+            question: The question as asked
+            decision: JSON-serializable decision
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO decisions (key, version, db_id, question, decision, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, version, db_id, question, json.dumps(decision, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+            self.writes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and write counts of this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Process-wide cache, None when disabled
+_selector_cache = None
+_selector_cache_loaded = False
+_selector_cache_lock = threading.Lock()
+
+def get_selector_cache() -> Optional[SelectorDecisionCache]:
+    """Get the process-wide decision cache, or None if SELECTOR_CACHE_DIR is unset or "off"."""
+    global _selector_cache, _selector_cache_loaded
+    if not _selector_cache_loaded:
+        with _selector_cache_lock:
+            if not _selector_cache_loaded:
+                cache_dir = os.getenv("SELECTOR_CACHE_DIR", "")
+                if cache_dir and cache_dir.lower() != "off":
+                    _selector_cache = SelectorDecisionCache(cache_dir)
+                _selector_cache_loaded = True
+    return _selector_cache
+
+def set_selector_cache(cache: Optional[SelectorDecisionCache]) -> None:
+    """
+    Replace the process-wide decision cache.
+
+    Args:
+        cache: The cache to use, or None to disable caching
+    """
+    global _selector_cache, _selector_cache_loaded
+    with _selector_cache_lock:
+        old_cache = _selector_cache
+        _selector_cache = cache
+        _selector_cache_loaded = True
+    if old_cache is not None and old_cache is not cache:
+        old_cache.close()
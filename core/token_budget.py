@@ -0,0 +1,171 @@
+"""
+Prompt Token Budgets for MAC-SQL
+
+The Selector decides whether a database schema must be pruned by an LLM call
+before it goes into the Decomposer prompt. With a token budget configured,
+that decision is made on token counts: every table block and column line of
+the rendered schema carries a precomputed token count, stored with the
+database profile (see core/db_profile_cache.py). If the schema exceeds the
+budget but a deterministic trim fits it, for example dropping value
+examples, no Selector LLM call is made.
+
+Token counts use tiktoken's cl100k_base encoding when tiktoken is installed
+and its encoding file can be loaded, and a characters/3 estimate otherwise.
+Either way they approximate the serving model's tokenizer.
+
+Fragments are measured in units that add up: tokens with tiktoken, characters
+with the estimate. tiktoken splits text into pieces before merging tokens, and
+a newline that ends a line of punctuation always ends a piece, so fragments
+cut right after such a newline have exactly the tokens of the joined text.
+`max_units` turns a token budget into the same units.
+
+Configuration (environment variables):
+    SELECTOR_TOKEN_BUDGET: Schema tokens (desc_str + fk_str) allowed without
+        pruning. Unset keeps the column-count rule.
+    SELECTOR_TOKEN_BUDGETS: JSON object of per-model budgets, e.g.
+        {"meta-llama/Llama-3.3-70B-Instruct-Turbo": 6000}
+"""
+
+import os
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+from core.rate_limiter import estimate_tokens
+
+# tiktoken is optional - fall back to the character-based estimate
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+ESTIMATE_NAME = "chars/3"
+
+# None until first use, False when tiktoken is missing or its encoding cannot be loaded
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        _encoder = False
+        if TIKTOKEN_AVAILABLE:
+            try:
+                # The encoding file is downloaded on first use
+                _encoder = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception as e:
+                logger.warning(f"Could not load tiktoken encoding {ENCODING_NAME}, estimating tokens: {str(e)}")
+    return _encoder
+
+
+def tokenizer_name() -> str:
+    """Name of the tokenizer count_tokens uses, part of the profile cache key."""
+    return ENCODING_NAME if _get_encoder() else ESTIMATE_NAME
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a prompt fragment.
+
+    Args:
+        text: Text to count
+
+    Returns:
+        Number of tokens
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def count_units(text: str) -> int:
+    """
+    Additive size of a prompt fragment, see the module docstring.
+
+    Args:
+        text: Fragment, cut right after a newline from the text around it
+
+    Returns:
+        Tokens with tiktoken, characters with the estimate
+    """
+    if _get_encoder():
+        return count_tokens(text)
+    return len(text)
+
+
+def max_units(budget: int) -> int:
+    """
+    Largest fragment size whose joined text fits a token budget.
+
+    Args:
+        budget: Token budget
+
+    Returns:
+        The budget in the units of count_units
+    """
+    if _get_encoder():
+        return budget
+    # count_tokens estimates len(text) // 3 + 1
+    return 3 * budget - 1
+
+
+def get_token_budget(model: Optional[str]) -> Optional[int]:
+    """
+    Schema token budget of a model.
+
+    Args:
+        model: Model name
+
+    Returns:
+        The budget, or None if no budget is configured
+    """
+    overrides = os.getenv("SELECTOR_TOKEN_BUDGETS")
+    if overrides and model:
+        try:
+            budgets = json.loads(overrides)
+        except ValueError:
+            logger.warning("SELECTOR_TOKEN_BUDGETS is not valid JSON, ignoring it")
+            budgets = {}
+        if model in budgets:
+            return int(budgets[model])
+    budget = os.getenv("SELECTOR_TOKEN_BUDGET")
+    return int(budget) if budget else None
+
+
+def plan_trim(total_tokens: int, budget: int, savings: List[Tuple[int, Any]]) -> Optional[List[Any]]:
+    """
+    Choose the fewest optional fragments to drop so the schema fits the budget.
+
+    Fragments are dropped largest first; ties keep their schema order, so the
+    same schema and budget always give the same result. Sizes may be in any
+    additive unit, e.g. count_units with max_units(budget).
+
+    Args:
+        total_tokens: Size of the untrimmed schema
+        budget: Size budget
+        savings: (size saved, key) for every droppable fragment, in schema order
+
+    Returns:
+        Keys of the fragments to drop ([] if the schema already fits), or None
+        if dropping all of them still exceeds the budget
+    """
+    if total_tokens <= budget:
+        return []
+    order = sorted(range(len(savings)), key=lambda i: (-savings[i][0], i))
+    dropped = []
+    for i in order:
+        saved, key = savings[i]
+        if saved <= 0:
+            break
+        total_tokens -= saved
+        dropped.append(key)
+        if total_tokens <= budget:
+            return dropped
+    return None
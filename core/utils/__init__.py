@@ -14,7 +14,10 @@ from core.utils.serialization import (
 from core.utils.parsing import (
     parse_json,
     parse_sql_from_string,
-    add_prefix
+    add_prefix,
+    sql_block_closed,
+    decomposition_solved,
+    json_object_closed
 )
 
 # Import file utilities
@@ -48,6 +51,9 @@ __all__ = [
     'parse_json',
     'parse_sql_from_string',
     'add_prefix',
+    'sql_block_closed',
+    'decomposition_solved',
+    'json_object_closed',
     
     # File operations
     'load_json_file',
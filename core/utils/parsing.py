@@ -22,6 +22,10 @@ def parse_json(text: str) -> dict:
     start = text.find("```json")
     end = text.find("```", start + 7)
     
+    # A stream stopped by json_object_closed ends before the closing fence
+    if start != -1 and end == -1:
+        end = len(text)
+    
     # If JSON block is found
     if start != -1 and end != -1:
         json_string = text[start + 7: end]
@@ -82,6 +86,77 @@ def parse_sql_from_string(input_string: str) -> str:
     else:
         return "error: No SQL found in the input string"
 
+def sql_block_closed(text: str) -> bool:
+    """
+    Stream stop predicate: a complete ```sql block has been generated
+    
+    Used for the Refiner, whose reply carries a single corrected query.
+    
+    Args:
+        text: Response text generated so far
+        
+    Returns:
+        True once the first ```sql fence has been closed
+    """
+    start = text.find("```sql")
+    return start != -1 and text.find("```", start + 6) != -1
+
+def decomposition_solved(text: str) -> bool:
+    """
+    Stream stop predicate: the Decomposer has written "Question Solved." after its final SQL
+    
+    Sub-questions each carry a ```sql block, so only the closing marker tells
+    which block is the final one.
+    
+    Args:
+        text: Response text generated so far
+        
+    Returns:
+        True once "Question Solved" follows a closed ```sql block
+    """
+    marker = text.find("Question Solved")
+    return marker != -1 and sql_block_closed(text[:marker])
+
+def json_object_closed(text: str) -> bool:
+    """
+    Stream stop predicate: the top-level object of the ```json block is balanced
+    
+    Used for the Selector; braces inside JSON strings are ignored.
+    
+    Args:
+        text: Response text generated so far
+        
+    Returns:
+        True once the JSON object has been closed
+    """
+    start = text.find("```json")
+    if start == -1:
+        return False
+    start = text.find("{", start + 7)
+    if start == -1:
+        return False
+    
+    depth = 0
+    in_string = False
+    escaped = False
+    for ch in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
 def add_prefix(sql: str) -> str:
     """
     Add SELECT prefix to SQL if needed
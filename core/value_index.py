@@ -0,0 +1,501 @@
+"""
+Value Mention Index for MAC-SQL
+
+Questions quote literal values ("у місті Київ", "з хворобою 'Пневмонія'")
+that the schema prompt only shows if they happen to be among a column's few
+sample values. This module links question substrings to the stored values
+without touching the database on the hot path:
+
+- `build_value_index` writes, offline, one file per database with every
+  distinct text value and a trigram inverted index over the values.
+- `ValueIndex` memory-maps that file and answers `lookup(question)` with
+  (table, column, canonical value, mention) matches.
+
+Values and questions are compared after case folding, apostrophe removal
+(ім'я = ім’я = імя) and ґ -> г, on trigrams of space-padded words. A value is
+a match when a window of question words of the same length is similar enough
+to it (Dice coefficient of the trigram sets), so light inflection such as
+"кардіолога" for "Кардіолог" still links.
+
+File layout (little endian): the magic bytes, a uint32 header length, a JSON
+header with the columns and section offsets, then 8-byte aligned sections:
+value offsets (uint32), value columns (uint32), value trigram counts (uint16),
+sorted trigram keys (uint64, three code points of 21 bits), posting offsets
+(uint32), postings (uint32 value ids) and the UTF-8 values.
+
+Configuration (environment variables):
+    VALUE_INDEX_DIR: Directory of the <db_id>.vidx files (default ./cache/value_index,
+        relative to the working directory; "off" disables lookups)
+"""
+
+import os
+import re
+import json
+import mmap
+import struct
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from core.schema_index import fold
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MACVIX01"
+INDEX_VERSION = 1
+DEFAULT_INDEX_DIR = os.path.join(".", "cache", "value_index")
+
+# Values outside these bounds are not literals a question would quote
+MIN_VALUE_LENGTH = 3
+MAX_VALUE_LENGTH = 100
+MAX_VALUE_WORDS = 8
+DEFAULT_MAX_VALUES_PER_COLUMN = 100000
+
+MIN_SIMILARITY = 0.75
+# Dice >= s needs at least s / (2 - s) of the value's trigrams in the question,
+# so candidates below that share are dropped before verification without loss
+MIN_CANDIDATE_SHARE = MIN_SIMILARITY / (2 - MIN_SIMILARITY)
+MAX_CANDIDATES = 32
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def words(text: str) -> List[str]:
+    """Folded words of a text."""
+    return _WORD_RE.findall(fold(text))
+
+
+def trigrams(text_words: List[str]) -> set:
+    """
+    Trigram keys of space-padded words.
+
+    Args:
+        text_words: Folded words
+
+    Returns:
+        Set of uint64 keys (three code points of 21 bits each)
+    """
+    if len(text_words) == 1:
+        return set(_word_trigrams(text_words[0]))
+    keys = set()
+    for word in text_words:
+        keys |= _word_trigrams(word)
+    return keys
+
+
+@lru_cache(maxsize=65536)
+def _word_trigrams(word: str) -> frozenset:
+    padded = f" {word} "
+    codes = [ord(c) for c in padded]
+    return frozenset((codes[i] << 42) | (codes[i + 1] << 21) | codes[i + 2] for i in range(len(codes) - 2))
+
+
+def is_indexable(value: Any) -> bool:
+    """Whether a value is text a question could quote."""
+    if not isinstance(value, str):
+        return False
+    text = value.strip()
+    if not (MIN_VALUE_LENGTH <= len(text) <= MAX_VALUE_LENGTH):
+        return False
+    value_words = words(text)
+    if not value_words or len(value_words) > MAX_VALUE_WORDS:
+        return False
+    # Numbers and dates are matched by the SQL itself, not by lookup
+    return any(not w.isdigit() for w in value_words)
+
+
+class ValueMatch:
+    """
+    One question substring linked to a stored value.
+    """
+
+    def __init__(self, table: str, column: str, value: str, mention: str, score: float):
+        self.table = table
+        self.column = column
+        self.value = value
+        self.mention = mention
+        self.score = score
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"table": self.table, "column": self.column, "value": self.value,
+                "mention": self.mention, "score": round(self.score, 3)}
+
+    def __repr__(self) -> str:
+        return f"ValueMatch({self.table}.{self.column}={self.value!r}, mention={self.mention!r}, score={self.score:.2f})"
+
+
+def build_value_index(values: Iterable[Tuple[str, str, Any]], path: str, db_id: str = "") -> Dict[str, int]:
+    """
+    Write the value index of one database.
+
+    Args:
+        values: (table, column, value) triples; non-text and duplicate values are skipped
+        path: Output file, replaced atomically
+        db_id: Database identifier stored in the header
+
+    Returns:
+        Statistics (columns, values, trigrams, postings)
+    """
+    columns: List[Tuple[str, str]] = []
+    column_ids: Dict[Tuple[str, str], int] = {}
+    seen = set()
+    value_texts: List[str] = []
+    value_columns: List[int] = []
+    value_ntri: List[int] = []
+    postings: Dict[int, List[int]] = defaultdict(list)
+
+    for table, column, value in values:
+        if not is_indexable(value):
+            continue
+        value = value.strip()
+        key = (table, column)
+        if key not in column_ids:
+            column_ids[key] = len(columns)
+            columns.append(key)
+        col_id = column_ids[key]
+        if (col_id, value) in seen:
+            continue
+        seen.add((col_id, value))
+
+        value_id = len(value_texts)
+        value_keys = trigrams(words(value))
+        value_texts.append(value)
+        value_columns.append(col_id)
+        value_ntri.append(min(len(value_keys), 65535))
+        for k in value_keys:
+            postings[k].append(value_id)
+
+    blob = bytearray()
+    value_offsets = [0]
+    for text in value_texts:
+        blob += text.encode("utf-8")
+        value_offsets.append(len(blob))
+
+    tri_keys = sorted(postings)
+    tri_offsets = [0]
+    posting_ids: List[int] = []
+    for k in tri_keys:
+        posting_ids.extend(postings[k])
+        tri_offsets.append(len(posting_ids))
+
+    sections = [
+        ("value_offsets", np.asarray(value_offsets, dtype="<u4").tobytes()),
+        ("value_columns", np.asarray(value_columns, dtype="<u4").tobytes()),
+        ("value_ntri", np.asarray(value_ntri, dtype="<u2").tobytes()),
+        ("tri_keys", np.asarray(tri_keys, dtype="<u8").tobytes()),
+        ("tri_offsets", np.asarray(tri_offsets, dtype="<u4").tobytes()),
+        ("postings", np.asarray(posting_ids, dtype="<u4").tobytes()),
+        ("values", bytes(blob)),
+    ]
+    stats = {"columns": len(columns), "values": len(value_texts),
+             "trigrams": len(tri_keys), "postings": len(posting_ids)}
+
+    # Section offsets are relative to the end of the header, each 8-byte aligned
+    layout, offset = {}, 0
+    for name, data in sections:
+        offset = (offset + 7) // 8 * 8
+        layout[name] = [offset, len(data)]
+        offset += len(data)
+    header = json.dumps({"version": INDEX_VERSION, "db_id": db_id, "columns": columns,
+                         "sections": layout, "stats": stats}, ensure_ascii=False).encode("utf-8")
+    header += b" " * ((-(len(MAGIC) + 4 + len(header))) % 8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        position = 0
+        for name, data in sections:
+            start = layout[name][0]
+            f.write(b"\0" * (start - position))
+            f.write(data)
+            position = start + len(data)
+    os.replace(tmp_path, path)
+    return stats
+
+
+class ValueIndex:
+    """
+    Read-only, memory-mapped value index of one database.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open an index file.
+
+        Args:
+            path: File written by build_value_index
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a value index")
+        (header_len,) = struct.unpack_from("<I", self._mmap, len(MAGIC))
+        base = len(MAGIC) + 4
+        header = json.loads(self._mmap[base:base + header_len].decode("utf-8"))
+        if header.get("version") != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"{path} has index version {header.get('version')}, expected {INDEX_VERSION}")
+        self.db_id = header["db_id"]
+        self.columns = [tuple(c) for c in header["columns"]]
+        base += header_len
+
+        def section(name: str, dtype: str) -> np.ndarray:
+            offset, length = header["sections"][name]
+            return np.frombuffer(self._mmap, dtype=dtype, count=length // np.dtype(dtype).itemsize,
+                                 offset=base + offset)
+
+        self._value_offsets = section("value_offsets", "<u4")
+        self._value_columns = section("value_columns", "<u4")
+        self._value_ntri = section("value_ntri", "<u2")
+        self._tri_keys = section("tri_keys", "<u8")
+        self._tri_offsets = section("tri_offsets", "<u4")
+        self._postings = section("postings", "<u4")
+        self._values_base = base + header["sections"]["values"][0]
+
+    def __len__(self) -> int:
+        return len(self._value_columns)
+
+    def value(self, value_id: int) -> Tuple[str, str, str]:
+        """
+        Look up a value by id.
+
+        Returns:
+            (table, column, canonical value)
+        """
+        start = self._values_base + int(self._value_offsets[value_id])
+        end = self._values_base + int(self._value_offsets[value_id + 1])
+        table, column = self.columns[int(self._value_columns[value_id])]
+        return table, column, self._mmap[start:end].decode("utf-8")
+
+    def lookup(self, question: str, max_matches: int = 10) -> List[ValueMatch]:
+        """
+        Find the stored values mentioned in a question.
+
+        Args:
+            question: Natural language question
+            max_matches: Maximum number of matches returned
+
+        Returns:
+            Matches by descending similarity
+        """
+        question_words = words(question)
+        if not question_words or len(self._tri_keys) == 0:
+            return []
+        keys = np.fromiter(trigrams(question_words), dtype="<u8")
+        keys.sort()
+        positions = np.searchsorted(self._tri_keys, keys)
+        inside = positions < len(self._tri_keys)
+        positions, keys = positions[inside], keys[inside]
+        positions = positions[self._tri_keys[positions] == keys]
+        if not len(positions):
+            return []
+        hits = np.concatenate([self._postings[self._tri_offsets[p]:self._tri_offsets[p + 1]] for p in positions])
+        value_ids, counts = np.unique(hits, return_counts=True)
+        share = counts / self._value_ntri[value_ids]
+        keep = share >= MIN_CANDIDATE_SHARE
+        value_ids, share = value_ids[keep], share[keep]
+        if len(value_ids) > MAX_CANDIDATES:
+            top = np.argpartition(-share, MAX_CANDIDATES)[:MAX_CANDIDATES]
+            value_ids = value_ids[top]
+
+        window_keys: Dict[Tuple[int, int], set] = {}
+        matches = []
+        for value_id in value_ids.tolist():
+            table, column, value = self.value(value_id)
+            value_words = words(value)
+            value_keys = trigrams(value_words)
+            n = len(value_words)
+            best, best_start = 0.0, -1
+            for start in range(0, len(question_words) - n + 1):
+                span = (start, n)
+                if span not in window_keys:
+                    window_keys[span] = trigrams(question_words[start:start + n])
+                span_keys = window_keys[span]
+                score = 2 * len(value_keys & span_keys) / (len(value_keys) + len(span_keys))
+                if score > best:
+                    best, best_start = score, start
+            if best >= MIN_SIMILARITY:
+                mention = " ".join(question_words[best_start:best_start + n])
+                matches.append(ValueMatch(table, column, value, mention, best))
+        matches.sort(key=lambda m: (-m.score, m.table, m.column, m.value))
+        return matches[:max_matches]
+
+    def close(self) -> None:
+        """Release the memory map."""
+        for name in ("_value_offsets", "_value_columns", "_value_ntri", "_tri_keys", "_tri_offsets", "_postings"):
+            self.__dict__.pop(name, None)
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+def iter_sqlite_values(db_path: str, max_values_per_column: int = DEFAULT_MAX_VALUES_PER_COLUMN) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Distinct text values of every column of a SQLite database.
+
+    Args:
+        db_path: Path of the .sqlite file
+        max_values_per_column: Values read per column at most
+
+    Yields:
+        (table, column, value)
+    """
+    import sqlite3
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.text_factory = lambda b: b.decode(errors="ignore")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'PRAGMA table_info("{table}")')
+            for _, column, col_type, *_ in cursor.fetchall():
+                if col_type.upper() in ("INTEGER", "REAL", "NUMERIC", "FLOAT", "INT", "BLOB"):
+                    continue
+                cursor.execute(f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL '
+                               f'AND length("{column}") <= ? LIMIT ?', (MAX_VALUE_LENGTH, max_values_per_column))
+                for (value,) in cursor.fetchall():
+                    yield table, column, value
+    finally:
+        conn.close()
+
+
+def iter_pg_values(conn, schema: str = "public",
+                   max_values_per_column: int = DEFAULT_MAX_VALUES_PER_COLUMN) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Distinct text values of every text column of a PostgreSQL schema.
+
+    Args:
+        conn: psycopg2 connection
+        schema: Schema name
+        max_values_per_column: Values read per column at most
+
+    Yields:
+        (table, column, value)
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.table_name, c.column_name
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = %s AND t.table_type = 'BASE TABLE'
+          AND c.data_type IN ('text', 'character varying', 'character', 'USER-DEFINED')
+        ORDER BY c.table_name, c.ordinal_position
+    """, (schema,))
+    for table, column in cursor.fetchall():
+        cursor.execute(f'SELECT DISTINCT "{column}"::text FROM "{schema}"."{table}" '
+                       f'WHERE "{column}" IS NOT NULL AND length("{column}"::text) <= %s LIMIT %s',
+                       (MAX_VALUE_LENGTH, max_values_per_column))
+        for (value,) in cursor.fetchall():
+            yield table, column, value
+    cursor.close()
+
+
+def index_path(db_id: str, index_dir: Optional[str] = None) -> str:
+    """Path of a database's index file."""
+    return os.path.join(index_dir or os.getenv("VALUE_INDEX_DIR", DEFAULT_INDEX_DIR), f"{db_id}.vidx")
+
+
+# Opened indexes per database (None when missing)
+_indexes: Dict[str, Optional[ValueIndex]] = {}
+_indexes_lock = threading.Lock()
+
+def get_value_index(db_id: str) -> Optional[ValueIndex]:
+    """
+    Get the value index of a database, opening it on first use.
+
+    Args:
+        db_id: Database identifier
+
+    Returns:
+        The index, or None if VALUE_INDEX_DIR is "off" or no index was built
+    """
+    index_dir = os.getenv("VALUE_INDEX_DIR", DEFAULT_INDEX_DIR)
+    if not index_dir or index_dir.lower() == "off":
+        return None
+    with _indexes_lock:
+        if db_id not in _indexes:
+            path = index_path(db_id, index_dir)
+            index = None
+            if os.path.exists(path):
+                try:
+                    index = ValueIndex(path)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ignoring value index {path}: {str(e)}")
+            _indexes[db_id] = index
+        return _indexes[db_id]
+
+def reset_value_indexes() -> None:
+    """Close all opened indexes (e.g. after rebuilding them)."""
+    with _indexes_lock:
+        for index in _indexes.values():
+            if index is not None:
+                index.close()
+        _indexes.clear()
+
+
+def index_version(db_id: str) -> str:
+    """
+    Identity of the index file lookup_values would read, for cache keys.
+
+    Args:
+        db_id: Database identifier
+
+    Returns:
+        Path, size and modification time of the file, or "" if lookups are off or no index was built
+    """
+    index_dir = os.getenv("VALUE_INDEX_DIR", DEFAULT_INDEX_DIR)
+    if not index_dir or index_dir.lower() == "off":
+        return ""
+    path = index_path(db_id, index_dir)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def lookup_values(db_id: str, question: str, max_matches: int = 10) -> List[ValueMatch]:
+    """
+    Values of a database mentioned in a question.
+
+    Args:
+        db_id: Database identifier
+        question: Natural language question
+        max_matches: Maximum number of matches
+
+    Returns:
+        Matches, or [] if the database has no index
+    """
+    index = get_value_index(db_id)
+    if index is None or not question:
+        return []
+    return index.lookup(question, max_matches=max_matches)
+
+
+def format_value_hints(matches: List[ValueMatch]) -> str:
+    """
+    Render matches as prompt lines, e.g. `аеропорти.місто = 'Київ'`.
+
+    Args:
+        matches: Result of ValueIndex.lookup
+
+    Returns:
+        One line per match, or "" without matches
+    """
+    lines = []
+    for m in matches:
+        value = m.value.replace("'", "''")
+        lines.append(f"{m.table}.{m.column} = '{value}'")
+    return "\n".join(lines)
@@ -0,0 +1,90 @@
+"""
+Cold-start Schema Loading Benchmark
+
+Measures the wall time of `Selector(lazy=False)` database profiling on the
+BIRD dev databases for different worker counts. The profile cache is disabled
+so that every run really profiles the databases.
+
+Usage:
+    python evaluation/benchmark_db_loading.py --bird-path data/bird --workers 1,2,4,8
+                                              [--repeat 1] [--limit 0] [--output-file results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+# Profile every database instead of loading cached profiles
+os.environ["DB_PROFILE_CACHE_DIR"] = "off"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agents import Selector
+from core.db_loader import load_db_infos, list_db_ids
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def find_bird_files(bird_path):
+    """Locate the database directory and tables.json of a BIRD checkout."""
+    db_dir = os.path.join(bird_path, "dev_databases")
+    if not os.path.exists(db_dir):
+        db_dir = os.path.join(bird_path, "database")
+    for name in ("dev_tables.json", "tables.json"):
+        tables_json = os.path.join(bird_path, name)
+        if os.path.exists(tables_json):
+            return db_dir, tables_json
+    raise FileNotFoundError(f"No dev_tables.json or tables.json in {bird_path}")
+
+
+def run_once(db_dir, tables_json, db_ids, workers):
+    """Profile all databases once and return (seconds, failed database ids)."""
+    selector = Selector(data_path=db_dir, tables_json_path=tables_json, model_name="benchmark",
+                        dataset_name="bird", lazy=True)
+    start = time.time()
+    errors = load_db_infos(selector, db_ids=db_ids, workers=workers, show_progress=False)
+    return time.time() - start, sorted(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel cold-start schema loading")
+    parser.add_argument("--bird-path", type=str, default=os.getenv("BIRD_PATH", "data/bird"),
+                        help="BIRD directory containing dev_databases/ and dev_tables.json")
+    parser.add_argument("--workers", type=str, default="1,2,4,8", help="Comma-separated worker counts")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per worker count (best time is reported)")
+    parser.add_argument("--limit", type=int, default=0, help="Only load the first N databases (0 = all)")
+    parser.add_argument("--output-file", type=str, default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    db_dir, tables_json = find_bird_files(args.bird_path)
+    db_ids = list_db_ids(db_dir)
+    if args.limit > 0:
+        db_ids = db_ids[:args.limit]
+    worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+    print(f"Profiling {len(db_ids)} databases from {db_dir}")
+
+    results = []
+    baseline = None
+    for workers in worker_counts:
+        times = []
+        failed = []
+        for _ in range(args.repeat):
+            seconds, failed = run_once(db_dir, tables_json, db_ids, workers)
+            times.append(seconds)
+        best = min(times)
+        baseline = baseline or best
+        results.append({"workers": workers, "seconds": best, "speedup": baseline / best, "failed": failed})
+        print(f"workers={workers:<3d} wall={best:8.2f}s  speedup={baseline / best:5.2f}x  failed={len(failed)}")
+
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump({"databases": len(db_ids), "results": results}, f, indent=2)
+        print(f"Results saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
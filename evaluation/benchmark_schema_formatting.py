@@ -0,0 +1,122 @@
+"""
+Schema Formatting Benchmark
+
+Measures the per-question cost of `Selector._get_db_desc_str` on the largest
+BIRD databases (by column count): rendering the full schema, and rendering
+pruned schemas for random Selector decisions (keep_all, drop_all and column
+lists). The first call of each database also renders its cached fragments and
+is reported separately. Database profiles come from the profile cache when
+available.
+
+Usage:
+    python evaluation/benchmark_schema_formatting.py --bird-path data/bird [--top 5]
+                                                     [--questions 200] [--seed 0] [--output-file results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.agents import Selector
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def find_bird_files(bird_path):
+    """Locate the database directory and tables.json of a BIRD checkout."""
+    db_dir = os.path.join(bird_path, "dev_databases")
+    if not os.path.exists(db_dir):
+        db_dir = os.path.join(bird_path, "database")
+    for name in ("dev_tables.json", "tables.json"):
+        tables_json = os.path.join(bird_path, name)
+        if os.path.exists(tables_json):
+            return db_dir, tables_json
+    raise FileNotFoundError(f"No dev_tables.json or tables.json in {bird_path}")
+
+
+def random_decision(rng, desc_dict):
+    """A Selector decision like the LLM returns: keep_all, drop_all or a column list per table."""
+    decision = {}
+    for table_name, columns_desc in desc_dict.items():
+        r = rng.random()
+        if r < 0.4:
+            decision[table_name] = "drop_all"
+        elif r < 0.6:
+            decision[table_name] = "keep_all"
+        else:
+            names = [col_name for col_name, _, _ in columns_desc]
+            decision[table_name] = rng.sample(names, rng.randint(1, len(names)))
+    return decision
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def time_calls(selector, db_id, decisions):
+    """Milliseconds of one _get_db_desc_str call per decision."""
+    times = []
+    # _get_db_desc_str prints progress; keep it out of the measurement output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for decision in decisions:
+            start = time.perf_counter()
+            selector._get_db_desc_str(db_id=db_id, extracted_schema=decision)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-question schema formatting")
+    parser.add_argument("--bird-path", type=str, default=os.getenv("BIRD_PATH", "data/bird"),
+                        help="BIRD directory containing dev_databases/ and dev_tables.json")
+    parser.add_argument("--top", type=int, default=5, help="Number of largest databases to measure")
+    parser.add_argument("--questions", type=int, default=200, help="Formatting calls per database and mode")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random Selector decisions")
+    parser.add_argument("--output-file", type=str, default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    db_dir, tables_json = find_bird_files(args.bird_path)
+    selector = Selector(data_path=db_dir, tables_json_path=tables_json, model_name="benchmark",
+                        dataset_name="bird", lazy=True)
+    db_ids = sorted(selector.db2dbjsons, key=lambda db_id: -selector.db2dbjsons[db_id]['total_column_count'])[:args.top]
+    rng = random.Random(args.seed)
+
+    results = []
+    for db_id in db_ids:
+        # load the profile outside the measurement
+        selector.db2infos[db_id] = selector._load_single_db_info(db_id)
+        desc_dict = selector.db2infos[db_id]['desc_dict']
+        first = time_calls(selector, db_id, [{}])[0]
+        full = time_calls(selector, db_id, [{}] * args.questions)
+        pruned = time_calls(selector, db_id, [random_decision(rng, desc_dict) for _ in range(args.questions)])
+        result = {
+            "db_id": db_id,
+            "tables": len(desc_dict),
+            "columns": selector.db2dbjsons[db_id]['total_column_count'],
+            "first_ms": first,
+            "full_ms": {"mean": sum(full) / len(full), "p50": percentile(full, 0.5), "p95": percentile(full, 0.95)},
+            "pruned_ms": {"mean": sum(pruned) / len(pruned), "p50": percentile(pruned, 0.5), "p95": percentile(pruned, 0.95)},
+        }
+        results.append(result)
+        print(f"{db_id:<28s} tables={result['tables']:<3d} columns={result['columns']:<4d} "
+              f"first={first:7.3f}ms  full p50={result['full_ms']['p50']:.3f}ms p95={result['full_ms']['p95']:.3f}ms  "
+              f"pruned p50={result['pruned_ms']['p50']:.3f}ms p95={result['pruned_ms']['p95']:.3f}ms")
+
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            json.dump({"questions": args.questions, "results": results}, f, indent=2)
+        print(f"Results saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
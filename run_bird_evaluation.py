@@ -130,7 +130,8 @@ def verify_database_structure(bird_path):
     logger.info("Database structure verified successfully")
     return True
 
-def run_evaluation(bird_path, num_samples=10, visualize=False, viz_format="html", output_path=None):
+def run_evaluation(bird_path, num_samples=10, visualize=False, viz_format="html", output_path=None,
+                   cache_dir=None, cache_mode=None):
     """Run the evaluation using test_macsql_agent_bird.py."""
     # Make sure paths are absolute
     abs_bird_path = os.path.abspath(bird_path)
@@ -143,6 +144,12 @@ def run_evaluation(bird_path, num_samples=10, visualize=False, viz_format="html"
     if "BIRD_TABLES_PATH" in os.environ:
         env["BIRD_TABLES_PATH"] = os.environ["BIRD_TABLES_PATH"]
     
+    # Share the LLM response cache with the subprocess
+    if cache_dir:
+        env["LLM_CACHE_DIR"] = os.path.abspath(cache_dir)
+    if cache_mode:
+        env["LLM_CACHE_MODE"] = cache_mode
+    
     env["PYTHONPATH"] = f"{os.getcwd()}:{env.get('PYTHONPATH', '')}"
 
     # For Windows, use a different path separator
@@ -274,6 +281,10 @@ def main():
     parser.add_argument("--visualize", action="store_true", help="Generate agent flow visualization")
     parser.add_argument("--viz-format", type=str, default="html", choices=["html", "json", "mermaid"], 
                         help="Visualization format")
+    parser.add_argument("--cache-dir", type=str, default=os.getenv("LLM_CACHE_DIR"),
+                        help="Directory for the on-disk LLM response cache")
+    parser.add_argument("--cache-mode", type=str, default=None, choices=["readwrite", "replay", "off"],
+                        help="Response cache mode (replay = read-only, fail on miss)")
     args = parser.parse_args()
 
     # Logging setup (can stay here)
@@ -317,7 +328,9 @@ def main():
         num_samples=args.num_samples,
         visualize=args.visualize,
         viz_format=args.viz_format,
-        output_path=output_path
+        output_path=output_path,
+        cache_dir=args.cache_dir,
+        cache_mode=args.cache_mode
     )
     
     if results_path and os.path.exists(results_path):
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Build the value mention indexes (core/value_index.py) of a dataset.
+
+BIRD-UKR databases are read from PostgreSQL (PG_HOST, PG_PORT, PG_USER,
+PG_PASSWORD); BIRD and Spider databases from their SQLite files. The indexes
+are written to VALUE_INDEX_DIR (default ./cache/value_index), one
+<db_id>.vidx file per database.
+
+Usage:
+    python scripts/build_value_index.py --dataset bird-ukr [--tables-json bird-ukr/tables.json]
+    python scripts/build_value_index.py --dataset bird --db-dir data/bird/dev_databases
+    Options: [--db DB_ID ...] [--output-dir DIR] [--max-values-per-column N]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.value_index import (build_value_index, iter_sqlite_values, iter_pg_values, index_path,
+                              DEFAULT_INDEX_DIR, DEFAULT_MAX_VALUES_PER_COLUMN)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def list_databases(args):
+    """Database ids of the dataset, or the ones given with --db."""
+    if args.db:
+        return args.db
+    if args.dataset == "bird-ukr":
+        with open(args.tables_json, "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        # BIRD-UKR keeps a {db_id: schema} mapping, BIRD and Spider a list
+        return sorted(tables) if isinstance(tables, dict) else sorted(t["db_id"] for t in tables)
+    return sorted(name for name in os.listdir(args.db_dir)
+                  if os.path.isfile(os.path.join(args.db_dir, name, f"{name}.sqlite")))
+
+
+def build_one(args, db_id):
+    """Build the index of one database and return its statistics."""
+    path = index_path(db_id, args.output_dir)
+    if args.dataset == "bird-ukr":
+        from core.db_utils import get_db_connection
+        conn, _ = get_db_connection("bird-ukr", db_id)
+        try:
+            return build_value_index(iter_pg_values(conn, max_values_per_column=args.max_values_per_column), path, db_id)
+        finally:
+            conn.close()
+    db_path = os.path.join(args.db_dir, db_id, f"{db_id}.sqlite")
+    return build_value_index(iter_sqlite_values(db_path, max_values_per_column=args.max_values_per_column), path, db_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build value mention indexes for literal linking")
+    parser.add_argument("--dataset", choices=["bird-ukr", "bird", "spider"], default="bird-ukr")
+    parser.add_argument("--tables-json", default=os.path.join("bird-ukr", "tables.json"),
+                        help="tables.json listing the BIRD-UKR databases")
+    parser.add_argument("--db-dir", default=None, help="Directory of <db_id>/<db_id>.sqlite (bird, spider)")
+    parser.add_argument("--db", nargs="*", help="Only these databases")
+    parser.add_argument("--output-dir", default=os.getenv("VALUE_INDEX_DIR", DEFAULT_INDEX_DIR))
+    parser.add_argument("--max-values-per-column", type=int, default=DEFAULT_MAX_VALUES_PER_COLUMN)
+    args = parser.parse_args()
+    if args.dataset != "bird-ukr" and not args.db_dir:
+        parser.error("--db-dir is required for SQLite datasets")
+
+    failed = []
+    for db_id in list_databases(args):
+        start = time.time()
+        try:
+            stats = build_one(args, db_id)
+        except Exception as e:
+            logger.error(f"Failed to index {db_id}: {e}")
+            failed.append(db_id)
+            continue
+        logger.info(f"{db_id}: {stats['values']} values in {stats['columns']} columns, "
+                    f"{stats['trigrams']} trigrams ({time.time() - start:.1f}s)")
+    if failed:
+        logger.error(f"Failed databases: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Check that the PostgreSQL connection pool keeps the server connection count flat.
+
+Runs the database side of the BIRD-UKR pipeline for a number of questions, with
+no LLM calls: PostgreSQLSelector.get_schema, PostgreSQLRefiner._execute_sql on
+the gold SQL, core.db_utils.get_db_connection and pg_connection.execute_query.
+Every --sample-every questions the server-side connection count of this user
+on the BIRD-UKR databases is read from pg_stat_activity. The check fails if it
+ever exceeds one full pool per database seen so far (PG_MAX_CONNECTIONS) or
+the global cap (PG_MAX_TOTAL_CONNECTIONS).
+
+It also fails if the pools keep reconnecting: connections opened beyond one
+full pool per database (or the global cap) count as reconnects, and they may
+not exceed --max-reconnect-rate of the borrows. When the questions touch more
+databases than the global cap holds, evictions cannot be avoided and the
+reconnects are only reported.
+
+Usage:
+    python scripts/check_pool_connections.py [--questions bird-ukr/all_questions.json]
+                                             [--limit 100] [--sample-every 10]
+                                             [--max-reconnect-rate 0.05]
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from core.metrics import get_metrics
+from core.db_utils import get_db_connection
+from core.bird_ukr_extensions import PostgreSQLRefiner
+from utils.pg_selector import PostgreSQLSelector
+from utils.bird_ukr_loader import load_questions
+from utils import pg_connection
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COUNT_CONNECTIONS_SQL = """
+    SELECT count(*)
+    FROM pg_stat_activity
+    WHERE usename = current_user AND datname = ANY (%s) AND pid <> pg_backend_pid()
+"""
+
+
+def count_server_connections(db_ids):
+    """Connections of the current user to the given databases, seen by the server."""
+    conn = psycopg2.connect(
+        dbname="postgres",
+        user=os.environ.get('PG_USER', 'postgres'),
+        password=os.environ.get('PG_PASSWORD', ''),
+        host=os.environ.get('PG_HOST', 'localhost'),
+        port=os.environ.get('PG_PORT', '5432')
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute(COUNT_CONNECTIONS_SQL, (list(db_ids),))
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def opened_connections():
+    """Connections opened by the pools so far (db_pool_connections_total, event=opened)."""
+    return sum(series["value"] for series in get_metrics().snapshot()["counters"].get("db_pool_connections_total", [])
+               if series["labels"].get("event") == "opened")
+
+
+def borrowed_connections():
+    """Connections handed out by the pools so far (db_pool_acquire_seconds observations)."""
+    return sum(series["count"] for series in get_metrics().snapshot()["histograms"].get("db_pool_acquire_seconds", []))
+
+
+def run_question(selector, refiner, question):
+    """The database work of one question."""
+    db_id = question["db_id"]
+    selector.get_schema(db_id)
+    refiner._execute_sql(db_id, question["gold_sql"])
+    conn, _ = get_db_connection("bird-ukr", db_id)
+    conn.close()
+    pg_connection.execute_query(db_id, "SELECT 1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that pooled PostgreSQL connections stay flat")
+    parser.add_argument("--questions", default=os.path.join("bird-ukr", "all_questions.json"))
+    parser.add_argument("--limit", type=int, default=100, help="Questions to run")
+    parser.add_argument("--sample-every", type=int, default=10, help="Questions between connection counts")
+    parser.add_argument("--max-reconnect-rate", type=float, default=0.05,
+                        help="Reconnects allowed per borrowed connection")
+    args = parser.parse_args()
+
+    questions = [q for q in load_questions(args.questions) if q.get("db_id") and q.get("gold_sql")]
+    if not questions:
+        logger.error(f"No questions with db_id and gold_sql in {args.questions}")
+        sys.exit(1)
+    # Cycle through the file if it has fewer questions than requested
+    questions = [questions[i % len(questions)] for i in range(args.limit)]
+    all_db_ids = sorted({q["db_id"] for q in questions})
+
+    selector = PostgreSQLSelector(data_path="bird-ukr", tables_json_path=os.path.join("bird-ukr", "tables.json"),
+                                  model_name="pool-check", dataset_name="bird-ukr")
+    refiner = PostgreSQLRefiner(data_path="bird-ukr", model_name="pool-check", dataset_name="bird-ukr")
+
+    baseline = count_server_connections(all_db_ids)
+    seen = set()
+    failed = False
+    start = time.time()
+    manager = pg_connection.get_pool_manager()
+    print(f"{'questions':>9s} {'databases':>9s} {'server':>6s} {'pooled':>6s} {'limit':>5s} {'opened':>6s}")
+    for i, question in enumerate(questions, 1):
+        seen.add(question["db_id"])
+        run_question(selector, refiner, question)
+        if i % args.sample_every == 0 or i == len(questions):
+            server = count_server_connections(all_db_ids) - baseline
+            limit = min(len(seen) * manager.max_per_db, manager.max_total)
+            pooled = manager.stats()["total"]
+            print(f"{i:9d} {len(seen):9d} {server:6d} {pooled:6d} {limit:5d} {opened_connections():6.0f}")
+            if server > limit:
+                failed = True
+
+    borrows = borrowed_connections()
+    reconnects = max(0, opened_connections() - min(len(all_db_ids) * manager.max_per_db, manager.max_total))
+    pg_connection.close_all_connection_pools()
+    print(f"{len(questions)} questions in {time.time() - start:.1f}s, "
+          f"connections after closing the pools: {count_server_connections(all_db_ids) - baseline}")
+    print(f"{borrows} borrows, {reconnects:.0f} reconnects")
+    if failed:
+        print("FAILED: connection count grew beyond the pool caps")
+        sys.exit(1)
+    if len(all_db_ids) > manager.max_total:
+        print(f"Reconnects not checked: {len(all_db_ids)} databases do not fit in {manager.max_total} connections")
+    elif reconnects > args.max_reconnect_rate * borrows:
+        print(f"FAILED: {reconnects:.0f} reconnects exceed {args.max_reconnect_rate:.0%} of {borrows} borrows")
+        sys.exit(1)
+    print("OK: connection count stayed within the pool caps")
+
+
+if __name__ == "__main__":
+    main()
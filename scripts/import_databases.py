@@ -8,18 +8,21 @@ This script automates the process of creating PostgreSQL databases and importing
 data for each database in the BIRD-UKR benchmark collection.
 
 Usage:
-    python import_databases.py [--convert] [--cleanup] [--check] [--import]
+    python import_databases.py [--convert] [--cleanup] [--check] [--import] [--analyze]
     
 Options:
     --convert  Convert MySQL syntax to PostgreSQL syntax
     --cleanup  Drop existing databases before import
     --check    Check PostgreSQL connection and create databases
     --import   Import schemas (default if no options provided)
+    --analyze  Run ANALYZE after each import, so the Selector can take value
+               examples from the planner statistics
     --help     Show this help message
 
 Examples:
     python import_databases.py --convert --check --import
     python import_databases.py --cleanup --import
+    python import_databases.py --import --analyze
     python import_databases.py  # Just import
 """
 
@@ -44,6 +47,7 @@ def parse_arguments():
     parser.add_argument("--cleanup", action="store_true", help="Drop existing databases before import")
     parser.add_argument("--check", action="store_true", help="Check PostgreSQL connection and create databases")
     parser.add_argument("--import", dest="do_import", action="store_true", help="Import schemas (default if no options provided)")
+    parser.add_argument("--analyze", action="store_true", help="Run ANALYZE after each import")
     args = parser.parse_args()
     
     # If no actions specified, default to import
@@ -340,6 +344,27 @@ def import_with_psycopg2(db_name, schema_file, user, password, host, port):
         print(f"Error importing schema with psycopg2: {str(e)}")
         return False
 
+def analyze_database(db_name, user, password, host, port):
+    """Collect planner statistics for all tables of a database"""
+    try:
+        conn = psycopg2.connect(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=db_name
+        )
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE")
+        cursor.close()
+        conn.close()
+        print(f"Statistics collected for {db_name}")
+        return True
+    except Exception as e:
+        print(f"Error analyzing {db_name}: {str(e)}")
+        return False
+
 def check_postgres_connection(host, port, user, password):
     """Check if PostgreSQL server is running and accessible"""
     try:
@@ -469,6 +494,8 @@ def main():
                     success = import_with_psycopg2(db_name, schema_file, db_user, db_password, db_host, db_port)
                     
                 if success:
+                    if args.analyze:
+                        analyze_database(db_name, db_user, db_password, db_host, db_port)
                     successful_imports += 1
                     print(f"✅ Successfully imported {db_dir}")
                 else:
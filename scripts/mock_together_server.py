@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+"""
+Local Together-compatible mock LLM server for offline load testing.
+
+Speaks the `/v1/chat/completions` schema used by `core.api.together_api_call`
+(plain JSON and `stream: true` server-sent events). Answers come from a chain
+of responders:
+
+1. Recorded traces: `api_trace.json` files (and their rotated `.gz`
+   backups) matched by prompt hash
+2. Pluggable canned responders given as `module:function`, called with
+   `(prompt, request_json)` and returning a response string or None
+3. Optionally the built-in MAC-SQL responder, which returns a well-formed
+   Selector/Decomposer/Refiner answer
+
+Latency, 429s and 5xx errors can be injected to exercise the retry policy,
+rate limiter, hedging and concurrency features.
+
+Usage:
+    python scripts/mock_together_server.py --trace logs/run1/api_trace.json --port 8900
+    export TOGETHER_API_BASE=http://127.0.0.1:8900/v1
+    export TOGETHER_API_KEY=mock
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import importlib
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+Responder = Callable[[str, Dict[str, Any]], Optional[str]]
+
+
+def prompt_hash(prompt: str) -> str:
+    """SHA-256 of the prompt text, as stored in `prompt_sha256` of api_trace.json."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for the `usage` block of generated answers."""
+    return len(text) // 3 + 1
+
+
+class TraceResponder:
+    """
+    Replays responses recorded in api_trace.json files.
+
+    Entries are indexed by `prompt_sha256` when present and by the hash of
+    the stored (stripped) prompt text, so traces from before prompt hashes
+    were logged also match.
+    """
+
+    def __init__(self, trace_paths: List[str]):
+        """
+        Load traces.
+
+        Args:
+            trace_paths: api_trace.json files; rotated `<path>.N.gz` backups are loaded too
+        """
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        for path in trace_paths:
+            for file_path in sorted(glob.glob(f"{path}.*.gz"), reverse=True) + [path]:
+                if os.path.exists(file_path):
+                    self._load(file_path)
+        logger.info(f"Loaded {len(self.entries)} recorded responses")
+
+    def _load(self, path: str) -> None:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                response = entry.get("response")
+                if response is None:
+                    continue
+                record = {
+                    "response": response.strip(),
+                    "prompt_tokens": entry.get("prompt_tokens", entry.get("prompt_token")),
+                    "completion_tokens": entry.get("response_tokens", entry.get("response_token"))
+                }
+                if entry.get("prompt_sha256"):
+                    self.entries[entry["prompt_sha256"]] = record
+                prompt = entry.get("prompt") or entry.get("input_prompt")
+                if prompt:
+                    self.entries[prompt_hash(prompt.strip())] = record
+
+    def lookup(self, prompt: str) -> Optional[Dict[str, Any]]:
+        """Find the recorded response of a prompt."""
+        return self.entries.get(prompt_hash(prompt)) or self.entries.get(prompt_hash(prompt.strip()))
+
+    def __call__(self, prompt: str, request: Dict[str, Any]) -> Optional[str]:
+        record = self.lookup(prompt)
+        return record["response"] if record else None
+
+
+def macsql_responder(prompt: str, request: Dict[str, Any]) -> Optional[str]:
+    """
+    Canned answers in the formats the MAC-SQL agents parse.
+
+    Selector prompts get a keep-all JSON block, Decomposer prompts a
+    one-step decomposition ending in "Question Solved.", everything else a
+    single SQL block.
+    """
+    if "keep_all" in prompt and "drop_all" in prompt:
+        return "```json\n{}\n```\nQuestion Solved."
+    if "Decompose the question" in prompt:
+        return ("Sub question 1: Answer the question.\nSQL\n```sql\nSELECT 1\n```\n\n"
+                "Question Solved.")
+    return "```sql\nSELECT 1\n```"
+
+
+def load_responder(spec: str) -> Responder:
+    """
+    Import a canned responder.
+
+    Args:
+        spec: "module:function", e.g. "my_responders:always_sql"
+
+    Returns:
+        The responder callable
+    """
+    module_name, _, func_name = spec.partition(":")
+    if not func_name:
+        raise ValueError(f"Responder must be given as module:function, got {spec}")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class MockTogetherServer:
+    """
+    Threaded HTTP server implementing the chat completions endpoint.
+
+    Can be used from benchmarks as a context manager:
+
+        with MockTogetherServer([macsql_responder], latency=0.5) as server:
+            os.environ["TOGETHER_API_BASE"] = server.api_base
+    """
+
+    def __init__(self, responders: List[Responder], host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, latency_jitter: float = 0.0, token_latency: float = 0.0,
+                 error_429_rate: float = 0.0, error_5xx_rate: float = 0.0, retry_after: float = 1.0,
+                 seed: Optional[int] = None):
+        """
+        Initialize the server.
+
+        Args:
+            responders: Responders tried in order for each prompt
+            host: Interface to bind
+            port: Port to bind (0 picks a free port)
+            latency: Seconds to wait before answering
+            latency_jitter: Extra uniform random delay in seconds
+            token_latency: Seconds between streamed chunks
+            error_429_rate: Probability of answering 429 with Retry-After
+            error_5xx_rate: Probability of answering 500/502/503
+            retry_after: Retry-After value sent with 429 and 503 responses
+            seed: Random seed for reproducible fault injection
+        """
+        self.responders = responders
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.token_latency = token_latency
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "misses": 0, "errors_429": 0, "errors_5xx": 0,
+                      "in_flight": 0, "max_in_flight": 0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        """Value for TOGETHER_API_BASE."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += delta
+            if key == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def _draw(self) -> Tuple[float, float, int]:
+        """
+        Draw the random values of one request under the lock, since handler
+        threads share the seeded generator.
+
+        Returns:
+            Tuple of (latency jitter in seconds, fault draw in [0, 1), 5xx status)
+        """
+        with self._lock:
+            return (self._random.uniform(0, self.latency_jitter), self._random.random(),
+                    self._random.choice([500, 502, 503]))
+
+    def answer(self, prompt: str, request: Dict[str, Any]) -> Optional[str]:
+        """Run the responder chain."""
+        for responder in self.responders:
+            response = responder(prompt, request)
+            if response is not None:
+                return response
+        return None
+
+    def usage(self, prompt: str, text: str) -> Dict[str, int]:
+        """Token usage of an answer, taken from the recorded trace when available."""
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(text)}
+        for responder in self.responders:
+            record = responder.lookup(prompt) if isinstance(responder, TraceResponder) else None
+            if record and record["response"] == text:
+                usage["prompt_tokens"] = record["prompt_tokens"] or usage["prompt_tokens"]
+                usage["completion_tokens"] = record["completion_tokens"] or usage["completion_tokens"]
+                break
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return usage
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    with server._lock:
+                        stats = dict(server.stats)
+                    self._send_json(200, stats)
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid JSON body"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+                    return
+
+                server._count("requests")
+                server._count("in_flight")
+                try:
+                    self._complete(request)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client closed the connection (e.g. a stream stopped early or a hedge lost)
+                    pass
+                finally:
+                    server._count("in_flight", -1)
+
+            def _complete(self, request: Dict[str, Any]):
+                jitter, draw, error_status = server._draw()
+                delay = server.latency + jitter
+                if delay > 0:
+                    time.sleep(delay)
+
+                if draw < server.error_429_rate:
+                    server._count("errors_429")
+                    self._send_json(429, {"error": {"message": "rate limit exceeded (mock)"}},
+                                    {"Retry-After": str(server.retry_after)})
+                    return
+                if draw < server.error_429_rate + server.error_5xx_rate:
+                    server._count("errors_5xx")
+                    status = error_status
+                    headers = {"Retry-After": str(server.retry_after)} if status == 503 else None
+                    self._send_json(status, {"error": {"message": "server error (mock)"}}, headers)
+                    return
+
+                messages = request.get("messages") or []
+                prompt = messages[-1].get("content", "") if messages else ""
+                text = server.answer(prompt, request)
+                if text is None:
+                    server._count("misses")
+                    self._send_json(404, {"error": {"message": f"no recorded response for prompt "
+                                                               f"{prompt_hash(prompt)[:16]}..."}})
+                    return
+
+                server._count("ok")
+                usage = server.usage(prompt, text)
+                completion_id = f"mock-{prompt_hash(prompt)[:12]}"
+                model = request.get("model", "mock")
+
+                if request.get("stream"):
+                    self._stream(completion_id, model, text, usage)
+                    return
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": usage
+                })
+
+            def _stream(self, completion_id: str, model: str, text: str, usage: Dict[str, int]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                def event(payload):
+                    self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                chunk_size = 8
+                for i in range(0, len(text), chunk_size):
+                    event(json.dumps({
+                        "id": completion_id, "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {"content": text[i:i + chunk_size]}}]
+                    }, ensure_ascii=False))
+                    if server.token_latency > 0:
+                        time.sleep(server.token_latency)
+                event(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                                  "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                  "usage": usage}))
+                event("[DONE]")
+                self.close_connection = True
+
+        return Handler
+
+    def start(self) -> "MockTogetherServer":
+        """Serve from a daemon thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-together", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock Together API listening on {self.api_base}")
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Local Together-compatible mock LLM server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8900, help="Port to listen on")
+    parser.add_argument("--trace", type=str, action="append", default=[],
+                        help="api_trace.json to replay (repeatable)")
+    parser.add_argument("--responder", type=str, action="append", default=[],
+                        help="Canned responder as module:function, tried after the traces (repeatable)")
+    parser.add_argument("--canned", action="store_true",
+                        help="Answer unmatched prompts with the built-in MAC-SQL responder")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each answer")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Extra random delay in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Probability of a 5xx response")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429/503")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for fault injection")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_arguments()
+
+    # Make repo-root modules importable as responders
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    responders: List[Responder] = []
+    if args.trace:
+        responders.append(TraceResponder(args.trace))
+    responders.extend(load_responder(spec) for spec in args.responder)
+    if args.canned or not responders:
+        responders.append(macsql_responder)
+
+    server = MockTogetherServer(
+        responders, host=args.host, port=args.port,
+        latency=args.latency, latency_jitter=args.latency_jitter, token_latency=args.token_latency,
+        error_429_rate=args.rate_429, error_5xx_rate=args.rate_5xx, retry_after=args.retry_after,
+        seed=args.seed
+    )
+    print(f"Mock Together API listening on {server.api_base}")
+    print(f"  export TOGETHER_API_BASE={server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -638,8 +638,16 @@ def parse_arguments():
     
     parser.add_argument("--model", type=str, default=os.environ.get("MODEL_NAME", "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo"),
                         help="Model name to use")
-    parser.add_argument("--cache-dir", type=str, default=None,
+    parser.add_argument("--cache-dir", type=str, default=os.environ.get("LLM_CACHE_DIR"),
                         help="Directory to cache API responses")
+    parser.add_argument("--cache-mode", type=str, default=os.environ.get("LLM_CACHE_MODE", "readwrite"),
+                        choices=["readwrite", "replay", "off"],
+                        help="Response cache mode: readwrite, replay (read-only, fail on miss) or off")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this local port during the run (0 disables)")
+    parser.add_argument("--metrics-json", type=str, default=None,
+                        help="Path of the metrics snapshot written at the end of the run "
+                             "(default: next to --output)")
     
     parser.add_argument("--output", type=str, default=None,
                         help="Path to save results JSON")
@@ -682,6 +690,17 @@ def main():
     
     configure_debug()
     
+    # Serve repeated prompts from the on-disk response cache
+    from core.llm_cache import init_cache
+    from core.log_sink import close_log_sink
+    llm_cache = init_cache(cache_dir=args.cache_dir, mode=args.cache_mode)
+    
+    from core.metrics import start_metrics_server, dump_metrics
+    start_metrics_server(args.metrics_port)
+    metrics_json = args.metrics_json
+    if not metrics_json and args.output:
+        metrics_json = os.path.splitext(args.output)[0] + "_metrics.json"
+    
     agent = get_agent(
         data_path=args.data_path,
         model_name=args.model,
@@ -709,15 +728,23 @@ def main():
         logger.info(f"Execution accuracy: {execution_accuracy:.4f}")
         logger.info(f"Average gold SQL time: {avg_gold_time:.4f}s")
         logger.info(f"Average pred SQL time: {avg_pred_time:.4f}s")
+        if llm_cache.enabled:
+            cache_stats = llm_cache.stats()
+            logger.info(f"LLM cache ({cache_stats['mode']}): {cache_stats['hits']} hits, "
+                        f"{cache_stats['misses']} misses, hit rate {cache_stats['hit_rate']:.2%}")
         logger.info("=" * 50)
         
         if args.output:
             save_results(results, args, execution_accuracy, avg_gold_time, avg_pred_time)
+        if metrics_json:
+            dump_metrics(metrics_json)
             
     except Exception as e:
         logger.error(f"Error during testing: {e}", exc_info=True)
     finally:
         close_all_pools()
+        # Make sure log.txt / api_trace.json are complete before the process exits
+        close_log_sink()
 
 def compare_results(gold_results, pred_results):
     """
@@ -2,17 +2,58 @@
 """
 PostgreSQL connection utilities for BIRD-UKR dataset.
 Provides connection pooling and query execution for PostgreSQL databases.
+
+All PostgreSQL access of the pipeline (Selector, Refiner, evaluation, db_utils)
+borrows connections from one pool per database, kept by a process-wide
+PoolManager. Pools are created on first use and open connections lazily, up
+to a cap per database and a cap over all databases; at the global cap, a
+borrower first waits briefly for a connection of its own database to come
+back, and only then closes an idle connection of the least recently used
+pools to make room. A
+borrowed connection is a PooledConnection: it behaves like the psycopg2
+connection, and close() hands it back instead of closing it. Connections idle
+for a while are checked with SELECT 1 before reuse; broken connections and
+connections past their maximum lifetime are closed and reopened on demand.
+Pending transactions are rolled back when a connection comes back.
+
+Session settings (statement_timeout, read-only transactions, search_path)
+travel in the libpq startup packet (options=-c ...), and application_name
+names the run and the borrowing agent, so opening a connection needs no SET
+round trips. A borrower that wants other settings gets an idle connection
+that already has them if there is one, otherwise the difference is applied
+with one set_config statement. The settings then stay on the connection for
+later borrowers.
+
+Configuration (environment variables):
+    PG_USER, PG_PASSWORD, PG_HOST, PG_PORT: Server credentials
+    PG_MAX_CONNECTIONS: Connections per database pool (default 5)
+    PG_MAX_TOTAL_CONNECTIONS: Connections over all pools of the process (default 20)
+    PG_POOL_MAX_LIFETIME: Seconds before a connection is closed and replaced
+        (default 1800, 0 for no limit)
+    PG_POOL_HEALTH_CHECK_IDLE: Seconds a connection may sit idle before it is
+        checked on borrow (default 30, 0 checks every borrow)
+    PG_POOL_EVICT_WAIT: Seconds a borrower at the global cap waits for a connection
+        of its own database before evicting another pool's (default 0.05)
+    PG_STATEMENT_TIMEOUT: Session statement timeout in milliseconds (default 30000)
+    PG_READ_ONLY: Set to 1 to make sessions default to read-only transactions (default off)
+    PG_SEARCH_PATH: Session search_path (default: the server's)
+    PG_APPLICATION_NAME: Prefix of application_name (default "mac-sql")
+    PG_RUN_ID: Run id in application_name (default: start time and process id)
 """
 
 import os
 import time
 import logging
+import threading
 import psycopg2
-from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 from typing import Dict, List, Tuple, Any, Optional, Union
+from collections import OrderedDict
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from queue import Queue
+
+from core.metrics import get_metrics
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -26,72 +67,597 @@ PG_PASSWORD = os.environ.get('PG_PASSWORD', '')
 PG_HOST = os.environ.get('PG_HOST', 'localhost')
 PG_PORT = os.environ.get('PG_PORT', '5432')
 
-# Global connection pools
-_connection_pools = {}
+DEFAULT_POOL_SIZE = int(os.environ.get('PG_MAX_CONNECTIONS', '5'))
+MAX_TOTAL_CONNECTIONS = int(os.environ.get('PG_MAX_TOTAL_CONNECTIONS', '20'))
+MAX_LIFETIME_SECONDS = float(os.environ.get('PG_POOL_MAX_LIFETIME', '1800'))
+HEALTH_CHECK_IDLE_SECONDS = float(os.environ.get('PG_POOL_HEALTH_CHECK_IDLE', '30'))
+# Statement timeout of pooled sessions (milliseconds)
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.environ.get('PG_STATEMENT_TIMEOUT', '30000'))
+READ_ONLY = os.environ.get('PG_READ_ONLY', '0').lower() in ('1', 'true', 'yes', 'on')
+SEARCH_PATH = os.environ.get('PG_SEARCH_PATH', '')
+APPLICATION_NAME = os.environ.get('PG_APPLICATION_NAME', 'mac-sql')
+RUN_ID = os.environ.get('PG_RUN_ID') or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+# Longest application_name the server keeps (NAMEDATALEN - 1)
+MAX_APPLICATION_NAME = 63
+EVICT_WAIT_SECONDS = float(os.environ.get('PG_POOL_EVICT_WAIT', '0.05'))
+# Seconds to wait for a free connection
+ACQUIRE_TIMEOUT = 5.0
+
 
-def init_connection_pool(db_name: str, pool_size: int = 5) -> None:
+def session_settings(agent: Optional[str] = None, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
     """
-    Initialize a connection pool for a database.
+    Session settings a borrower expects, as strings for set_config.
     
     Args:
-        db_name: Database name
-        pool_size: Number of connections in the pool
-    """
-    if db_name in _connection_pools:
-        logger.warning(f"Connection pool for {db_name} already exists")
-        return
-    
-    # Get PostgreSQL credentials from environment
-    pg_user = os.environ.get('PG_USER', 'postgres')
-    pg_password = os.environ.get('PG_PASSWORD', '')
-    pg_host = os.environ.get('PG_HOST', 'localhost')
-    pg_port = os.environ.get('PG_PORT', '5432')
-    
-    # Create a pool of connections
-    pool = Queue(pool_size)
-    
-    # Initialize connections
-    for _ in range(pool_size):
-        try:
-            conn = psycopg2.connect(
-                dbname=db_name,
-                user=pg_user,
-                password=pg_password,
-                host=pg_host,
-                port=pg_port
-            )
-            # Set timeout to avoid long-running queries
-            cursor = conn.cursor()
-            cursor.execute("SET statement_timeout = 30000")  # 30 seconds
-            conn.commit()
+        agent: Borrowing agent, tagged in application_name
+        overrides: Settings that differ from the defaults, e.g. {"statement_timeout": 5000}
+        
+    Returns:
+        Setting name -> value
+    """
+    settings = {"statement_timeout": str(DEFAULT_STATEMENT_TIMEOUT_MS)}
+    if READ_ONLY:
+        settings["default_transaction_read_only"] = "on"
+    if SEARCH_PATH:
+        settings["search_path"] = SEARCH_PATH
+    for name, value in (overrides or {}).items():
+        settings[name] = str(value)
+    name = ":".join(part for part in (APPLICATION_NAME, RUN_ID, agent) if part)
+    settings["application_name"] = name[:MAX_APPLICATION_NAME]
+    return settings
+
+def _libpq_options(settings: Dict[str, str]) -> str:
+    """The libpq options string (-c name=value ...) for settings other than application_name."""
+    def escape(value):
+        # libpq splits options on spaces; backslash escapes them
+        return value.replace("\\", "\\\\").replace(" ", "\\ ")
+    return " ".join(f"-c {name}={escape(value)}" for name, value in settings.items() if name != "application_name")
+
+def _apply_settings(conn: Any, changes: Dict[str, str], db_name: str) -> None:
+    """
+    Change session settings outside of any transaction, in one round trip.
+    
+    Args:
+        conn: psycopg2 connection with no transaction in progress
+        changes: Setting name -> value
+        db_name: Database name, for metrics
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT " + ", ".join(["set_config(%s, %s, false)"] * len(changes)),
+                       [item for change in changes.items() for item in change])
+        cursor.close()
+    finally:
+        conn.autocommit = autocommit
+    get_metrics().inc("db_pool_session_sets_total", db_id=db_name)
+
+
+class PooledConnection:
+    """
+    A psycopg2 connection borrowed from a ConnectionPool.
+    
+    Attribute access is forwarded to the connection, so it can be used
+    wherever a psycopg2 connection is expected. close() returns it to its pool.
+    """
+    
+    def __init__(self, pool: "ConnectionPool", connection: Any, created_at: float, settings: Dict[str, str]):
+        self._pool = pool
+        self._connection = connection
+        self.db_name = pool.db_name
+        self.created_at = created_at
+        self.borrowed_at = time.time()
+        # Session settings of the connection, kept with it in the pool
+        self.settings = settings
+        # A setting was changed inside a transaction, which may be rolled back
+        self.settings_uncertain = False
+        # Close instead of reusing when returned
+        self.invalid = False
+    
+    @property
+    def raw(self) -> Any:
+        """The underlying psycopg2 connection."""
+        return self._connection
+    
+    def __getattr__(self, name: str) -> Any:
+        if self._connection is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._connection, name)
+    
+    def set_session(self, name: str, value: Any) -> None:
+        """
+        Change a session setting, skipping the round trip if it already has the value.
+        
+        Args:
+            name: Setting name, e.g. statement_timeout
+            value: New value
+        """
+        value = str(value)
+        if self.settings.get(name) == value:
+            return
+        if self._connection.get_transaction_status() == TRANSACTION_STATUS_IDLE:
+            _apply_settings(self._connection, {name: value}, self.db_name)
+        else:
+            # Takes effect now; whether it survives depends on how the transaction ends
+            cursor = self._connection.cursor()
+            cursor.execute("SELECT set_config(%s, %s, false)", (name, value))
             cursor.close()
+            self.settings_uncertain = True
+        self.settings[name] = value
+    
+    def set_statement_timeout(self, timeout_ms: int) -> None:
+        """
+        Set the session statement timeout, skipping the round trip if unchanged.
+        
+        Args:
+            timeout_ms: Timeout in milliseconds
+        """
+        self.set_session("statement_timeout", int(timeout_ms))
+    
+    def invalidate(self) -> None:
+        """Have the pool close this connection instead of reusing it."""
+        self.invalid = True
+    
+    def close(self) -> None:
+        """Return the connection to its pool (repeated calls are ignored)."""
+        if self._connection is not None:
+            self._pool.release(self)
+            self._connection = None
+
+
+class ConnectionPool:
+    """
+    Connections to one PostgreSQL database, opened on demand up to max_size.
+    
+    Pools belong to a PoolManager; its lock guards their state.
+    """
+    
+    def __init__(self, manager: "PoolManager", db_name: str, max_size: int):
+        self.manager = manager
+        self.db_name = db_name
+        self.max_size = max_size
+        # (connection, opened at, returned at, session settings), most recently returned last
+        self.idle: List[Tuple[Any, float, float, Dict[str, str]]] = []
+        # Open connections, idle or borrowed
+        self.size = 0
+        self.closed = False
+    
+    def connect(self, settings: Dict[str, str]) -> Any:
+        """
+        Open a connection whose session starts with the given settings.
+        
+        Args:
+            settings: Result of session_settings
+            
+        Returns:
+            psycopg2 connection
+        """
+        conn = psycopg2.connect(
+            dbname=self.db_name,
+            user=os.environ.get('PG_USER', 'postgres'),
+            password=os.environ.get('PG_PASSWORD', ''),
+            host=os.environ.get('PG_HOST', 'localhost'),
+            port=os.environ.get('PG_PORT', '5432'),
+            application_name=settings["application_name"],
+            options=_libpq_options(settings)
+        )
+        get_metrics().inc("db_pool_connections_total", event="opened", db_id=self.db_name)
+        return conn
+    
+    @property
+    def borrowed(self) -> int:
+        """Connections currently lent out."""
+        return self.size - len(self.idle)
+    
+    def acquire(self, timeout: float = ACQUIRE_TIMEOUT, agent: Optional[str] = None,
+                settings: Optional[Dict[str, Any]] = None) -> PooledConnection:
+        """
+        Borrow a connection to this pool's database.
+        
+        Args:
+            timeout: Seconds to wait for a free connection
+            agent: Borrowing agent, tagged in application_name
+            settings: Session settings that differ from the defaults
+            
+        Returns:
+            PooledConnection; close() it to give it back
             
-            # Add to pool
-            pool.put(conn)
-        except Exception as e:
-            logger.error(f"Error creating connection for {db_name}: {e}")
+        Raises:
+            ConnectionError: If no connection is free in time or one cannot be opened
+        """
+        return self.manager.acquire(self.db_name, timeout, agent, settings)
+    
+    def release(self, pooled: PooledConnection) -> None:
+        """Take back a borrowed connection."""
+        self.manager.release(self, pooled)
+    
+    def close(self) -> int:
+        """
+        Close the idle connections; borrowed ones are closed when returned.
+        
+        Returns:
+            Number of connections closed
+        """
+        return self.manager.close_pool(self.db_name, pool=self)
+
+
+class PoolManager:
+    """
+    Thread-safe registry of the per-database connection pools.
+    
+    Pools are created on first use and open connections only when no idle
+    one is left, up to max_per_db per database and max_total over all
+    databases. When max_total is reached, a borrower whose pool has
+    connections out waits up to evict_wait for one of them to come back;
+    after that, idle connections of the least recently used pools are
+    closed to make room, and a pool left without
+    connections is dropped. Connections older than max_lifetime, broken
+    ones and ones that fail the rollback on return are closed instead of
+    being reused.
+    """
+    
+    def __init__(self, max_per_db: int = DEFAULT_POOL_SIZE, max_total: int = MAX_TOTAL_CONNECTIONS,
+                 max_lifetime: float = MAX_LIFETIME_SECONDS, evict_wait: float = EVICT_WAIT_SECONDS):
+        """
+        Initialize the manager.
+        
+        Args:
+            max_per_db: Connection cap of each database pool
+            max_total: Connection cap over all pools
+            max_lifetime: Seconds after which a connection is closed when it comes back (0 for no limit)
+            evict_wait: Seconds to wait for the pool's own connections before evicting at max_total
+        """
+        self.max_per_db = max_per_db
+        self.max_total = max(1, max_total)
+        self.max_lifetime = max_lifetime
+        self.evict_wait = evict_wait
+        # db_name -> pool, least recently used first
+        self._pools: "OrderedDict[str, ConnectionPool]" = OrderedDict()
+        self.total = 0
+        self._cond = threading.Condition(threading.Lock())
+    
+    def get_pool(self, db_name: str, max_size: Optional[int] = None) -> ConnectionPool:
+        """
+        Get the pool of a database, creating it on first use.
+        
+        Args:
+            db_name: Database name
+            max_size: Connection cap of this pool (default max_per_db)
+            
+        Returns:
+            ConnectionPool
+        """
+        with self._cond:
+            pool = self._get_pool(db_name)
+            if max_size is not None:
+                pool.max_size = max_size
+            return pool
+    
+    def _get_pool(self, db_name: str) -> ConnectionPool:
+        # Caller holds the lock
+        pool = self._pools.get(db_name)
+        if pool is None:
+            pool = ConnectionPool(self, db_name, self.max_per_db)
+            self._pools[db_name] = pool
+            logger.info(f"Created connection pool for database: {db_name}")
+        else:
+            self._pools.move_to_end(db_name)
+        return pool
+    
+    def _evict_idle(self, keep: ConnectionPool) -> Optional[Any]:
+        """Take the oldest idle connection of the least recently used other pool (caller holds the lock)."""
+        for db_name, pool in self._pools.items():
+            if pool is keep or not pool.idle:
+                continue
+            conn = pool.idle.pop(0)[0]
+            pool.size -= 1
+            self.total -= 1
+            if pool.size == 0:
+                del self._pools[db_name]
+                pool.closed = True
+            get_metrics().inc("db_pool_connections_total", event="evicted", db_id=db_name)
+            return conn
+        return None
+    
+    def _forget(self, pool: ConnectionPool) -> None:
+        """Drop a closed connection from the counts (caller holds the lock)."""
+        pool.size -= 1
+        self.total -= 1
+        self._cond.notify_all()
     
-    # Store the pool
-    _connection_pools[db_name] = pool
-    logger.info(f"Created connection pool for database: {db_name}")
+    def _expired(self, created_at: float) -> bool:
+        return self.max_lifetime > 0 and time.time() - created_at > self.max_lifetime
+    
+    def acquire(self, db_name: str, timeout: float = ACQUIRE_TIMEOUT, agent: Optional[str] = None,
+                settings: Optional[Dict[str, Any]] = None) -> PooledConnection:
+        """
+        Borrow a connection, reusing an idle one or opening a new one.
+        
+        An idle connection whose session already has the wanted settings is
+        preferred. Without one, a new connection is opened with them if that
+        needs no eviction; otherwise the most recently returned idle
+        connection is changed with one set_config statement.
+        
+        Args:
+            db_name: Database name
+            timeout: Seconds to wait for a free connection
+            agent: Borrowing agent, tagged in application_name
+            settings: Session settings that differ from the defaults
+            
+        Returns:
+            PooledConnection; close() it to give it back
+            
+        Raises:
+            ConnectionError: If no connection is free in time or one cannot be opened
+        """
+        start = time.time()
+        wanted = session_settings(agent, settings)
+        deadline = time.monotonic() + timeout
+        # Until then, a pool with borrowed connections waits for one instead of evicting at max_total
+        evict_after = time.monotonic() + min(self.evict_wait, timeout)
+        while True:
+            evicted = None
+            with self._cond:
+                while True:
+                    pool = self._get_pool(db_name)
+                    if pool.idle:
+                        # Fewest settings to change, most recently returned first
+                        differences = [sum(entry[3].get(name) != value for name, value in wanted.items())
+                                       for entry in pool.idle]
+                        best = min(reversed(range(len(differences))), key=differences.__getitem__)
+                        if differences[best] == 0 or pool.size >= pool.max_size or self.total >= self.max_total:
+                            conn, created_at, idle_since, current = pool.idle.pop(best)
+                            break
+                    wait_until = deadline
+                    if pool.size < pool.max_size:
+                        if self.total >= self.max_total and evicted is None:
+                            if pool.size > 0 and time.monotonic() < evict_after:
+                                wait_until = evict_after
+                            else:
+                                evicted = self._evict_idle(keep=pool)
+                        if self.total < self.max_total:
+                            # Reserve the slot; the connection is opened outside the lock
+                            pool.size += 1
+                            self.total += 1
+                            conn, created_at, idle_since, current = None, time.time(), None, wanted
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        get_metrics().inc("db_pool_acquire_timeouts_total", db_id=db_name)
+                        raise ConnectionError(f"No free connection to {db_name} after {timeout}s "
+                                              f"({pool.size}/{pool.max_size} for the database, "
+                                              f"{self.total}/{self.max_total} in total)")
+                    self._cond.wait(wait_until - time.monotonic())
+            if evicted is not None:
+                _close_quietly(evicted)
+            
+            if conn is None:
+                try:
+                    conn = pool.connect(wanted)
+                except Exception as e:
+                    with self._cond:
+                        self._forget(pool)
+                    raise ConnectionError(f"Failed to connect to {db_name}: {e}")
+            elif self._expired(created_at) or not _healthy(conn, idle_since, db_name):
+                event = "expired" if self._expired(created_at) and not conn.closed else "broken"
+                get_metrics().inc("db_pool_connections_total", event=event, db_id=db_name)
+                _close_quietly(conn)
+                with self._cond:
+                    self._forget(pool)
+                continue
+            
+            changes = {name: value for name, value in wanted.items() if current.get(name) != value}
+            if changes:
+                try:
+                    _apply_settings(conn, changes, db_name)
+                except Exception as e:
+                    logger.warning(f"Discarding connection to {db_name}, session settings failed: {e}")
+                    get_metrics().inc("db_pool_connections_total", event="broken", db_id=db_name)
+                    _close_quietly(conn)
+                    with self._cond:
+                        self._forget(pool)
+                    continue
+            
+            get_metrics().observe("db_pool_acquire_seconds", time.time() - start, db_id=db_name)
+            return PooledConnection(pool, conn, created_at, dict(wanted))
+    
+    def release(self, pool: ConnectionPool, pooled: PooledConnection) -> None:
+        """
+        Take back a borrowed connection: roll it back, or close it if it is
+        broken, too old or its pool was closed. Session settings changed by
+        the borrower stay on the connection.
+        
+        Args:
+            pool: Pool the connection was borrowed from
+            pooled: Connection from acquire
+        """
+        conn = pooled.raw
+        get_metrics().observe("db_pool_checkout_seconds", time.time() - pooled.borrowed_at, db_id=pool.db_name)
+        keep = not (pool.closed or pooled.invalid or conn.closed)
+        if keep and self._expired(pooled.created_at):
+            get_metrics().inc("db_pool_connections_total", event="expired", db_id=pool.db_name)
+            keep = False
+        
+        # Reset the connection before returning it
+        if keep:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()  # Rollback any pending transaction
+                if pooled.settings_uncertain:
+                    # A rollback may have undone settings changed inside the transaction
+                    _apply_settings(conn, pooled.settings, pool.db_name)
+            except Exception as e:
+                logger.error(f"Error returning connection to pool for {pool.db_name}: {e}")
+                keep = False
+        elif conn.closed and not pool.closed:
+            get_metrics().inc("db_pool_connections_total", event="broken", db_id=pool.db_name)
+        if not keep:
+            _close_quietly(conn)
+        
+        with self._cond:
+            if keep:
+                pool.idle.append((conn, pooled.created_at, time.time(), pooled.settings))
+                self._cond.notify_all()
+            else:
+                self._forget(pool)
+    
+    def close_pool(self, db_name: str, pool: Optional[ConnectionPool] = None) -> int:
+        """
+        Remove a pool and close its idle connections; borrowed ones are closed when returned.
+        
+        Args:
+            db_name: Database name
+            pool: Only close if this is still the registered pool
+            
+        Returns:
+            Number of connections closed
+        """
+        with self._cond:
+            registered = self._pools.get(db_name)
+            if registered is None or (pool is not None and registered is not pool):
+                return 0
+            del self._pools[db_name]
+            registered.closed = True
+            idle, registered.idle = registered.idle, []
+            registered.size -= len(idle)
+            self.total -= len(idle)
+            self._cond.notify_all()
+        for conn, *_ in idle:
+            _close_quietly(conn)
+        get_metrics().inc("db_pool_connections_total", len(idle), event="closed", db_id=db_name)
+        logger.info(f"Closed connection pool for {db_name}")
+        return len(idle)
+    
+    def close_all(self) -> None:
+        """Close every pool."""
+        with self._cond:
+            db_names = list(self._pools)
+        for db_name in db_names:
+            self.close_pool(db_name)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Connection counts overall and per database."""
+        with self._cond:
+            return {
+                "total": self.total,
+                "max_total": self.max_total,
+                "pools": {db_name: {"size": p.size, "idle": len(p.idle), "borrowed": p.borrowed, "max_size": p.max_size}
+                          for db_name, p in self._pools.items()}
+            }
 
-def get_pool_connection(db_name: str) -> Optional[Any]:
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _healthy(conn: Any, idle_since: float, db_name: str) -> bool:
+    """Whether an idle connection can be handed out; long-idle ones are checked with SELECT 1."""
+    if conn.closed:
+        return False
+    if time.time() - idle_since < HEALTH_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        conn.rollback()
+        return True
+    except Exception as e:
+        logger.warning(f"Discarding broken connection to {db_name}: {e}")
+        return False
+
+
+# Process-wide pool manager
+_pool_manager = None
+_pool_manager_lock = threading.Lock()
+
+def get_pool_manager() -> PoolManager:
+    """Get the process-wide pool manager, created on first use."""
+    global _pool_manager
+    if _pool_manager is None:
+        with _pool_manager_lock:
+            if _pool_manager is None:
+                _pool_manager = PoolManager()
+    return _pool_manager
+
+def set_pool_manager(manager: PoolManager) -> None:
     """
-    Get a connection from the pool.
+    Replace the process-wide pool manager, closing the previous one's pools.
+    
+    Args:
+        manager: The manager to use
+    """
+    global _pool_manager
+    with _pool_manager_lock:
+        old_manager, _pool_manager = _pool_manager, manager
+    if old_manager is not None and old_manager is not manager:
+        old_manager.close_all()
+
+def init_connection_pool(db_name: str, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+    """
+    Initialize a connection pool for a database.
+    
+    Connections are opened on demand; this only registers the pool and its size.
+    
+    Args:
+        db_name: Database name
+        pool_size: Maximum number of connections in the pool
+    """
+    get_pool_manager().get_pool(db_name, pool_size)
+
+def get_connection_pool(db_name: str) -> ConnectionPool:
+    """
+    Get the pool of a database, creating it on first use.
     
     Args:
         db_name: Database name
         
     Returns:
-        Database connection or None if no pool exists
+        ConnectionPool
     """
-    if db_name not in _connection_pools:
-        logger.warning(f"No connection pool for {db_name}")
-        return None
+    return get_pool_manager().get_pool(db_name)
+
+@contextmanager
+def connection(db_name: str, timeout: float = ACQUIRE_TIMEOUT, agent: Optional[str] = None, **settings):
+    """
+    Borrow a pooled connection for the duration of a with block.
     
+    Args:
+        db_name: Database name
+        timeout: Seconds to wait for a free connection
+        agent: Borrowing agent, tagged in application_name
+        **settings: Session settings that differ from the defaults, e.g. statement_timeout=5000
+        
+    Yields:
+        PooledConnection
+        
+    Raises:
+        ConnectionError: If no connection can be borrowed
+    """
+    conn = get_pool_manager().acquire(db_name, timeout, agent, settings)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_pool_connection(db_name: str) -> Optional[Any]:
+    """
+    Get a connection from the pool, creating the pool on first use.
+    
+    Args:
+        db_name: Database name
+        
+    Returns:
+        Database connection or None if none could be borrowed
+    """
     # Wait up to 5 seconds for a connection
     try:
-        return _connection_pools[db_name].get(timeout=5)
+        return get_pool_manager().acquire(db_name)
     except Exception as e:
         logger.error(f"Error getting connection from pool for {db_name}: {e}")
         return None
@@ -104,28 +670,9 @@ def return_connection(db_name: str, connection: Any) -> None:
         db_name: Database name
         connection: Connection to return
     """
-    if db_name not in _connection_pools:
-        logger.warning(f"No connection pool for {db_name}")
-        return
-    
-    # Reset the connection before returning it
-    try:
-        connection.rollback()  # Rollback any pending transaction
-        cursor = connection.cursor()
-        cursor.execute("SET statement_timeout = 30000")  # Reset timeout
-        connection.commit()
-        cursor.close()
-        
-        # Return to pool
-        _connection_pools[db_name].put(connection)
-    except Exception as e:
-        logger.error(f"Error returning connection to pool for {db_name}: {e}")
-        
-        # Try to close the connection
-        try:
-            connection.close()
-        except:
-            pass
+    if not isinstance(connection, PooledConnection):
+        logger.warning(f"Connection to {db_name} was not borrowed from a pool, closing it")
+    connection.close()
 
 def close_connection_pool(db_name: str) -> None:
     """
@@ -134,25 +681,7 @@ def close_connection_pool(db_name: str) -> None:
     Args:
         db_name: Database name
     """
-    if db_name not in _connection_pools:
-        logger.warning(f"No connection pool for {db_name}")
-        return
-    
-    # Close all connections
-    pool = _connection_pools[db_name]
-    closed_count = 0
-    
-    while not pool.empty():
-        try:
-            conn = pool.get_nowait()
-            conn.close()
-            closed_count += 1
-        except Exception as e:
-            logger.error(f"Error closing connection for {db_name}: {e}")
-    
-    # Remove the pool
-    del _connection_pools[db_name]
-    logger.info(f"Closed connection pool for {db_name}")
+    get_pool_manager().close_pool(db_name)
 
 def execute_query(db_name: str, query: str, params: Optional[Dict] = None, 
                   as_dict: bool = False, timeout: float = 30.0) -> Tuple[bool, Any, float]:
@@ -170,39 +699,25 @@ def execute_query(db_name: str, query: str, params: Optional[Dict] = None,
         Tuple of (success, results, execution_time)
         If success is False, results contains an error message
     """
-    connection = None
     try:
-        # Get connection from pool
-        connection = get_pool_connection(db_name)
-        if connection is None:
-            return False, "Failed to get connection from pool", 0
-        
-        # Create cursor (dict or tuple based)
-        cursor_type = RealDictCursor if as_dict else None
-        cursor = connection.cursor(cursor_factory=cursor_type)
-        
-        # Set statement timeout (milliseconds)
-        cursor.execute(f"SET statement_timeout = {int(timeout * 1000)}")
-        
-        # Measure execution time
-        start_time = time.time()
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        execution_time = time.time() - start_time
-        
-        # Clean up
-        cursor.close()
-        return_connection(db_name, connection)
+        # Borrow a connection with the statement timeout (milliseconds); it is rolled back when returned
+        with connection(db_name, agent="System", statement_timeout=int(timeout * 1000)) as conn:
+            # Create cursor (dict or tuple based)
+            cursor_type = RealDictCursor if as_dict else None
+            cursor = conn.cursor(cursor_factory=cursor_type)
+            
+            # Measure execution time
+            start_time = time.time()
+            cursor.execute(query, params)
+            results = cursor.fetchall()
+            execution_time = time.time() - start_time
+            get_metrics().observe("db_execution_seconds", execution_time, agent="System", db_id=db_name)
+            
+            # Clean up
+            cursor.close()
         
         return True, results, execution_time
-    except psycopg2.Error as e:
-        if connection:
-            connection.rollback()  # Roll back on error
-            return_connection(db_name, connection)
-        return False, str(e), 0
     except Exception as e:
-        if connection:
-            return_connection(db_name, connection)
         return False, str(e), 0
 
 def execute_and_compare_queries(db_name: str, pred_sql: str, gold_sql: str, 
@@ -350,20 +865,7 @@ def close_all_connection_pools():
     """
     Close all connection pools.
     """
-    logger = logging.getLogger(__name__)
-    
-    # Get all database IDs with open pools
-    db_ids = list(_connection_pools.keys())
-    
-    # Close each pool
-    for db_id in db_ids:
-        try:
-            close_connection_pool(db_id)
-        except Exception as e:
-            logger.error(f"Error closing connection pool for database {db_id}: {e}")
-    
-    # Clear the pools dictionary
-    _connection_pools.clear()
+    get_pool_manager().close_all()
 
 if __name__ == "__main__":
     # Test connection functionality
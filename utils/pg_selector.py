@@ -2,6 +2,12 @@
 """
 PostgreSQL Selector for the BIRD-UKR dataset.
 Optimized for Ukrainian database schema handling.
+
+Configuration (environment variables):
+    PG_SAMPLE_SOURCE: Where value examples come from: "stats" (default) reads the
+        planner statistics in pg_stats, "scan" reads the first rows of each column
+    PG_ANALYZE_MISSING_STATS: Set to 1 to ANALYZE tables without statistics once
+        per database before reading them (needs table ownership, default off)
 """
 
 import os
@@ -10,17 +16,124 @@ import json
 from typing import Dict, List, Any, Tuple, Optional
 import re
 
-import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
 # Import base Selector
 from core.agents import Selector, BaseAgent
 from core.const_ukr import selector_template_ukr, SELECTOR_NAME, DECOMPOSER_NAME
-from core.utils import parse_json
+from core.utils import parse_json, json_object_closed
 from core.api import call_llm
+from core import schema_index
+from core import join_graph
+from core.metrics import get_metrics
+from core.value_index import lookup_values, index_version
+from core.selector_cache import get_selector_cache, make_version, make_decision_key
+from utils.bird_ukr_loader import load_column_meaning
+from utils.pg_connection import connection
 
 logger = logging.getLogger(__name__)
 
+SELECTION_SYSTEM_PROMPT = "You are a database schema expert that helps identify relevant tables and columns needed to answer specific questions."
+
+# Relation kinds listed like information_schema.tables: tables, partitioned tables, views, foreign tables
+SCHEMA_RELKINDS = "('r', 'p', 'v', 'f')"
+
+# Hash of the catalog rows behind the public schema. Any change of a table,
+# column, primary or foreign key changes it, as does a table rewrite (TRUNCATE,
+# VACUUM FULL, ALTER COLUMN TYPE) through relfilenode. Plain INSERTs do not, so
+# cached sample values may lag behind the data.
+SCHEMA_FINGERPRINT_SQL = f"""
+    SELECT md5(coalesce(string_agg(item, ',' ORDER BY item), ''))
+    FROM (
+        SELECT 'r' || c.oid || ':' || c.relname || ':' || c.relkind || ':' || c.relfilenode AS item
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN {SCHEMA_RELKINDS}
+        UNION ALL
+        SELECT 'a' || a.attrelid || ':' || a.attnum || ':' || a.attname || ':' || a.atttypid
+               || ':' || a.attnotnull || ':' || a.atthasdef
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN {SCHEMA_RELKINDS}
+          AND a.attnum > 0 AND NOT a.attisdropped
+        UNION ALL
+        SELECT 'k' || con.oid || ':' || con.contype || ':' || con.conrelid || ':' || con.confrelid
+               || ':' || con.conkey::text || ':' || coalesce(con.confkey::text, '')
+        FROM pg_constraint con
+        JOIN pg_namespace n ON n.oid = con.connamespace
+        WHERE n.nspname = 'public' AND con.contype IN ('p', 'f')
+    ) items
+"""
+
+# All columns of all public tables in one pass. data_type follows
+# information_schema.columns (base type of domains, ARRAY, USER-DEFINED).
+SCHEMA_COLUMNS_SQL = f"""
+    SELECT c.relname AS table_name,
+           a.attname AS column_name,
+           CASE
+               WHEN t.typtype = 'd' THEN format_type(t.typbasetype, NULL)
+               WHEN t.typcategory = 'A' THEN 'ARRAY'
+               WHEN t.typtype IN ('e', 'c') OR tn.nspname <> 'pg_catalog' THEN 'USER-DEFINED'
+               ELSE format_type(a.atttypid, NULL)
+           END AS data_type,
+           NOT a.attnotnull AS is_nullable,
+           pg_get_expr(d.adbin, d.adrelid) AS column_default,
+           coalesce(a.attnum = ANY (pk.conkey), false) AS is_primary
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_namespace tn ON tn.oid = t.typnamespace
+    LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+    LEFT JOIN pg_constraint pk ON pk.conrelid = c.oid AND pk.contype = 'p'
+    WHERE n.nspname = 'public' AND c.relkind IN {SCHEMA_RELKINDS}
+    ORDER BY c.relname, a.attnum
+"""
+
+# One row per column pair of every foreign key (composite keys stay paired)
+SCHEMA_FOREIGN_KEYS_SQL = """
+    SELECT src.relname AS source_table,
+           sa.attname AS source_column,
+           dst.relname AS target_table,
+           da.attname AS target_column,
+           con.conname AS constraint_name
+    FROM pg_constraint con
+    JOIN pg_class src ON src.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = src.relnamespace
+    JOIN pg_class dst ON dst.oid = con.confrelid
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(source_attnum, target_attnum)
+    JOIN pg_attribute sa ON sa.attrelid = con.conrelid AND sa.attnum = k.source_attnum
+    JOIN pg_attribute da ON da.attrelid = con.confrelid AND da.attnum = k.target_attnum
+    WHERE con.contype = 'f' AND n.nspname = 'public'
+    ORDER BY src.relname, sa.attname
+"""
+
+# Planner statistics of all public columns. The anyarray columns are cast
+# through text so values of any type come back as a text[].
+SCHEMA_STATS_SQL = """
+    SELECT s.tablename, s.attname, s.null_frac, s.n_distinct,
+           s.most_common_vals::text::text[], s.histogram_bounds::text::text[]
+    FROM pg_stats s
+    WHERE s.schemaname = 'public'
+    ORDER BY s.inherited
+"""
+
+# Kind and size of the public relations, to choose the sampling method
+SCHEMA_RELATIONS_SQL = f"""
+    SELECT c.relname, c.relkind, c.relpages
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN {SCHEMA_RELKINDS}
+"""
+
+# Sample values per column and columns per sampling statement
+SAMPLE_LIMIT = 5
+SAMPLE_BATCH_COLUMNS = 200
+# Pages read by TABLESAMPLE SYSTEM for columns without statistics
+SAMPLE_PAGES = 100
+
 class PostgreSQLSelector(BaseAgent):
     """
     Smart PostgreSQL Selector optimized for BIRD-UKR dataset.
@@ -44,14 +157,18 @@ class PostgreSQLSelector(BaseAgent):
         self.model_name = model_name
         self.dataset_name = dataset_name
         
-        # Get PostgreSQL credentials from environment
-        self.pg_user = os.environ.get('PG_USER', 'postgres')
-        self.pg_password = os.environ.get('PG_PASSWORD', '')
-        self.pg_host = os.environ.get('PG_HOST', 'localhost')
-        self.pg_port = os.environ.get('PG_PORT', '5432')
-        
         # Cache for database schema information
         self.schema_cache = {}
+        self.sample_source = os.environ.get('PG_SAMPLE_SOURCE', 'stats').lower()
+        self.analyze_missing_stats = os.environ.get('PG_ANALYZE_MISSING_STATS', '0').lower() in ('1', 'true', 'yes', 'on')
+        # Databases already analyzed by this Selector
+        self.analyzed_dbs = set()
+        
+        # Lexical schema index per database (SCHEMA_INDEX=1)
+        self.schema_indexes = {}
+        # Foreign key join graph per database (SELECTOR_JOIN_PATHS=1)
+        self.join_graphs = {}
+        self.column_meanings = None
         
         logger.info("Initialized PostgreSQL Selector")
         
@@ -94,6 +211,15 @@ class PostgreSQLSelector(BaseAgent):
             message["send_to"] = DECOMPOSER_NAME
             return message
         
+        # Link literal values quoted in the question to their columns, so the
+        # canonical spelling shows up among the column's sample values
+        value_matches = lookup_values(db_id, query)
+        if value_matches:
+            logger.info(f"Value matches: {value_matches}")
+            message["value_matches"] = [m.to_dict() for m in value_matches]
+            schema_info = self.add_value_samples(schema_info, value_matches)
+        value_tables = [m.table for m in value_matches]
+        
         # Format full schema descriptions
         desc_str, fk_str = self.format_schema(schema_info)
         
@@ -102,12 +228,49 @@ class PostgreSQLSelector(BaseAgent):
         logger.debug(f"Schema:\n{desc_str}")
         logger.debug(f"Foreign keys:\n{fk_str}")
         
+        # Rank tables lexically first: a confident pick needs no LLM call,
+        # otherwise the LLM only sees the candidate tables
+        prompt_desc_str, prompt_fk_str = desc_str, fk_str
+        if schema_index.is_enabled():
+            index = self.get_schema_index(db_id, schema_info)
+            match = index.search(query, evidence or "", max_tables=schema_index.max_tables())
+            message["schema_index"] = match.to_dict()
+            if match.selected and match.confidence >= schema_index.skip_confidence():
+                selected_tables = self.connect_tables(db_id, schema_info, index.with_neighbours(list(dict.fromkeys(match.selected + value_tables))), message)
+                logger.info(f"Schema index picked {selected_tables} (confidence {match.confidence:.2f}), skipping LLM selection")
+                get_metrics().inc("selector_index_total", outcome="skip", db_id=db_id)
+                message["desc_str"], message["fk_str"] = self.format_schema(self.filter_schema(schema_info, selected_tables))
+                message["send_to"] = DECOMPOSER_NAME
+                return message
+            candidates = index.with_neighbours(list(dict.fromkeys(match.candidates(schema_index.max_tables()) + value_tables)))
+            if 0 < len(candidates) < len(schema_info["tables"]):
+                logger.info(f"Schema index candidates: {candidates} (confidence {match.confidence:.2f})")
+                prompt_desc_str, prompt_fk_str = self.format_schema(self.filter_schema(schema_info, candidates))
+                get_metrics().inc("selector_index_total", outcome="candidates", db_id=db_id)
+            else:
+                get_metrics().inc("selector_index_total", outcome="full", db_id=db_id)
+        
+        # Reuse the table selection of an earlier run (SELECTOR_CACHE_DIR)
+        cache = get_selector_cache()
+        if cache is not None:
+            version = self.decision_version(schema_info, db_id)
+            cache_key = make_decision_key(version, db_id, query, evidence)
+            cached = cache.get(cache_key)
+            get_metrics().inc("selector_cache_total", outcome="miss" if cached is None else "hit", db_id=db_id)
+            if cached is not None:
+                logger.info(f"Cached selection for {db_id}: {cached['selected_tables']}")
+                selected_tables = self.connect_tables(db_id, schema_info, cached["selected_tables"], message)
+                message["desc_str"], message["fk_str"] = self.format_schema(self.filter_schema(schema_info, selected_tables))
+                message["selection_explanation"] = cached.get("explanation", "")
+                message["send_to"] = DECOMPOSER_NAME
+                return message
+        
         # Now use the LLM to select relevant tables and columns based on the question
         selection_prompt = selector_template_ukr.format(
             question=query,
             db_id=db_id,
-            desc_str=desc_str,
-            fk_str=fk_str,
+            desc_str=prompt_desc_str,
+            fk_str=prompt_fk_str,
             evidence=evidence
         )
         
@@ -115,9 +278,10 @@ class PostgreSQLSelector(BaseAgent):
         selection_response = call_llm(
             model_name=self.model_name,
             messages=[
-                {"role": "system", "content": "You are a database schema expert that helps identify relevant tables and columns needed to answer specific questions."},
+                {"role": "system", "content": SELECTION_SYSTEM_PROMPT},
                 {"role": "user", "content": selection_prompt}
-            ]
+            ],
+            stop_when=json_object_closed
         )
         
         # Extract selected tables and columns from response
@@ -180,21 +344,12 @@ class PostgreSQLSelector(BaseAgent):
             # Explanation may or may not be present
             explanation = selection_data.get("explanation", "")
             
-            # Filter schema to only include selected tables
-            selected_schema = {"tables": {}, "foreign_keys": []}
-            
-            for table in selected_tables:
-                if table in schema_info["tables"]:
-                    selected_schema["tables"][table] = schema_info["tables"][table]
-            
-            # Include relevant foreign keys
-            for fk in schema_info["foreign_keys"]:
-                if (fk["source_table"] in selected_tables and 
-                    fk["target_table"] in selected_tables):
-                    selected_schema["foreign_keys"].append(fk)
+            if cache is not None and selected_tables:
+                cache.put(cache_key, version, db_id, query, {"selected_tables": selected_tables, "explanation": explanation})
             
-            # Format selected schema
-            selected_desc_str, selected_fk_str = self.format_schema(selected_schema)
+            # Filter schema to only include selected tables (and the tables joining them) and format it
+            selected_tables = self.connect_tables(db_id, schema_info, selected_tables, message)
+            selected_desc_str, selected_fk_str = self.format_schema(self.filter_schema(schema_info, selected_tables))
             
             # Log final selected schema
             logger.info(f"Selected tables: {selected_tables}")
@@ -223,124 +378,405 @@ class PostgreSQLSelector(BaseAgent):
         message["send_to"] = DECOMPOSER_NAME
         return message
     
-    def get_schema(self, db_id: str) -> Dict[str, Any]:
+    def get_schema_index(self, db_id: str, schema_info: Dict[str, Any]) -> schema_index.SchemaIndex:
         """
-        Get schema information for a PostgreSQL database.
+        Get the lexical schema index of a database, building it on first use.
         
         Args:
             db_id: Database ID
+            schema_info: Schema information from get_schema
             
         Returns:
-            Dictionary with schema information
+            SchemaIndex over tables, columns, column meanings and sample values
         """
-        # Create a new connection to the database
-        try:
-            conn = psycopg2.connect(
-                host=self.pg_host,
-                port=self.pg_port,
-                user=self.pg_user,
-                password=self.pg_password,
-                dbname=db_id
-            )
+        if db_id not in self.schema_indexes:
+            if self.column_meanings is None:
+                self.column_meanings = load_column_meaning(self.data_path)
+            meanings = schema_index.column_meanings_for_db(self.column_meanings, db_id)
+            self.schema_indexes[db_id] = schema_index.build_index_from_pg_schema(schema_info, meanings)
+        return self.schema_indexes[db_id]
+    
+    def connect_tables(self, db_id: str, schema_info: Dict[str, Any], tables: List[str],
+                       message: Dict[str, Any]) -> List[str]:
+        """
+        Add the bridge tables needed to join the selected tables (SELECTOR_JOIN_PATHS=1).
+        
+        Args:
+            db_id: Database ID
+            schema_info: Schema information from get_schema
+            tables: Selected tables
+            message: Message that receives the join plan
             
-            # Create cursor for executing queries
-            cursor = conn.cursor()
+        Returns:
+            The selected tables followed by the bridge tables
+        """
+        if not join_graph.is_enabled() or len(tables) < 2:
+            return tables
+        if db_id not in self.join_graphs:
+            self.join_graphs[db_id] = join_graph.build_join_graph_from_pg_schema(schema_info)
+        plan = self.join_graphs[db_id].connect(tables)
+        message["join_plan"] = plan.to_dict()
+        if plan.bridges:
+            logger.info(f"Join bridges for {tables}: {plan.bridges}")
+        return list(tables) + plan.bridges
+    
+    def decision_version(self, schema_info: Dict[str, Any], db_id: str) -> str:
+        """
+        Version of the cached table selections of a database.
+        
+        Args:
+            schema_info: Schema information from get_schema
+            db_id: Database identifier, for its value index
             
-            # Get list of tables
-            cursor.execute("""
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public'
-                ORDER BY table_name;
-            """)
-            tables = [row[0] for row in cursor.fetchall()]
+        Returns:
+            Version hash of prompt template, model, tables, selection settings and value index
+        """
+        tables = {table: [col["name"] for col in columns] for table, columns in schema_info["tables"].items()}
+        # Linked values change the prompt, so a rebuilt or removed index invalidates the selections
+        return make_version(selector_template_ukr, SELECTION_SYSTEM_PROMPT, self.model_name, type(self).__name__,
+                            json.dumps(tables, sort_keys=True, ensure_ascii=False),
+                            schema_index.is_enabled(), schema_index.max_tables(), schema_index.skip_confidence(),
+                            index_version(db_id))
+    
+    def add_value_samples(self, schema_info: Dict[str, Any], value_matches: List[Any]) -> Dict[str, Any]:
+        """
+        Put values linked from the question first among their columns' samples.
+        
+        Args:
+            schema_info: Schema information from get_schema (not modified)
+            value_matches: Matches from core.value_index
+            
+        Returns:
+            Schema information with the linked values in the samples
+        """
+        tables = dict(schema_info["tables"])
+        for m in value_matches:
+            if m.table not in tables:
+                continue
+            columns = []
+            for col in tables[m.table]:
+                if col["name"] == m.column and m.value not in col["samples"]:
+                    col = dict(col, samples=[m.value] + col["samples"])
+                columns.append(col)
+            tables[m.table] = columns
+        return dict(schema_info, tables=tables)
+    
+    def filter_schema(self, schema_info: Dict[str, Any], tables: List[str]) -> Dict[str, Any]:
+        """
+        Restrict schema information to some tables and the foreign keys between them.
+        
+        Args:
+            schema_info: Schema information from get_schema
+            tables: Tables to keep
             
-            schema_info = {"tables": {}}
+        Returns:
+            Schema information in the same format
+        """
+        selected_schema = {"tables": {}, "foreign_keys": []}
+        
+        for table in tables:
+            if table in schema_info["tables"]:
+                selected_schema["tables"][table] = schema_info["tables"][table]
+        
+        # Include relevant foreign keys
+        for fk in schema_info["foreign_keys"]:
+            if fk["source_table"] in tables and fk["target_table"] in tables:
+                selected_schema["foreign_keys"].append(fk)
+        
+        return selected_schema
+    
+    def get_schema(self, db_id: str) -> Dict[str, Any]:
+        """
+        Get schema information for a PostgreSQL database.
+        
+        The schema is read with a few bulk pg_catalog queries and cached per
+        database. Each call only compares the catalog fingerprint; the schema
+        is read again when tables, columns or keys have changed.
+        
+        Args:
+            db_id: Database ID
             
-            # Get columns for each table
-            for table in tables:
-                cursor.execute("""
-                    SELECT column_name, data_type, 
-                           is_nullable, column_default,
-                           (SELECT EXISTS (
-                               SELECT 1 FROM information_schema.table_constraints tc
-                               INNER JOIN information_schema.constraint_column_usage ccu 
-                               ON tc.constraint_name = ccu.constraint_name
-                               WHERE tc.constraint_type = 'PRIMARY KEY' 
-                               AND tc.table_name = c.table_name
-                               AND ccu.column_name = c.column_name
-                           )) as is_primary
-                    FROM information_schema.columns c
-                    WHERE table_name = %s AND table_schema = 'public'
-                    ORDER BY ordinal_position;
-                """, (table,))
+        Returns:
+            Dictionary with schema information
+        """
+        try:
+            # Borrow a pooled connection; it is rolled back when returned
+            with connection(db_id, agent=self.name) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SCHEMA_FINGERPRINT_SQL)
+                fingerprint = cursor.fetchone()[0]
                 
-                columns = []
-                for col in cursor.fetchall():
-                    column_name, data_type, is_nullable, default, is_primary = col
-                    
-                    # Get sample values for this column (up to 5)
-                    try:
-                        cursor.execute(f"""
-                            SELECT "{column_name}" 
-                            FROM "{table}" 
-                            WHERE "{column_name}" IS NOT NULL 
-                            LIMIT 5
-                        """)
-                        sample_values = [str(val[0]) for val in cursor.fetchall()]
-                    except Exception as e:
-                        # If error getting samples, provide empty list
-                        sample_values = []
-                    
-                    columns.append({
-                        "name": column_name,
-                        "type": data_type,
-                        "nullable": is_nullable == "YES",
-                        "default": default,
-                        "primary": is_primary,
-                        "samples": sample_values
-                    })
+                cached = self.schema_cache.get(db_id)
+                if cached is not None and cached[0] == fingerprint:
+                    get_metrics().inc("selector_schema_cache_total", outcome="hit", db_id=db_id)
+                    return cached[1]
                 
-                schema_info["tables"][table] = columns
+                if cached is not None:
+                    # Derived structures were built from the old schema
+                    logger.info(f"Schema of {db_id} changed, reloading")
+                    self.schema_indexes.pop(db_id, None)
+                    self.join_graphs.pop(db_id, None)
+                get_metrics().inc("selector_schema_cache_total", outcome="changed" if cached is not None else "miss", db_id=db_id)
+                
+                schema_info = self._load_schema(db_id, conn, cursor)
+                cursor.close()
+            self.schema_cache[db_id] = (fingerprint, schema_info)
+            return schema_info
             
-            # Get foreign keys
-            cursor.execute("""
-                SELECT
-                    tc.table_name AS source_table, 
-                    kcu.column_name AS source_column,
-                    ccu.table_name AS target_table,
-                    ccu.column_name AS target_column
-                FROM information_schema.table_constraints tc
-                JOIN information_schema.key_column_usage kcu
-                  ON tc.constraint_name = kcu.constraint_name
-                JOIN information_schema.constraint_column_usage ccu
-                  ON ccu.constraint_name = tc.constraint_name
-                WHERE tc.constraint_type = 'FOREIGN KEY'
-                AND tc.table_schema = 'public'
-                ORDER BY tc.table_name, kcu.column_name;
-            """)
+        except Exception as e:
+            logger.error(f"Error getting schema for {db_id}: {e}")
+            return {"tables": {}, "foreign_keys": []}
+    
+    def _load_schema(self, db_id: str, conn, cursor) -> Dict[str, Any]:
+        """
+        Read tables, columns, primary keys, foreign keys and sample values.
+        
+        Args:
+            db_id: Database ID
+            conn: Open connection to the database
+            cursor: Cursor of the connection
             
-            foreign_keys = []
-            for row in cursor.fetchall():
-                source_table, source_column, target_table, target_column = row
-                foreign_keys.append({
-                    "source_table": source_table,
-                    "source_column": source_column,
-                    "target_table": target_table,
-                    "target_column": target_column
-                })
+        Returns:
+            Dictionary with schema information
+        """
+        schema_info = {"tables": {}}
+        cursor.execute(SCHEMA_COLUMNS_SQL)
+        for table, column_name, data_type, is_nullable, default, is_primary in cursor.fetchall():
+            columns = schema_info["tables"].setdefault(table, [])
+            if column_name is None:
+                # Table without columns
+                continue
+            columns.append({
+                "name": column_name,
+                "type": data_type,
+                "nullable": is_nullable,
+                "default": default,
+                "primary": is_primary,
+                "samples": [],
+                "null_frac": None,
+                "n_distinct": None
+            })
+        
+        cursor.execute(SCHEMA_FOREIGN_KEYS_SQL)
+        schema_info["foreign_keys"] = [
+            {
+                "source_table": source_table,
+                "source_column": source_column,
+                "target_table": target_table,
+                "target_column": target_column,
+                # Column pairs of a composite key share the constraint name
+                "constraint": f"{source_table}.{constraint_name}"
+            }
+            for source_table, source_column, target_table, target_column, constraint_name in cursor.fetchall()
+        ]
+        
+        columns = [(table, col) for table, cols in schema_info["tables"].items() for col in cols]
+        if self.sample_source == "scan":
+            self._load_samples(conn, cursor, columns)
+        else:
+            self._load_stats_samples(db_id, conn, cursor, columns)
+        return schema_info
+    
+    def _load_stats_samples(self, db_id: str, conn, cursor, columns: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        Fill in value examples from the planner statistics (pg_stats).
+        
+        Examples are the most common values, most common first, topped up
+        with values spread over the histogram bounds. Statistics also give
+        each column's null_frac and n_distinct. Only columns without
+        statistics are read from the table, with TABLESAMPLE SYSTEM on
+        large tables; columns that are entirely NULL keep no examples.
+        
+        Args:
+            db_id: Database ID
+            conn: Open connection to the database
+            cursor: Cursor of the connection
+            columns: (table, column info) pairs to update in place
+        """
+        stats = self._read_stats(cursor)
+        missing = self._apply_stats(columns, stats)
+        if not missing:
+            return
+        
+        cursor.execute(SCHEMA_RELATIONS_SQL)
+        relations = {table: (relkind, relpages) for table, relkind, relpages in cursor.fetchall()}
+        if self.analyze_missing_stats and db_id not in self.analyzed_dbs:
+            self.analyzed_dbs.add(db_id)
+            # Views and foreign tables have no statistics of their own
+            tables = list(dict.fromkeys(table for table, col in missing
+                                        if (table, col["name"]) not in stats and relations.get(table, ('',))[0] in ('r', 'p')))
+            if tables and self._analyze_tables(conn, cursor, tables):
+                stats = self._read_stats(cursor)
+                missing = self._apply_stats(missing, stats)
+                if not missing:
+                    return
+        
+        logger.debug(f"Sampling {len(missing)} columns without statistics")
+        percents = {}
+        for table, (relkind, relpages) in relations.items():
+            # Views and foreign tables cannot be sampled by page
+            if relkind in ('r', 'p') and relpages > SAMPLE_PAGES:
+                percents[table] = round(100.0 * SAMPLE_PAGES / relpages, 4)
+        self._load_samples(conn, cursor, missing, percents)
+        
+        # A sample of a large table can miss the values of a sparse column
+        sparse = [(table, col) for table, col in missing if table in percents and not col["samples"]]
+        if sparse:
+            self._load_samples(conn, cursor, sparse)
+    
+    def _apply_stats(self, columns: List[Tuple[str, Dict[str, Any]]],
+                     stats: Dict[Tuple[str, str], Tuple[float, float, Optional[List[str]], Optional[List[str]]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Set examples, null_frac and n_distinct of the columns with statistics.
+        
+        Args:
+            columns: (table, column info) pairs to update in place
+            stats: Result of _read_stats
             
-            schema_info["foreign_keys"] = foreign_keys
+        Returns:
+            The columns that still need to be sampled from their table
+        """
+        missing = []
+        for table, col in columns:
+            row = stats.get((table, col["name"]))
+            if row is None:
+                missing.append((table, col))
+                continue
+            null_frac, n_distinct, common_values, histogram = row
+            col["null_frac"] = null_frac
+            col["n_distinct"] = n_distinct
+            col["samples"] = self._stats_examples(common_values, histogram)
+            if not col["samples"] and null_frac < 1:
+                # Statistics without values (e.g. types without ordering)
+                missing.append((table, col))
+        return missing
+    
+    def _read_stats(self, cursor) -> Dict[Tuple[str, str], Tuple[float, float, Optional[List[str]], Optional[List[str]]]]:
+        """
+        Read pg_stats of all public columns in one query.
+        
+        Args:
+            cursor: Database cursor
             
-            # Close cursor and connection
-            cursor.close()
-            conn.close()
+        Returns:
+            (table, column) -> (null_frac, n_distinct, most common values, histogram bounds)
+        """
+        cursor.execute(SCHEMA_STATS_SQL)
+        stats = {}
+        for table, column_name, null_frac, n_distinct, common_values, histogram in cursor.fetchall():
+            # Rows of the table itself come before rows including inheritance children
+            stats.setdefault((table, column_name), (null_frac, n_distinct, common_values, histogram))
+        return stats
+    
+    def _stats_examples(self, common_values: Optional[List[str]], histogram: Optional[List[str]]) -> List[str]:
+        """
+        Pick up to SAMPLE_LIMIT examples from a column's statistics.
+        
+        Args:
+            common_values: most_common_vals, most common first
+            histogram: histogram_bounds, sorted
             
-            return schema_info
+        Returns:
+            Distinct example values
+        """
+        examples = list(dict.fromkeys(common_values or []))[:SAMPLE_LIMIT]
+        if histogram and len(examples) < SAMPLE_LIMIT:
+            # Evenly spaced bounds cover the value range
+            step = max(1, (len(histogram) - 1) // (SAMPLE_LIMIT - 1))
+            for value in histogram[::step]:
+                if len(examples) >= SAMPLE_LIMIT:
+                    break
+                if value not in examples:
+                    examples.append(value)
+        return examples
+    
+    def _analyze_tables(self, conn, cursor, tables: List[str]) -> bool:
+        """
+        Collect planner statistics for some tables.
+        
+        Args:
+            conn: Open connection to the database
+            cursor: Cursor of the connection
+            tables: Tables to analyze
             
+        Returns:
+            True if ANALYZE ran
+        """
+        logger.info(f"Analyzing {len(tables)} tables without statistics")
+        try:
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.SQL(", ").join(sql.Identifier(t) for t in tables)))
+            conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"Error getting schema for {db_id}: {e}")
-            return {"tables": {}, "foreign_keys": []}
+            conn.rollback()
+            logger.warning(f"ANALYZE failed, sampling tables instead: {e}")
+            return False
+    
+    def _load_samples(self, conn, cursor, columns: List[Tuple[str, Dict[str, Any]]],
+                      percents: Optional[Dict[str, float]] = None) -> None:
+        """
+        Fill in up to SAMPLE_LIMIT non-null values per column from the tables.
+        
+        Columns are sampled SAMPLE_BATCH_COLUMNS at a time with one UNION ALL
+        statement. If a batch fails (e.g. no read permission on a table), its
+        columns are sampled one by one and failing columns keep no samples.
+        
+        Args:
+            conn: Open connection to the database
+            cursor: Cursor of the connection
+            columns: (table, column info) pairs to update in place
+            percents: Table -> TABLESAMPLE SYSTEM percentage; other tables are read from the start
+        """
+        for start in range(0, len(columns), SAMPLE_BATCH_COLUMNS):
+            batch = columns[start:start + SAMPLE_BATCH_COLUMNS]
+            try:
+                rows = self._fetch_samples(cursor, batch, percents)
+            except Exception as e:
+                conn.rollback()
+                logger.debug(f"Batched sampling failed, sampling columns one by one: {e}")
+                rows = []
+                for item in batch:
+                    try:
+                        rows.extend(self._fetch_samples(cursor, [item], percents))
+                    except Exception:
+                        # If error getting samples, provide empty list
+                        conn.rollback()
+            
+            samples = {}
+            for table, column_name, value in rows:
+                samples.setdefault((table, column_name), []).append(value)
+            for table, col in batch:
+                col["samples"] = samples.get((table, col["name"]), [])
+    
+    def _fetch_samples(self, cursor, columns: List[Tuple[str, Dict[str, Any]]],
+                       percents: Optional[Dict[str, float]] = None) -> List[Tuple[str, str, str]]:
+        """
+        Run one sampling statement over some columns.
+        
+        Args:
+            cursor: Database cursor
+            columns: (table, column info) pairs
+            percents: Table -> TABLESAMPLE SYSTEM percentage
+            
+        Returns:
+            (table, column, value as text) rows
+        """
+        percents = percents or {}
+        query = sql.SQL(" UNION ALL ").join(
+            sql.SQL("(SELECT {table_name}, {column_name}, {column}::text FROM {table}{sample} "
+                    "WHERE {column} IS NOT NULL LIMIT {limit})").format(
+                table_name=sql.Literal(table),
+                column_name=sql.Literal(col["name"]),
+                column=sql.Identifier(col["name"]),
+                table=sql.Identifier(table),
+                sample=sql.SQL(" TABLESAMPLE SYSTEM ({})").format(sql.Literal(percents[table]))
+                if table in percents else sql.SQL(""),
+                limit=sql.Literal(SAMPLE_LIMIT)
+            )
+            for table, col in columns
+        )
+        cursor.execute(query)
+        return cursor.fetchall()
     
     def format_schema(self, schema_info: Dict[str, Any]) -> Tuple[str, str]:
         """